@@ -0,0 +1,296 @@
+"""
+End-to-end benchmarks of CompletionAgent and StreamingAgent against the local fake OpenAI server.
+
+Measures the library's own overhead per ask: CPU time of the calling thread (library + OpenAI client), time to
+first token minus the latency injected by the server, throughput with concurrent agents, and peak memory.
+
+    python -m benchmarks.bench_e2e --asks 50 --latency 0.05 --tokens-per-second 200 --output e2e.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Literal
+
+from benchmarks.common import environment, print_table, summarize, write_results
+from nimbusagent.agent.base import BaseAgent
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.streaming import StreamingAgent
+
+QUERIES = [
+    "What's the weather like in Minneapolis today?",
+    "Will it rain in Paris this weekend?",
+    "What's the forecast for Tokyo for the next three days?",
+    "Are there any weather alerts for Miami?",
+]
+
+
+def get_current_weather(
+    location: str, unit: Literal["celsius", "fahrenheit"] = "fahrenheit"
+) -> dict[str, Any]:
+    """
+    Get the current weather in a given location
+    :param location: The city and state, e.g. San Francisco, CA
+    :param unit: The unit to return the temperature in, either celsius or fahrenheit
+    """
+    return {
+        "content": json.dumps({"location": location, "temperature": 21, "unit": unit})
+    }
+
+
+def get_forecast(location: str, days: int) -> dict[str, Any]:
+    """
+    Get the daily weather forecast for a given location
+    :param location: The city and state, e.g. San Francisco, CA
+    :param days: The number of days to forecast
+    """
+    forecast = [{"day": day, "high": 24, "low": 12} for day in range(days)]
+    return {"content": json.dumps({"location": location, "forecast": forecast})}
+
+
+def get_alerts(location: str) -> dict[str, Any]:
+    """
+    Get the active weather alerts for a given location
+    :param location: The city and state, e.g. San Francisco, CA
+    """
+    return {"content": json.dumps({"location": location, "alerts": []})}
+
+
+FUNCTIONS = [get_current_weather, get_forecast, get_alerts]
+PATTERN_GROUPS = [
+    {
+        "pattern": r"(?i)weather|rain|forecast",
+        "functions": ["get_current_weather", "get_forecast"],
+    },
+    {"pattern": r"(?i)alert", "functions": ["get_alerts"]},
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(latency: float, tokens_per_second: float | None):
+    """
+    Start the fake OpenAI server in a subprocess, so its CPU time is not counted against the library.
+    :return:  The server process and its base URL.
+    """
+    port = _free_port()
+    command = [
+        sys.executable,
+        "-m",
+        "nimbusagent.testing.fake_openai",
+        "--port",
+        str(port),
+        "--latency",
+        str(latency),
+    ]
+    if tokens_per_second:
+        command += ["--tokens-per-second", str(tokens_per_second)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("The fake OpenAI server did not start")
+
+
+def run_ask(agent: BaseAgent, query: str) -> dict[str, Any]:
+    """
+    Run one ask and measure it.
+    :return:  The wall time, CPU time and time to first token (streaming only) of the ask, in seconds.
+    """
+    ttft = None
+    start_cpu = time.thread_time()
+    start = time.perf_counter()
+    if isinstance(agent, StreamingAgent):
+        for chunk in agent.ask(query):
+            if chunk and ttft is None:
+                ttft = time.perf_counter() - start
+    else:
+        agent.ask(query)
+    return {
+        "wall": time.perf_counter() - start,
+        "cpu": time.thread_time() - start_cpu,
+        "ttft": ttft,
+    }
+
+
+def requests_before_content(agent: BaseAgent) -> int:
+    """
+    Count the requests made before the first content arrived, each of which waited for the injected latency.
+    """
+    stats = agent.get_last_stats()
+    return (
+        stats.loop_count
+        + (1 if stats.moderation_time else 0)
+        + (1 if stats.embedding_time else 0)
+    )
+
+
+def bench_scenario(
+    make_agent: Callable[[], BaseAgent],
+    asks: int,
+    warmup: int,
+    latency: float,
+    concurrency: int,
+    memory_asks: int,
+) -> dict[str, Any]:
+    """
+    Benchmark one agent configuration.
+    :return:  The results of the scenario.
+    """
+    agent = make_agent()
+    for i in range(warmup):
+        run_ask(agent, QUERIES[i % len(QUERIES)])
+
+    walls, cpus, ttfts, overheads = [], [], [], []
+    loops, tool_calls = 0, 0
+    for i in range(asks):
+        measurement = run_ask(agent, QUERIES[i % len(QUERIES)])
+        walls.append(measurement["wall"])
+        cpus.append(measurement["cpu"])
+        if measurement["ttft"] is not None:
+            ttfts.append(measurement["ttft"])
+            overheads.append(
+                measurement["ttft"] - latency * requests_before_content(agent)
+            )
+        loops += agent.get_last_stats().loop_count
+        tool_calls += len(agent.get_last_stats().tool_calls)
+
+    results: dict[str, Any] = {
+        "asks": asks,
+        "loops_per_ask": loops / asks if asks else 0,
+        "tool_calls_per_ask": tool_calls / asks if asks else 0,
+        "wall_ms": summarize(walls, 1000),
+        "cpu_ms": summarize(cpus, 1000),
+    }
+    if ttfts:
+        results["ttft_ms"] = summarize(ttfts, 1000)
+        results["ttft_overhead_ms"] = summarize(overheads, 1000)
+
+    results["throughput_asks_per_second"] = _throughput(make_agent, asks, concurrency)
+    results["peak_memory_kib"] = _peak_memory(agent, memory_asks)
+    return results
+
+
+def _throughput(
+    make_agent: Callable[[], BaseAgent], asks: int, concurrency: int
+) -> float:
+    """Run asks across concurrent agents, one per thread, and return the asks per second."""
+    local = threading.local()
+
+    def ask(i: int) -> None:
+        if not hasattr(local, "agent"):
+            local.agent = make_agent()
+        run_ask(local.agent, QUERIES[i % len(QUERIES)])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(ask, range(asks)))
+    return asks / (time.perf_counter() - start)
+
+
+def _peak_memory(agent: BaseAgent, memory_asks: int) -> dict[str, float]:
+    """Return the peak traced memory of single asks, in KiB."""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(memory_asks):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            run_ask(agent, QUERIES[i % len(QUERIES)])
+            peaks.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024)
+    finally:
+        tracemalloc.stop()
+    return summarize(peaks)
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--asks", type=int, default=50)
+    arg_parser.add_argument("--warmup", type=int, default=3)
+    arg_parser.add_argument("--latency", type=float, default=0.0)
+    arg_parser.add_argument("--tokens-per-second", type=float, default=None)
+    arg_parser.add_argument("--concurrency", type=int, default=4)
+    arg_parser.add_argument("--memory-asks", type=int, default=5)
+    arg_parser.add_argument(
+        "--scenario", action="append", help="only run the named scenario(s)"
+    )
+    arg_parser.add_argument("--output", help="write the results as JSON to this file")
+    args = arg_parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+    process, base_url = start_server(args.latency, args.tokens_per_second)
+
+    def agent_factory(agent_class, **kwargs):
+        return lambda: agent_class(openai_base_url=base_url, **kwargs)
+
+    tool_options = {"functions": FUNCTIONS, "functions_pattern_groups": PATTERN_GROUPS}
+    scenarios = {
+        "completion_chat": agent_factory(CompletionAgent),
+        "completion_tools": agent_factory(CompletionAgent, **tool_options),
+        "streaming_chat": agent_factory(StreamingAgent),
+        "streaming_tools": agent_factory(StreamingAgent, **tool_options),
+    }
+    if args.scenario:
+        scenarios = {name: scenarios[name] for name in args.scenario}
+
+    results: dict[str, Any] = {
+        "environment": environment(),
+        "config": {
+            "asks": args.asks,
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": {},
+    }
+    try:
+        for name, make_agent in scenarios.items():
+            results["scenarios"][name] = bench_scenario(
+                make_agent,
+                asks=args.asks,
+                warmup=args.warmup,
+                latency=args.latency,
+                concurrency=args.concurrency,
+                memory_asks=args.memory_asks,
+            )
+    finally:
+        process.terminate()
+        process.wait()
+
+    rows = [("scenario", "cpu p50 ms", "cpu p95 ms", "ttft overhead p50 ms", "asks/s")]
+    for name, result in results["scenarios"].items():
+        overhead = result.get("ttft_overhead_ms", {}).get("p50")
+        rows.append(
+            (
+                name,
+                f"{result['cpu_ms']['p50']:.2f}",
+                f"{result['cpu_ms']['p95']:.2f}",
+                f"{overhead:.2f}" if overhead is not None else "-",
+                f"{result['throughput_asks_per_second']:.1f}",
+            )
+        )
+    print_table(rows)
+
+    if args.output:
+        write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Import-time benchmark: the cold start cost of importing the library's entry points, each in a fresh interpreter.
+
+Reports the median wall time of each import over several runs (minus the time of an empty interpreter), the
+heaviest modules it pulls in according to `python -X importtime`, and whether any of the lazily imported modules
+(numpy, tiktoken) were loaded. Can fail on regressions against a baseline:
+
+    python -m benchmarks.bench_import --output import.json
+    python -m benchmarks.bench_import --baseline import.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any
+
+from benchmarks.common import (
+    environment,
+    find_regressions,
+    print_table,
+    summarize,
+    write_results,
+)
+from nimbusagent.utils.lazy import LAZY_MODULES
+
+ENTRY_POINTS = [
+    "nimbusagent.agent.completion",
+    "nimbusagent.agent.streaming",
+    "nimbusagent.agent.batch",
+    "nimbusagent.serve",
+]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code: str, importtime: bool = False) -> tuple[float, str]:
+    """
+    Run code in a fresh interpreter.
+    :param code:  The code to run.
+    :param importtime:  True to run with -X importtime.
+    :return:  The wall time in seconds and the standard error of the interpreter.
+    """
+    args = (
+        [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    )
+    start = time.perf_counter()
+    process = subprocess.run(args, cwd=ROOT, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, process.stderr
+
+
+def heaviest_modules(importtime_log: str, top: int) -> list[tuple[str, float]]:
+    """
+    Find the packages whose modules took the longest to import.
+    :param importtime_log:  The output of python -X importtime.
+    :param top:  The number of packages to return.
+    :return:  The packages and the total self time of their modules in milliseconds, heaviest first.
+    """
+    packages: dict[str, float] = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time, _, name = line[len("import time:") :].split("|")
+        if not self_time.strip().isdigit():
+            continue  # the header
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(self_time) / 1000
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def measure(module: str, repeat: int, baseline_time: float) -> dict[str, Any]:
+    """
+    Measure the import of a module.
+    :param module:  The module to import.
+    :param repeat:  The number of fresh interpreters to import it in.
+    :param baseline_time:  The wall time of an empty interpreter, in seconds.
+    :return:  The summary of the import time in milliseconds, the heaviest packages and the lazy modules loaded.
+    """
+    code = (
+        f"import sys, json, {module}; "
+        f"print(json.dumps([m for m in {list(LAZY_MODULES)!r} if m in sys.modules]), file=sys.stderr)"
+    )
+    times = []
+    for _ in range(repeat):
+        elapsed, _ = run_python(code)
+        times.append(max(elapsed - baseline_time, 0.0))
+    _, log = run_python(code, importtime=True)
+    return {
+        **summarize(times, 1000),
+        "heaviest": heaviest_modules(log, 3),
+        "lazy_loaded": json.loads(log.strip().splitlines()[-1]),
+    }
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--output", help="write the results as JSON to this file")
+    arg_parser.add_argument("--baseline", help="compare with the results in this file")
+    arg_parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed relative increase"
+    )
+    args = arg_parser.parse_args()
+
+    baseline_time = min(run_python("pass")[0] for _ in range(args.repeat))
+    results: dict[str, Any] = {
+        "environment": environment(),
+        "config": {"repeat": args.repeat},
+        "benchmarks": {},
+    }
+    rows = [("import", "p50 ms", "min ms", "heaviest", "lazy loaded")]
+    for module in ENTRY_POINTS:
+        result = measure(module, args.repeat, baseline_time)
+        results["benchmarks"][module] = result
+        rows.append(
+            (
+                module,
+                f"{result['p50']:.1f}",
+                f"{result['min']:.1f}",
+                ", ".join(f"{name} {ms:.0f}ms" for name, ms in result["heaviest"]),
+                ", ".join(result["lazy_loaded"]) or "-",
+            )
+        )
+    print_table(rows)
+
+    if args.output:
+        write_results(args.output, results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(
+            {name: result["p50"] for name, result in results["benchmarks"].items()},
+            {name: result["p50"] for name, result in baseline["benchmarks"].items()},
+            args.tolerance,
+        )
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
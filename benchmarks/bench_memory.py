@@ -0,0 +1,183 @@
+"""
+Memory benchmark: the bytes each live session of a SessionManager holds.
+
+Rehydrates many sessions from stored state (as a server does after evicting them) and measures the memory they hold
+with tracemalloc, next to the same histories kept as plain message dictionaries and token count lists for comparison.
+Reports the bytes per session, the overhead per message on top of its content, and the projected memory of 50k
+sessions. Can fail on regressions against a baseline:
+
+    python -m benchmarks.bench_memory --output memory.json
+    python -m benchmarks.bench_memory --baseline memory.json --tolerance 0.1
+"""
+
+import argparse
+import gc
+import json
+import random
+import sys
+import tracemalloc
+from typing import Any, Callable
+
+from benchmarks.common import environment, find_regressions, print_table, write_results
+from nimbusagent.agent.sessions import AgentSession
+from nimbusagent.memory.base import AgentMemory
+
+PROJECTED_SESSIONS = 50_000
+
+WORDS = (
+    "the weather in Paris is sunny with a high of 21 degrees and light winds from the west "
+    "will it rain tomorrow afternoon in Lyon or should I expect clear skies over the weekend"
+).split()
+
+
+def make_states(sessions: int, messages: int, words: int, seed: int = 0) -> list[str]:
+    """
+    Make the stored states of sessions, as JSON like a SessionStore keeps them.
+    :param sessions:  The number of sessions.
+    :param messages:  The number of messages of each session, alternating user and assistant.
+    :param words:  The number of words of each message.
+    :param seed:  The seed of the random content.
+    :return:  The states, as JSON.
+    """
+    rng = random.Random(seed)
+    states = []
+    for _ in range(sessions):
+        history = [
+            {
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": " ".join(rng.choice(WORDS) for _ in range(words)),
+            }
+            for i in range(messages)
+        ]
+        token_counts = [len(entry["content"].split()) for entry in history]
+        states.append(
+            json.dumps(
+                {"memory": {"chat_history": history, "token_counts": token_counts}}
+            )
+        )
+    return states
+
+
+def load_session(index: int, state: dict[str, Any]) -> AgentSession:
+    """Rehydrates a session the way SessionManager does."""
+    memory = AgentMemory(
+        max_tokens=10**9, max_messages=10**6, token_encoding="cl100k_base"
+    )
+    memory.load_state(state["memory"])
+    return AgentSession(f"session-{index}", memory)
+
+
+def load_dicts(index: int, state: dict[str, Any]) -> tuple[list, list]:
+    """Keeps the history as message dictionaries and a list of token counts, for comparison."""
+    return state["memory"]["chat_history"], list(state["memory"]["token_counts"])
+
+
+def measure(
+    states: list[str], load: Callable[[int, dict[str, Any]], Any], messages: int
+) -> dict[str, float]:
+    """
+    Measure the memory held by sessions.
+    :param states:  The stored states of the sessions, as JSON.
+    :param load:  The function that loads a session from its decoded state.
+    :param messages:  The number of messages of each session.
+    :return:  The bytes per session, the bytes of message content per session and the overhead per message.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        sessions = [load(i, json.loads(state)) for i, state in enumerate(states)]
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+    content = sum(
+        sys.getsizeof(entry["content"])
+        for state in states
+        for entry in json.loads(state)["memory"]["chat_history"]
+    )
+    del sessions
+    bytes_per_session = held / len(states)
+    content_per_session = content / len(states)
+    return {
+        "bytes_per_session": bytes_per_session,
+        "content_per_session": content_per_session,
+        "overhead_per_message": (bytes_per_session - content_per_session) / messages,
+    }
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--sessions", type=int, default=2000)
+    arg_parser.add_argument("--messages", type=int, default=20)
+    arg_parser.add_argument("--words", type=int, default=30)
+    arg_parser.add_argument("--output", help="write the results as JSON to this file")
+    arg_parser.add_argument("--baseline", help="compare with the results in this file")
+    arg_parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="allowed relative increase"
+    )
+    args = arg_parser.parse_args()
+
+    states = make_states(args.sessions, args.messages, args.words)
+    results: dict[str, Any] = {
+        "environment": environment(),
+        "config": {
+            "sessions": args.sessions,
+            "messages": args.messages,
+            "words": args.words,
+        },
+        "benchmarks": {
+            "sessions": measure(states, load_session, args.messages),
+            "plain_dicts": measure(states, load_dicts, args.messages),
+        },
+    }
+
+    rows = [
+        (
+            "layout",
+            "bytes/session",
+            "content bytes",
+            "overhead/message",
+            f"{PROJECTED_SESSIONS // 1000}k sessions",
+        )
+    ]
+    for name, result in results["benchmarks"].items():
+        rows.append(
+            (
+                name,
+                f"{result['bytes_per_session']:.0f}",
+                f"{result['content_per_session']:.0f}",
+                f"{result['overhead_per_message']:.1f}",
+                f"{result['bytes_per_session'] * PROJECTED_SESSIONS / 2**20:.0f} MiB",
+            )
+        )
+    print_table(rows)
+
+    if args.output:
+        write_results(args.output, results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(
+            {
+                name: result["bytes_per_session"]
+                for name, result in results["benchmarks"].items()
+            },
+            {
+                name: result["bytes_per_session"]
+                for name, result in baseline["benchmarks"].items()
+            },
+            args.tolerance,
+        )
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Microbenchmarks of the library's hot paths, without any network access.
+
+Reports the time per call in microseconds for function metadata parsing, embedding similarity, memory management,
+function routing over large catalogs, tool call results, agent construction and streaming delta assembly, and can fail
+on regressions against a baseline:
+
+    python -m benchmarks.bench_micro --output micro.json
+    python -m benchmarks.bench_micro --baseline micro.json --tolerance 0.15
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import random
+import sys
+import timeit
+from types import SimpleNamespace
+from typing import Any, Callable, Literal
+
+from openai.types.chat import ChatCompletionChunk
+
+from benchmarks.common import (
+    environment,
+    find_regressions,
+    print_table,
+    summarize,
+    write_results,
+)
+from nimbusagent.agent.blueprint import AgentBlueprint
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.functions import parser
+from nimbusagent.functions.handler import FunctionHandler
+from nimbusagent.memory.base import AgentMemory
+from nimbusagent.utils.helper import EmbeddingIndex, find_similar_embedding_list
+
+
+def get_weather(
+    location: str,
+    days: int = 1,
+    unit: Literal["celsius", "fahrenheit"] = "fahrenheit",
+    alerts: list[str] | None = None,
+) -> dict[str, Any]:
+    """
+    Get the weather forecast for a given location
+    :param location: The city and state, e.g. San Francisco, CA
+    :param days: The number of days to forecast
+    :param unit: The unit to return the temperature in, either celsius or fahrenheit
+    :param alerts: The types of alerts to include
+    """
+    return {"content": json.dumps({"location": location, "temperature": 21})}
+
+
+class WeatherTool:
+    """
+    Get the weather forecast for a given location
+    :param location: The city and state, e.g. San Francisco, CA
+    :param days: The number of days to forecast
+    """
+
+    @staticmethod
+    def call(location: str, days: int = 1) -> dict[str, Any]:
+        """
+        Get the weather forecast for a given location
+        :param location: The city and state, e.g. San Francisco, CA
+        :param days: The number of days to forecast
+        """
+        return get_weather(location, days)
+
+
+class PartialWeatherTool:
+    call = functools.partial(get_weather, unit="celsius")
+
+
+def make_catalog(size: int) -> list[Callable]:
+    """Create a catalog of distinct functions with the signature and docstring of get_weather."""
+    catalog = []
+    for i in range(size):
+
+        def tool(
+            location: str,
+            days: int = 1,
+            unit: Literal["celsius", "fahrenheit"] = "fahrenheit",
+            alerts: list[str] | None = None,
+        ) -> dict[str, Any]:
+            return get_weather(location, days, unit, alerts)
+
+        tool.__name__ = f"tool_{i}"
+        tool.__doc__ = f"Tool number {i}. " + (get_weather.__doc__ or "")
+        catalog.append(tool)
+    return catalog
+
+
+def random_vector(rng: random.Random, dimensions: int) -> list[float]:
+    return [rng.uniform(-1, 1) for _ in range(dimensions)]
+
+
+class StubClient:
+    """
+    Stands in for the OpenAI client: chat completions return scripted chunk streams in turn and embeddings return a
+    fixed vector, so only the library's own work is measured.
+    """
+
+    def __init__(
+        self, streams: list[list[ChatCompletionChunk]], embedding: list[float]
+    ):
+        scripts = itertools.cycle(streams)
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=lambda **kwargs: iter(next(scripts)))
+        )
+        response = SimpleNamespace(data=[SimpleNamespace(embedding=embedding)])
+        self.embeddings = SimpleNamespace(create=lambda **kwargs: response)
+
+    def with_options(self, **kwargs) -> "StubClient":
+        return self
+
+
+def _chunk(delta: dict[str, Any] | None, finish_reason: str | None = None, usage=None):
+    return ChatCompletionChunk.model_validate(
+        {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "gpt-4",
+            "choices": (
+                [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+                if delta is not None
+                else []
+            ),
+            "usage": usage,
+        }
+    )
+
+
+def content_stream(chunks: int) -> list[ChatCompletionChunk]:
+    """A streamed answer of the given number of content chunks."""
+    stream = [_chunk({"role": "assistant", "content": ""})]
+    stream += [_chunk({"content": f"word{i} "}) for i in range(chunks)]
+    stream.append(_chunk({}, "stop"))
+    stream.append(
+        _chunk(
+            None,
+            usage={
+                "prompt_tokens": 50,
+                "completion_tokens": chunks,
+                "total_tokens": 50 + chunks,
+            },
+        )
+    )
+    return stream
+
+
+def tool_call_stream(fragments: int) -> list[ChatCompletionChunk]:
+    """A streamed tool call whose arguments arrive in the given number of fragments."""
+    arguments = json.dumps({"location": "Minneapolis, MN " + "x" * fragments})
+    size = max(1, len(arguments) // fragments)
+    pieces = [arguments[i : i + size] for i in range(0, len(arguments), size)]
+    stream = [
+        _chunk(
+            {
+                "role": "assistant",
+                "tool_calls": [
+                    {
+                        "index": 0,
+                        "id": "call_0",
+                        "type": "function",
+                        "function": {"name": "get_weather", "arguments": ""},
+                    }
+                ],
+            }
+        )
+    ]
+    stream += [
+        _chunk({"tool_calls": [{"index": 0, "function": {"arguments": piece}}]})
+        for piece in pieces
+    ]
+    stream.append(_chunk({}, "tool_calls"))
+    return stream
+
+
+def build_benchmarks(dimensions: int) -> dict[str, Callable[[], Any]]:
+    """
+    Build the benchmarks.
+    :param dimensions:  The number of dimensions of the embeddings.
+    :return:  The benchmark callables by name.
+    """
+    rng = random.Random(0)
+    benchmarks: dict[str, Callable[[], Any]] = {
+        "func_metadata.function": lambda: parser.func_metadata(get_weather),
+        "func_metadata.class": lambda: parser.func_metadata(WeatherTool),
+        "func_metadata.partial": lambda: parser.func_metadata(PartialWeatherTool),
+    }
+
+    query_embedding = random_vector(rng, dimensions)
+    for size in (10, 100, 1000, 10000):
+        embeddings = [
+            {"name": f"tool_{i}", "embedding": random_vector(rng, dimensions)}
+            for i in range(size)
+        ]
+        benchmarks[f"find_similar_embedding_list.{size}"] = functools.partial(
+            find_similar_embedding_list,
+            "What's the weather?",
+            embeddings,
+            k_nearest_neighbors=3,
+            query_embedding=query_embedding,
+        )
+        benchmarks[f"embedding_index.search.{size}"] = functools.partial(
+            EmbeddingIndex(embeddings).search,
+            query_embedding,
+            k_nearest_neighbors=3,
+        )
+
+    history = [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"Message {i} about the weather in city number {i}.",
+        }
+        for i in range(2000)
+    ]
+    full_memory = AgentMemory(
+        max_tokens=10**9, max_messages=1000, token_encoding="cl100k_base"
+    )
+    full_memory.set_chat_history(history[:1000])
+    benchmarks["memory.add_entry.full_1000"] = lambda: full_memory.add_entry(
+        {"role": "user", "content": "What about tomorrow?"}
+    )
+
+    set_memory = AgentMemory(
+        max_tokens=10**9, max_messages=2000, token_encoding="cl100k_base"
+    )
+    benchmarks["memory.set_chat_history.2000"] = lambda: set_memory.set_chat_history(
+        history
+    )
+
+    trim_memory = AgentMemory(
+        max_tokens=10**9, max_messages=2000, token_encoding="cl100k_base"
+    )
+    trim_memory.set_chat_history(history)
+    trim_entries = trim_memory.entries.copy()
+    trim_counts = trim_memory.token_counts[:]
+    trim_tokens = trim_memory.num_tokens
+
+    def trim_excess_entries():
+        trim_memory.entries = trim_entries.copy()
+        trim_memory.token_counts = trim_counts[:]
+        trim_memory.num_tokens = trim_tokens
+        trim_memory.max_messages = 2000
+        trim_memory.max_tokens = trim_tokens // 2
+        trim_memory._trim_excess_entries()
+
+    benchmarks["memory._trim_excess_entries.2000_to_half"] = trim_excess_entries
+
+    client: Any = StubClient([], query_embedding)
+    for size in (50, 500):
+        catalog = make_catalog(size)
+        names = [func.__name__ for func in catalog]
+        all_handler = FunctionHandler(functions=catalog, max_tokens=0)
+        benchmarks[f"get_functions_from_query_and_history.all_{size}"] = (
+            functools.partial(
+                all_handler.get_functions_from_query_and_history,
+                "What's the weather?",
+                history[:4],
+            )
+        )
+        routed_handler = FunctionHandler(
+            functions=catalog,
+            embeddings=[
+                {"name": name, "embedding": random_vector(rng, dimensions)}
+                for name in names
+            ],
+            pattern_groups=[
+                {"pattern": r"(?i)weather", "functions": names[:5]},
+                {"pattern": r"(?i)alert", "functions": names[5:10]},
+            ],
+            always_use=names[:1],
+            k_nearest=3,
+            client=client,
+        )
+        benchmarks[f"get_functions_from_query_and_history.routed_{size}"] = (
+            functools.partial(
+                routed_handler.get_functions_from_query_and_history,
+                "What's the weather?",
+                history[:4],
+            )
+        )
+
+    tool_handler = FunctionHandler(functions=[get_weather])
+    tool_args = json.dumps({"location": "Minneapolis, MN", "days": 3})
+    benchmarks["handle_function_call.dict"] = functools.partial(
+        tool_handler.handle_function_call, "get_weather", tool_args
+    )
+    benchmarks["call_function.dict"] = functools.partial(
+        tool_handler.call_function, "get_weather", tool_args
+    )
+
+    agent_options = {
+        "client": client,
+        "functions": make_catalog(50),
+        "perform_moderation": False,
+    }
+    blueprint = AgentBlueprint(CompletionAgent, agent_options)
+    benchmarks["agent.construct.50_functions"] = lambda: CompletionAgent(
+        **agent_options
+    )
+    benchmarks["agent.blueprint.new_agent.50_functions"] = blueprint.new_agent
+
+    content_agent = StreamingAgent(
+        client=StubClient([content_stream(500)], query_embedding),
+        perform_moderation=False,
+    )
+    benchmarks["streaming.content_500_chunks"] = lambda: list(
+        content_agent.ask("What's the weather?")
+    )
+    coalesced_agent = StreamingAgent(
+        client=StubClient([content_stream(500)], query_embedding),
+        perform_moderation=False,
+        coalesce_max_bytes=256,
+        coalesce_on_boundary=True,
+    )
+    benchmarks["streaming.content_500_chunks.coalesced"] = lambda: list(
+        coalesced_agent.ask("What's the weather?")
+    )
+    tool_agent = StreamingAgent(
+        client=StubClient([tool_call_stream(200), content_stream(50)], query_embedding),
+        functions=[get_weather],
+        perform_moderation=False,
+    )
+    benchmarks["streaming.tool_call_200_fragments"] = lambda: list(
+        tool_agent.ask("What's the weather?")
+    )
+    return benchmarks
+
+
+def run_benchmark(func: Callable[[], Any], repeat: int) -> dict[str, float]:
+    """
+    Time a benchmark with timeit, scaling the number of calls per round to at least 0.2 seconds.
+    :return:  The summary of the time per call, in microseconds.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    rounds = timer.repeat(repeat=repeat, number=number)
+    return {"calls": number, **summarize([t / number for t in rounds], 1e6)}
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--dimensions", type=int, default=1536)
+    arg_parser.add_argument(
+        "--filter", action="append", help="only run benchmarks containing this text"
+    )
+    arg_parser.add_argument("--output", help="write the results as JSON to this file")
+    arg_parser.add_argument("--baseline", help="compare with the results in this file")
+    arg_parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="allowed relative increase"
+    )
+    args = arg_parser.parse_args()
+
+    benchmarks = build_benchmarks(args.dimensions)
+    if args.filter:
+        benchmarks = {
+            name: func
+            for name, func in benchmarks.items()
+            if any(text in name for text in args.filter)
+        }
+
+    results: dict[str, Any] = {
+        "environment": environment(),
+        "config": {"repeat": args.repeat, "dimensions": args.dimensions},
+        "benchmarks": {},
+    }
+    rows = [("benchmark", "p50 us", "min us", "calls")]
+    for name, func in benchmarks.items():
+        result = run_benchmark(func, args.repeat)
+        results["benchmarks"][name] = result
+        rows.append(
+            (name, f"{result['p50']:.2f}", f"{result['min']:.2f}", str(result["calls"]))
+        )
+    print_table(rows)
+
+    if args.output:
+        write_results(args.output, results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(
+            {name: result["p50"] for name, result in results["benchmarks"].items()},
+            {name: result["p50"] for name, result in baseline["benchmarks"].items()},
+            args.tolerance,
+        )
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Replay a recorded cassette through an agent and measure the library's overhead against identical inputs.
+
+Record a cassette once with `cassette_client(path, "record")`, then benchmark changes to chunk handling or function
+routing against it, optionally failing when CPU time regresses beyond a tolerance from a recorded baseline:
+
+    python -m benchmarks.bench_replay conversations.jsonl --agent streaming --output replay.json
+    python -m benchmarks.bench_replay conversations.jsonl --agent streaming --baseline replay.json
+"""
+
+import argparse
+import importlib
+import json
+import sys
+import time
+from typing import Any
+
+from benchmarks.common import (
+    environment,
+    find_regressions,
+    print_table,
+    summarize,
+    write_results,
+)
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.testing.cassette import cassette_client, cassette_queries
+
+AGENTS = {"completion": CompletionAgent, "streaming": StreamingAgent}
+
+
+def load_object(path: str) -> Any:
+    """
+    Load an object from a 'module:attribute' path, e.g. 'benchmarks.bench_e2e:FUNCTIONS'.
+    """
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("cassette", help="the JSONL cassette to replay")
+    arg_parser.add_argument("--agent", choices=sorted(AGENTS), default="streaming")
+    arg_parser.add_argument(
+        "--functions", help="'module:attribute' path of the functions the cassette used"
+    )
+    arg_parser.add_argument("--rounds", type=int, default=10)
+    arg_parser.add_argument("--warmup", type=int, default=1)
+    arg_parser.add_argument(
+        "--timing", choices=["collapse", "preserve"], default="collapse"
+    )
+    arg_parser.add_argument("--speed", type=float, default=1.0)
+    arg_parser.add_argument("--output", help="write the results as JSON to this file")
+    arg_parser.add_argument("--baseline", help="compare with the results in this file")
+    arg_parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="allowed relative CPU increase"
+    )
+    args = arg_parser.parse_args()
+
+    queries = cassette_queries(args.cassette)
+    if not queries:
+        sys.exit(f"No queries recorded in {args.cassette}")
+
+    client = cassette_client(
+        args.cassette, "replay", timing=args.timing, speed=args.speed, cycle=True
+    )
+    options: dict[str, Any] = {"client": client}
+    if args.functions:
+        options["functions"] = load_object(args.functions)
+
+    walls, cpus, ttfts = [], [], []
+    for round_number in range(args.warmup + args.rounds):
+        for query in queries:
+            agent = AGENTS[args.agent](**options)
+            start_cpu = time.thread_time()
+            start = time.perf_counter()
+            response = agent.ask(query)
+            if args.agent == "streaming":
+                for _ in response:
+                    pass
+            if round_number < args.warmup:
+                continue
+            walls.append(time.perf_counter() - start)
+            cpus.append(time.thread_time() - start_cpu)
+            if agent.get_last_stats().time_to_first_token is not None:
+                ttfts.append(agent.get_last_stats().time_to_first_token)
+
+    results: dict[str, Any] = {
+        "environment": environment(),
+        "config": {
+            "cassette": args.cassette,
+            "agent": args.agent,
+            "queries": len(queries),
+            "rounds": args.rounds,
+            "timing": args.timing,
+        },
+        "wall_ms": summarize(walls, 1000),
+        "cpu_ms": summarize(cpus, 1000),
+    }
+    if ttfts:
+        results["ttft_ms"] = summarize(ttfts, 1000)
+
+    print_table(
+        [
+            ("asks", "cpu p50 ms", "cpu p95 ms", "wall p50 ms"),
+            (
+                str(len(cpus)),
+                f"{results['cpu_ms']['p50']:.2f}",
+                f"{results['cpu_ms']['p95']:.2f}",
+                f"{results['wall_ms']['p50']:.2f}",
+            ),
+        ]
+    )
+    if args.output:
+        write_results(args.output, results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(
+            {f"cpu_ms.{k}": v for k, v in results["cpu_ms"].items() if k != "max"},
+            {f"cpu_ms.{k}": v for k, v in baseline["cpu_ms"].items() if k != "max"},
+            args.tolerance,
+        )
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
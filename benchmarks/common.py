@@ -0,0 +1,81 @@
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Sequence
+
+
+def summarize(values: list[float], scale: float = 1.0) -> dict[str, float]:
+    """
+    Summarize a list of measurements.
+    :param values:  The measurements.
+    :param scale:  The factor to multiply every measurement by, e.g. 1000 to report seconds as milliseconds.
+    :return:  The mean, median, 95th percentile, minimum and maximum of the measurements.
+    """
+    if not values:
+        return {}
+    ordered = sorted(value * scale for value in values)
+    p95_index = min(len(ordered) - 1, max(0, round(0.95 * len(ordered)) - 1))
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": statistics.median(ordered),
+        "p95": ordered[p95_index],
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+
+
+def environment() -> dict[str, Any]:
+    """
+    Describe the environment the benchmarks ran in.
+    :return:  The Python version, platform and time of the run.
+    """
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def write_results(path: str, results: dict[str, Any]) -> None:
+    """
+    Write benchmark results to a JSON file.
+    :param path:  The path of the file.
+    :param results:  The results.
+    """
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def print_table(rows: Sequence[Sequence[str]]) -> None:
+    """
+    Print rows as an aligned table. The first row is the header.
+    :param rows:  The rows to print.
+    """
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for index, row in enumerate(rows):
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+        if index == 0:
+            print("  ".join("-" * width for width in widths))
+
+
+def find_regressions(
+    current: dict[str, float], baseline: dict[str, float], tolerance: float
+) -> list[str]:
+    """
+    Compare measurements with a baseline, where lower is better.
+    :param current:  The current measurements by name.
+    :param baseline:  The baseline measurements by name.  Names missing from either side are ignored.
+    :param tolerance:  The allowed relative increase, e.g. 0.1 for 10%.
+    :return:  A description of every measurement that regressed beyond the tolerance.
+    """
+    regressions = []
+    for name, value in current.items():
+        base = baseline.get(name)
+        if base and value > base * (1 + tolerance):
+            regressions.append(
+                f"{name}: {value:.3f} vs baseline {base:.3f} (+{(value / base - 1) * 100:.1f}%)"
+            )
+    return regressions
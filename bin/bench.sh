@@ -0,0 +1,11 @@
+#!/bin/bash
+
+# Activate virtual environment
+source ../venv/bin/activate
+
+# Run the end-to-end benchmarks against the local fake OpenAI server, passing on any arguments
+# e.g. ./bench.sh --asks 100 --latency 0.05 --tokens-per-second 200 --output e2e.json
+cd .. && python -m benchmarks.bench_e2e "$@"
+
+# Deactivate the virtual environment
+deactivate
@@ -0,0 +1,11 @@
+#!/bin/bash
+
+# Activate virtual environment
+source ../venv/bin/activate
+
+# Run the import-time benchmark of the library's entry points, passing on any arguments
+# e.g. ./bench_import.sh --output import.json, then ./bench_import.sh --baseline import.json
+cd .. && python -m benchmarks.bench_import "$@"
+
+# Deactivate the virtual environment
+deactivate
@@ -0,0 +1,11 @@
+#!/bin/bash
+
+# Activate virtual environment
+source ../venv/bin/activate
+
+# Run the memory benchmark of live sessions, passing on any arguments
+# e.g. ./bench_memory.sh --output memory.json, then ./bench_memory.sh --baseline memory.json
+cd .. && python -m benchmarks.bench_memory "$@"
+
+# Deactivate the virtual environment
+deactivate
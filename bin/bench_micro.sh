@@ -0,0 +1,11 @@
+#!/bin/bash
+
+# Activate virtual environment
+source ../venv/bin/activate
+
+# Run the microbenchmarks of the library's hot paths, passing on any arguments
+# e.g. ./bench_micro.sh --output micro.json, then ./bench_micro.sh --baseline micro.json
+cd .. && python -m benchmarks.bench_micro "$@"
+
+# Deactivate the virtual environment
+deactivate
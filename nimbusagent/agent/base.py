@@ -1,12 +1,62 @@
+import abc
+import functools
+import inspect
+import json
 import os
-from typing import Callable, Literal
+import time
+from typing import Any, Callable, Literal
 
 import openai
 from openai import OpenAI
 
+from nimbusagent.agent.routing import (
+    ModelRouter,
+    PRIMARY,
+    RoutingContext,
+    SECONDARY,
+)
+from nimbusagent.agent.stats import AgentStats, AskStats, LoopStats
 from nimbusagent.functions.handler import FunctionHandler
+from nimbusagent.functions.responses import FuncResponse, FuncResult
 from nimbusagent.memory.base import AgentMemory
-from nimbusagent.utils.helper import is_query_safe, FUNCTIONS_EMBEDDING_MODEL
+from nimbusagent.utils.helper import (
+    check_query_safety,
+    EmbeddingIndex,
+    FUNCTIONS_EMBEDDING_MODEL,
+    LRUCache,
+)
+from nimbusagent.utils.lazy import warmup as warmup_modules
+from nimbusagent.utils.metrics import (
+    Metrics,
+    NOOP_METRICS,
+    ASK_LOOPS,
+    ASKS_CANCELLED_TOTAL,
+    RATE_LIMIT_WAIT_SECONDS,
+    ASK_SECONDS,
+    CACHED_TOKENS_TOTAL,
+    HEDGES_TOTAL,
+    MODEL_ROUTES_TOTAL,
+    COMPLETION_TOKENS_TOTAL,
+    MODEL_CALL_SECONDS,
+    MODERATION_CACHE_TOTAL,
+    MODERATION_SECONDS,
+    PROMPT_TOKENS_TOTAL,
+    RESPONSE_CACHE_TOTAL,
+    RETRIES_TOTAL,
+    TIME_TO_FIRST_TOKEN_SECONDS,
+)
+from nimbusagent.utils.circuit_breaker import CircuitBreakers, CircuitOpenError, OPEN
+from nimbusagent.utils.cancellation import AskCancelled, CancellationToken
+from nimbusagent.utils.hedging import HedgePolicy, PrefetchedStream
+from nimbusagent.utils.rate_limit import (
+    PRIORITY_INTERACTIVE,
+    RateLimiter,
+    RateLimitReservation,
+)
+from nimbusagent.utils.profiling import AskProfiler, ProfileSession
+from nimbusagent.utils.response_cache import CachedResponse, ResponseCache
+from nimbusagent.utils.retry import RetryPolicy
+from nimbusagent.utils.tracing import Tracer, NOOP_TRACE, NOOP_TRACER
 
 SYS_MSG = """You are a helpful assistant."""
 
@@ -20,10 +70,12 @@ DEFAULT_TEMP = 0.1
 DEFAULT_SECONDARY_MODEL_NAME = "gpt-3.5-turbo"
 
 
-class BaseAgent:
+class BaseAgent(abc.ABC):
     def __init__(
         self,
         openai_api_key: str | None = None,
+        openai_base_url: str | None = None,
+        client: OpenAI | None = None,
         model_name: str = DEFAULT_MODEL_NAME,
         secondary_model_name: str = DEFAULT_SECONDARY_MODEL_NAME,
         temperature: float = DEFAULT_TEMP,
@@ -52,16 +104,31 @@ class BaseAgent:
         internal_thoughts_max_entries: int = 8,
         loops_max: int = 10,
         send_events: bool = False,
-        max_event_size: int = 2000,
+        max_event_size: int | None = 2000,
         on_complete: Callable | None = None,
         store_request: bool = False,
         store_metadata: dict[str, str] | None = None,
+        metrics: Metrics | None = None,
+        moderation_cache: LRUCache | None = None,
+        embedding_cache: LRUCache | None = None,
+        tracer: Tracer | None = None,
+        profiler: AskProfiler | None = None,
+        response_cache: ResponseCache | None = None,
+        retry_policy: RetryPolicy | None = None,
+        hedge_policy: HedgePolicy | None = None,
+        model_router: ModelRouter | None = None,
+        rate_limiter: RateLimiter | None = None,
+        rate_limit_priority: int = PRIORITY_INTERACTIVE,
+        circuit_breakers: CircuitBreakers | None = None,
     ):
         """
         Base Agent Class for Nimbus Agent
 
         Args:
             openai_api_key: the OpenAI API key to use
+            openai_base_url: the base URL of the OpenAI API, e.g. for a proxy or a local test server (default: None)
+            client: The OpenAI client to use instead of creating one, e.g. to share it between agents or to record
+                    and replay requests with a cassette. Overrides openai_api_key and openai_base_url (default: None)
             model_name: The name of the model to use (default: 'gpt-4-0613')
             secondary_model_name: The name of the secondary model to use (default: 'gpt-3.5-turbo')
             temperature: The temperature for the response sampling (default: 0.1)
@@ -92,34 +159,62 @@ class BaseAgent:
             internal_thoughts_max_entries: The maximum number of entries to store in the internal thoughts (default: 3)
             loops_max: The maximum number of loops to allow (default: 5)
             send_events: True if events should be sent (default: False)
-            max_event_size: The maximum size of an event (default: 2000)
+            max_event_size: The maximum size of an event, or None for no limit (default: 2000)
             on_complete: The callback to call when the agent completes a response.
-                The response is passed to the callable. This can be useful with streaming. (default: None)
+                The response is passed to the callable, followed by the AskStats of the ask if the callable
+                accepts a second argument. This can be useful with streaming. (default: None)
             store_request: True if openAI request should be stored, useful for debugging and logging (default: False)
             store_metadata: The metadata to store with the request (default: None)
+            metrics: The metrics to record model calls, tool calls, moderation and embeddings to (default: None)
+            moderation_cache: A cache of queries that passed moderation, can be shared between agents (default: None)
+            embedding_cache: A cache of query embeddings used for function routing, can be shared between agents
+                            (default: None)
+            tracer: The tracer to record spans for every stage of an ask to, e.g. a TraceCollector (default: None)
+            profiler: The AskProfiler to profile asks with, writing cProfile and tracemalloc reports (default: None)
+            response_cache: A cache of final responses consulted before the model loop, can be shared between agents.
+                            Tools can keep a response out of it with FuncResponse.cacheable (default: None)
+            retry_policy: How to retry chat, moderation and embedding calls that fail with transient errors. The
+                          OpenAI client's own retries are turned off in favor of it (default: RetryPolicy())
+            hedge_policy: Sends a second request when a model call has not responded (or streamed its first chunk)
+                          within a percentile of recent latencies, and uses whichever responds first. Can be shared
+                          between agents (default: None)
+            model_router: Decides per turn whether the primary or the secondary model answers, e.g. sending greetings
+                          and unit conversions to the cheaper, faster secondary model (default: None)
+            rate_limiter: A client-side requests and tokens per minute limit for chat, moderation and embedding calls,
+                          shared between the agents of a process (default: None)
+            rate_limit_priority: The priority of this agent's calls when they wait for the rate limiter, lowest
+                          first, e.g. PRIORITY_BATCH for batch jobs (default: PRIORITY_INTERACTIVE)
+            circuit_breakers: Circuit breakers of the chat, moderation and embedding endpoints, shared between agents,
+                          to fail fast or degrade while an endpoint keeps failing (default: None)
         """
 
-        self.client = OpenAI(
-            api_key=(
-                openai_api_key
-                if openai_api_key is not None
-                else os.getenv("OPENAI_API_KEY")
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.hedge_policy = hedge_policy
+        self.model_router = model_router
+        self.rate_limiter = rate_limiter
+        self.rate_limit_priority = rate_limit_priority
+        self.circuit_breakers = circuit_breakers
+        if client is not None:
+            self.client = client.with_options(max_retries=0)
+        else:
+            self.client = OpenAI(
+                api_key=(
+                    openai_api_key
+                    if openai_api_key is not None
+                    else os.getenv("OPENAI_API_KEY")
+                ),
+                base_url=openai_base_url,
+                max_retries=0,
             )
-        )
 
-        # self.internal_thoughts: A list that captures the agent's intermediate
-        # processing and thoughts during a single 'ask' session. It gets cleared
-        # at the beginning of every new 'ask' to ensure no residual information
-        # affects the new processing.
-        self.internal_thoughts = []
+        self._init_state()
         self.internal_thoughts_max_entries = internal_thoughts_max_entries
         self.model_name = model_name
         self.secondary_model_name = secondary_model_name
         self.temperature = temperature
         self.max_tokens = max_tokens
-        self.system_message = None
+        self.system_message: dict[str, str] = {}
         self.set_system_message(system_message)
-        self.last_response = None
         self.perform_moderation = perform_moderation
         self.moderation_fail_message = moderation_fail_message
         self.loops_max = loops_max
@@ -128,8 +223,14 @@ class BaseAgent:
         self.calling_function_start_callback = calling_function_start_callback
         self.calling_function_stop_callback = calling_function_stop_callback
         self.on_complete = on_complete
+        self._on_complete_accepts_stats = self._accepts_two_args(on_complete)
         self.store_request = store_request
         self.store_metadata = store_metadata
+        self.metrics = metrics if metrics is not None else NOOP_METRICS
+        self.moderation_cache = moderation_cache
+        self.tracer = tracer if tracer is not None else NOOP_TRACER
+        self.profiler = profiler
+        self.response_cache = response_cache
 
         self.chat_history = AgentMemory(
             max_messages=memory_max_entries,
@@ -153,9 +254,39 @@ class BaseAgent:
             function_pattern_mode=function_pattern_mode,
             function_max_tokens=function_max_tokens,
             function_min_similarity=function_min_similarity,
+            embedding_cache=embedding_cache,
         )
+        self.function_handler.rate_limiter = rate_limiter
+        self.function_handler.rate_limit_priority = rate_limit_priority
+        if circuit_breakers is not None:
+            self.function_handler.embeddings_breaker = circuit_breakers.embeddings
         self.use_tool_calls = use_tool_calls
 
+    def _init_state(self) -> None:
+        """
+        Initialize the state that belongs to a single agent, as opposed to its configuration. Agents created from an
+        AgentBlueprint share their configuration and call this to get their own state.
+        """
+        # self.internal_thoughts: A list that captures the agent's intermediate
+        # processing and thoughts during a single 'ask' session. It gets cleared
+        # at the beginning of every new 'ask' to ensure no residual information
+        # affects the new processing.
+        self.internal_thoughts = []
+        self.last_response: openai.types.chat.ChatCompletion | str | None = None
+        self.last_stats = AskStats()
+        self.stats = AgentStats()
+        self._trace = NOOP_TRACE
+        self._profile_session: ProfileSession | None = None
+        self._cache_key: str | None = None
+        self._cache_scope = ""
+        self._cache_model = ""
+        self._cache_embedding: list[float] | None = None
+        self._cache_ttl: float | None = None
+        self._use_secondary_model = False
+        self._cancellation = CancellationToken()
+        self._retry = self.retry_policy.new_budget(self._on_retry, self._cancellation)
+        self._rate_limit_reservations: list[tuple[RateLimitReservation, LoopStats]] = []
+
     def set_system_message(self, message: str) -> None:
         """Sets the system message.
         :param message: The system message to set
@@ -175,6 +306,7 @@ class BaseAgent:
         functions_pattern_groups: list[dict] | None = None,
         function_pattern_mode: Literal["all", "first"] = "all",
         function_max_tokens: int = 0,
+        embedding_cache: LRUCache | None = None,
     ) -> FunctionHandler:
         """Initializes the function handler.
         Returns a FunctionHandler instance.
@@ -184,6 +316,7 @@ class BaseAgent:
         :param functions_k_closest: The number of closest functions to use
         :param functions_always_use: The list of functions to always use
         :param functions_pattern_groups: The list of function pattern groups to use
+        :param embedding_cache: The cache to store query embeddings in
         :return: A FunctionHandler instance
         """
 
@@ -202,6 +335,9 @@ class BaseAgent:
             calling_function_stop_callback=self.calling_function_stop_callback,
             max_tokens=function_max_tokens,
             chat_history=self.chat_history,
+            metrics=self.metrics,
+            embedding_cache=embedding_cache,
+            client=self.client,
         )
 
     # noinspection PyUnresolvedReferences
@@ -223,47 +359,187 @@ class BaseAgent:
         :param force_no_functions: True if functions should be forced to not be used
         :return: An openai chat completion
         """
+        self._cancellation.raise_if_cancelled()
         model_name = (
-            self.secondary_model_name if use_secondary_model else self.model_name
+            self.secondary_model_name
+            if use_secondary_model or self._use_secondary_model
+            else self.model_name
         )
 
+        kwargs: dict[str, Any] = {
+            "model": model_name,
+            "temperature": self.temperature,
+            "messages": messages,
+        }
         if use_functions and self.function_handler.functions and not force_no_functions:
             if self.use_tool_calls:
-                # noinspection PyTypeChecker
-                res = self.client.chat.completions.create(
-                    model=model_name,
-                    temperature=self.temperature,
-                    messages=messages,
-                    tools=self.function_handler.functions_to_tools(),
-                    tool_choice=function_call,
-                    stream=stream,
-                    store=self.store_request,
-                    metadata=self.store_metadata,
+                kwargs["tools"] = self.function_handler.functions_to_tools()
+                kwargs["tool_choice"] = function_call
+            else:
+                kwargs["functions"] = self.function_handler.functions
+                kwargs["function_call"] = function_call
+
+        kwargs["stream"] = stream
+        if stream:
+            kwargs["stream_options"] = {"include_usage": True}
+        kwargs["store"] = self.store_request
+        kwargs["metadata"] = self.store_metadata
+
+        loop_stats = self.last_stats.start_loop(model_name)
+        with self._trace.span(
+            "chat.completions.create", {"model": model_name, "stream": stream}
+        ):
+            if self.hedge_policy is not None:
+                res = self._create_hedged_chat_completion(
+                    self.hedge_policy, kwargs, loop_stats
                 )
             else:
                 # noinspection PyTypeChecker
-                res = self.client.chat.completions.create(
-                    model=model_name,
-                    temperature=self.temperature,
-                    messages=messages,
-                    functions=self.function_handler.functions,
-                    function_call=function_call,
-                    stream=stream,
-                    store=self.store_request,
-                    metadata=self.store_metadata,
+                res = self._retry.call("chat", self._chat_completions_create, **kwargs)
+        if not stream:
+            loop_stats.add_usage(getattr(res, "usage", None))
+            loop_stats.finish()
+        return res
+
+    def _chat_completions_create(self, **kwargs) -> Any:
+        """Sends a chat completion request for the current model call. Its rate limiter reservation is corrected with
+        the usage of the model call when the ask finishes.
+        :return: The chat completion, or its stream
+        """
+        res, reservation = self._reserve_chat_completion(kwargs)
+        self._keep_reservation(reservation, self.last_stats.loops[-1])
+        return res
+
+    def _reserve_chat_completion(
+        self, kwargs: dict[str, Any]
+    ) -> tuple[Any, RateLimitReservation | None]:
+        """Sends a chat completion request, waiting for the rate limiter if one is set. The request is pre-charged with
+        an estimate of its tokens. Does not touch the state of the ask, so that hedged attempts can call it from their
+        threads.
+        :param kwargs: The arguments of the chat completion
+        :return: The chat completion, or its stream, and its rate limiter reservation if any
+        """
+        create = self.client.chat.completions.create
+        if self.circuit_breakers is not None:
+            create = functools.partial(self.circuit_breakers.chat.call, create)
+        if self.rate_limiter is None:
+            return create(**kwargs), None
+        if (
+            self.circuit_breakers is not None
+            and self.circuit_breakers.chat.state == OPEN
+        ):
+            # fail fast instead of waiting for capacity first
+            raise CircuitOpenError("chat")
+
+        reservation = self.rate_limiter.acquire(
+            self._estimate_tokens(kwargs), self.rate_limit_priority
+        )
+        if reservation.wait_time:
+            self.metrics.observe(RATE_LIMIT_WAIT_SECONDS, reservation.wait_time)
+        try:
+            return create(**kwargs), reservation
+        except Exception:
+            # a failed request used no tokens
+            reservation.settle(0)
+            raise
+
+    def _keep_reservation(
+        self, reservation: RateLimitReservation | None, loop_stats: LoopStats
+    ) -> None:
+        """Records the rate limiter reservation of a model call, to settle it with the call's usage when the ask
+        finishes.
+        :param reservation: The reservation, or None without a rate limiter
+        :param loop_stats: The stats of the model call
+        """
+        if reservation is None:
+            return
+        self.last_stats.rate_limit_wait += reservation.wait_time
+        self._rate_limit_reservations.append((reservation, loop_stats))
+
+    def _estimate_tokens(self, kwargs: dict[str, Any]) -> int:
+        """Estimates the tokens of a chat completion request: its prompt, tools and max_tokens.
+        :param kwargs: The arguments of the chat completion
+        :return: The estimated number of tokens
+        """
+        tokens = self.max_tokens
+        for message in kwargs["messages"]:
+            if not isinstance(message, dict):
+                message = message.model_dump(exclude_none=True)
+            content = message.get("content")
+            tokens += 4 + (self.chat_history.tokenize(content) if content else 0)
+            for key in ("tool_calls", "function_call"):
+                if message.get(key):
+                    tokens += self.chat_history.tokenize(json.dumps(message[key]))
+        tools = kwargs.get("tools") or kwargs.get("functions")
+        if tools:
+            tokens += self.chat_history.tokenize(json.dumps(tools))
+        return tokens
+
+    def _settle_rate_limit(self) -> None:
+        """Corrects the tokens charged to the rate limiter for the model calls of the ask with their actual usage."""
+        for reservation, loop_stats in self._rate_limit_reservations:
+            used = loop_stats.prompt_tokens + loop_stats.completion_tokens
+            if used:
+                reservation.settle(used)
+        self._rate_limit_reservations = []
+
+    def _create_hedged_chat_completion(
+        self, hedge_policy: HedgePolicy, kwargs: dict[str, Any], loop_stats: LoopStats
+    ) -> Any:
+        """Creates a chat completion under the hedge policy. Streams race on their first chunk, and the losing stream
+        is closed. The usage of the losing call is not recorded; its rate limiter reservation is settled with its own
+        usage, or nothing for a stream.
+        :param hedge_policy: The hedge policy
+        :param kwargs: The arguments of the chat completion
+        :param loop_stats: The stats of the model call
+        :return: The chat completion, or the stream with its first chunk read
+        """
+        stream = kwargs["stream"]
+        hedge_kwargs = kwargs
+        if hedge_policy.use_secondary_model:
+            hedge_kwargs = {**kwargs, "model": self.secondary_model_name}
+
+        def create(call_kwargs: dict[str, Any], cancellation: CancellationToken):
+            # the attempt that lost the race stops before its next retry
+            cancellation.raise_if_cancelled()
+            res, reservation = self._reserve_chat_completion(call_kwargs)
+            if not stream:
+                return res, reservation
+            try:
+                return PrefetchedStream(res), reservation
+            except Exception:
+                if reservation is not None:
+                    reservation.settle(0)
+                raise
+
+        def discard(attempt: tuple[Any, RateLimitReservation | None]) -> None:
+            res, reservation = attempt
+            if stream:
+                res.close()
+            if reservation is not None:
+                usage = None if stream else getattr(res, "usage", None)
+                reservation.settle(
+                    usage.prompt_tokens + usage.completion_tokens if usage else 0
                 )
-        else:
-            res = self.client.chat.completions.create(
-                model=model_name,
-                temperature=self.temperature,
-                messages=messages,
-                stream=stream,
-                store=self.store_request,
-                metadata=self.store_metadata,
+
+        outcome = hedge_policy.call(
+            lambda token: self._retry.call("chat", create, kwargs, token),
+            lambda token: create(hedge_kwargs, token),
+            discard=discard,
+        )
+        res, reservation = outcome.result
+        self._keep_reservation(reservation, loop_stats)
+        if outcome.hedged:
+            loop_stats.hedged = True
+            loop_stats.hedge_won = outcome.hedge_won
+            if outcome.hedge_won:
+                loop_stats.model = hedge_kwargs["model"]
+            self.metrics.inc(
+                HEDGES_TOTAL, labels={"result": "won" if outcome.hedge_won else "lost"}
             )
         return res
 
-    def _history_needs_moderation(self, history: list[tuple[str, str]]) -> bool:
+    def _history_needs_moderation(self, history: list[dict[str, str]]) -> bool:
         """Handles history moderation.
         Returns True if the history contains inappropriate content, False otherwise.
         :param history: The history to check
@@ -282,7 +558,315 @@ class BaseAgent:
         :param query: The query to check
         :return: True if the query requires moderation, False otherwise
         """
-        return self.perform_moderation and not is_query_safe(query)
+        if not self.perform_moderation:
+            return False
+
+        if self.moderation_cache is not None:
+            if self.moderation_cache.get(query):
+                self.metrics.inc(MODERATION_CACHE_TOTAL, labels={"result": "hit"})
+                return False
+            self.metrics.inc(MODERATION_CACHE_TOTAL, labels={"result": "miss"})
+
+        breakers = self.circuit_breakers
+        start = time.perf_counter()
+        try:
+            with self._trace.span("moderation"):
+                is_safe = check_query_safety(
+                    query,
+                    client=self.client,
+                    retry=self._retry,
+                    rate_limiter=self.rate_limiter,
+                    priority=self.rate_limit_priority,
+                    circuit_breaker=breakers.moderation if breakers else None,
+                )
+        finally:
+            duration = time.perf_counter() - start
+            self.last_stats.moderation_time += duration
+            self.metrics.observe(MODERATION_SECONDS, duration)
+
+        if is_safe is None:
+            # moderation is unavailable: fail open or closed as configured, without caching the result
+            self.last_stats.moderation_skipped = True
+            return not (breakers is not None and breakers.moderation_fail_open)
+
+        # only safe results are cached, as API errors are reported as unsafe
+        if is_safe and self.moderation_cache is not None:
+            self.moderation_cache.set(query, True)
+        return not is_safe
+
+    def _select_functions(self, query: str) -> None:
+        """Selects the functions to offer the model for the given query, based on the chat history.
+        :param query: The query to select the functions for
+        """
+        self.function_handler.get_functions_from_query_and_history(
+            query, self.get_chat_history()
+        )
+        self.last_stats.embedding_time += self.function_handler.last_embedding_time
+
+    def _route_model(self, query: str) -> None:
+        """Decides with the model router whether the primary or the secondary model answers the turn. Must be called
+        after the functions have been selected and before the query is added to the chat history.
+        :param query: The query of the turn
+        """
+        self._use_secondary_model = False
+        if self.model_router is None:
+            return
+
+        context = RoutingContext(
+            query=query,
+            history=self.get_chat_history(),
+            functions=[func["name"] for func in self.function_handler.functions or []],
+            query_embedding=self.function_handler.last_query_embedding,
+        )
+        with self._trace.span("model_router") as span:
+            decision = self.model_router.route(context)
+            span.set_attribute("tier", decision.tier)
+        self._use_secondary_model = decision.tier == SECONDARY
+        self.last_stats.model_route = decision.tier
+        self.last_stats.model_route_reason = decision.reason
+        self.metrics.inc(
+            MODEL_ROUTES_TOTAL,
+            labels={"tier": decision.tier, "reason": decision.reason},
+        )
+
+    def _handle_function_call(
+        self, func_name: str, args_str: str
+    ) -> FuncResult | FuncResponse | None:
+        """Calls a function through the function handler, recording how long it took.
+        :param func_name: The name of the function to call
+        :param args_str: The arguments to pass to the function, as a JSON formatted string
+        :return: The result of the function call
+        """
+        self._cancellation.raise_if_cancelled()
+        start = time.perf_counter()
+        try:
+            result = self.function_handler.call_function(func_name, args_str)
+        finally:
+            self.last_stats.add_tool_call(func_name, time.perf_counter() - start)
+            if (
+                self._use_secondary_model
+                and self.model_router is not None
+                and len(self.last_stats.tool_calls)
+                > self.model_router.max_secondary_tool_calls
+            ):
+                # tool-heavy turns are finished by the primary model
+                self._use_secondary_model = False
+                self.last_stats.model_route_escalated = True
+                self.metrics.inc(
+                    MODEL_ROUTES_TOTAL,
+                    labels={"tier": PRIMARY, "reason": "tool_calls"},
+                )
+
+        if result is not None and self._cache_key is not None:
+            if not result.cacheable:
+                self._cache_key = None
+            elif result.cache_ttl is not None:
+                self._cache_ttl = (
+                    result.cache_ttl
+                    if self._cache_ttl is None
+                    else min(self._cache_ttl, result.cache_ttl)
+                )
+        return result
+
+    def _get_cached_response(self, query: str) -> CachedResponse | None:
+        """Looks up the response to the query in the response cache. Must be called after the functions have been
+        selected and the model routed, and before the query is added to the chat history. On a miss, the key is kept to
+        store the response.
+        :param query: The query to look up
+        :return: The cached response, or None on a miss or if there is no response cache
+        """
+        self._cache_key = None
+        self._cache_ttl = None
+        if self.response_cache is None:
+            return None
+
+        # responses are cached per model, so answers of the secondary model are not served for the primary model
+        self._cache_model = (
+            self.secondary_model_name if self._use_secondary_model else self.model_name
+        )
+        with self._trace.span("response_cache") as span:
+            self._cache_scope = self.response_cache.make_scope(
+                self.system_message["content"],
+                self._cache_model,
+                self.function_handler.functions,
+            )
+            key = self.response_cache.make_key(
+                self._cache_scope, self.get_chat_history(), query
+            )
+            self._cache_embedding = self.function_handler.last_query_embedding
+            cached, result = self.response_cache.get(
+                key, scope=self._cache_scope, embedding=self._cache_embedding
+            )
+            span.set_attribute("result", result or "miss")
+
+        self.metrics.inc(RESPONSE_CACHE_TOTAL, labels={"result": result or "miss"})
+        if cached is None:
+            self._cache_key = key
+            return None
+
+        self.last_stats.response_cache = result
+        return cached
+
+    def _set_cached_response(
+        self, content: str | None, chunks: list[str] | None = None
+    ) -> None:
+        """Stores the final response of the ask in the response cache, unless a tool marked it uncacheable or it was
+        answered by another model than the one it was looked up for (e.g. after escalating to the primary model).
+        :param content: The content of the response
+        :param chunks: The chunks the response was streamed in, if it was streamed
+        """
+        if self.response_cache is None or self._cache_key is None or not content:
+            return
+        loops = self.last_stats.loops
+        if loops and loops[-1].model != self._cache_model:
+            self._cache_key = None
+            return
+
+        self.response_cache.set(
+            self._cache_key,
+            content,
+            chunks=chunks,
+            ttl=self._cache_ttl,
+            scope=self._cache_scope,
+            embedding=self._cache_embedding,
+        )
+        self._cache_key = None
+
+    def _skip_cached_response(self) -> None:
+        """Keeps the response of the current ask out of the response cache, e.g. when it did not come from the model."""
+        self._cache_key = None
+
+    def warmup(self, keep_alive: bool = False) -> dict[str, float]:
+        """Does the one-time work of a first ask now, so that the first ask sees steady-state latency: imports the
+        lazily imported modules, loads the token encodings, parses the function definitions and indexes the function
+        embeddings. Call it before a server reports itself ready.
+        :param keep_alive: True to also make a cheap request to the API (retrieving the model), which opens the
+            client's connection for the first ask
+        :return: The seconds each step took, by step
+        """
+        handler = self.function_handler
+        timings = warmup_modules(
+            {self.chat_history.token_encoding, handler.token_encoding}
+        )
+
+        start = time.perf_counter()
+        self.chat_history.tokenize(self.system_message["content"])
+        for func_name in handler.orig_functions or {}:
+            handler.get_function_definition(func_name)
+        timings["functions"] = time.perf_counter() - start
+
+        if handler.embeddings and handler.embedding_index is None:
+            start = time.perf_counter()
+            handler.embedding_index = EmbeddingIndex(handler.embeddings)
+            timings["embedding_index"] = time.perf_counter() - start
+
+        if keep_alive:
+            start = time.perf_counter()
+            self.client.models.retrieve(self.model_name)
+            timings["keep_alive"] = time.perf_counter() - start
+        return timings
+
+    @abc.abstractmethod
+    def ask(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        """Asks the agent a question. CompletionAgent returns the response, and StreamingAgent a generator of it.
+        :param query: The query to ask the agent
+        :return: The response
+        """
+
+    def cancel(self) -> None:
+        """Cancels the ask in flight, from any thread. The ask stops before its next model loop or tool call, or at the
+        next chunk of its stream, and its query is removed from the chat history. Running tools can stop early by
+        checking the cancellation token.
+        """
+        self._cancellation.cancel()
+
+    def _cancel_turn(self, query: str) -> None:
+        """Records a cancelled ask and removes its query from the chat history, so the history stays consistent.
+        :param query: The query of the ask
+        """
+        self.last_stats.cancelled = True
+        self.last_response = None
+        self._skip_cached_response()
+        if self.chat_history.get_last_entry() == {"role": "user", "content": query}:
+            self.chat_history.pop_entry()
+
+    def _start_ask(self, cancellation: CancellationToken | None = None) -> None:
+        """Starts recording the stats, trace and profile of a new ask.
+        :param cancellation: The cancellation token of the ask. A new token is created if not provided.
+        """
+        if self.profiler is not None:
+            self._profile_session = self.profiler.start_ask()
+        self.last_stats = AskStats()
+        self._trace = self.tracer.start_trace(
+            "ask", {"agent": type(self).__name__, "model": self.model_name}
+        )
+        self.function_handler.trace = self._trace
+        self._cancellation = cancellation or CancellationToken()
+        self.function_handler.cancellation = self._cancellation
+        self._retry = self.retry_policy.new_budget(self._on_retry, self._cancellation)
+        self.function_handler.retry = self._retry
+
+    def _on_retry(self, operation: str, reason: str, delay: float) -> None:
+        """Records a retry of an API call to the stats and metrics of the current ask.
+        :param operation: The call being retried, e.g. 'chat'
+        :param reason: The reason of the retry, e.g. 'rate_limit'
+        :param delay: The time waited before the retry, in seconds
+        """
+        self.last_stats.retries += 1
+        self.last_stats.retry_time += delay
+        self.metrics.inc(
+            RETRIES_TOTAL, labels={"operation": operation, "reason": reason}
+        )
+
+    def _finish_ask(self) -> None:
+        """Finishes recording the stats, trace and profile of the current ask, and adds the stats to the agent
+        totals."""
+        if self.last_stats.finished:
+            return
+        self._settle_rate_limit()
+        self.last_stats.finish()
+        self.stats.add(self.last_stats)
+        self._record_ask_metrics(self.last_stats)
+
+        self.tracer.finish_trace(self._trace)
+        self._trace = NOOP_TRACE
+        self.function_handler.trace = NOOP_TRACE
+
+        if self._profile_session is not None:
+            self._profile_session.stop()
+            self._profile_session = None
+
+    def _pause_profiling(self) -> None:
+        """Pauses profiling the current ask, while control is handed back to the caller."""
+        if self._profile_session is not None:
+            self._profile_session.pause()
+
+    def _resume_profiling(self) -> None:
+        """Resumes profiling the current ask."""
+        if self._profile_session is not None:
+            self._profile_session.resume()
+
+    def _record_ask_metrics(self, stats: AskStats) -> None:
+        """Records the stats of a finished ask to the metrics.
+        :param stats: The stats of the ask
+        """
+        for loop in stats.loops:
+            labels = {"model": loop.model}
+            self.metrics.observe(MODEL_CALL_SECONDS, loop.duration, labels=labels)
+            if loop.time_to_first_token is not None:
+                self.metrics.observe(
+                    TIME_TO_FIRST_TOKEN_SECONDS, loop.time_to_first_token, labels=labels
+                )
+            self.metrics.inc(PROMPT_TOKENS_TOTAL, loop.prompt_tokens, labels=labels)
+            self.metrics.inc(
+                COMPLETION_TOKENS_TOTAL, loop.completion_tokens, labels=labels
+            )
+            self.metrics.inc(CACHED_TOKENS_TOTAL, loop.cached_tokens, labels=labels)
+
+        self.metrics.observe(ASK_LOOPS, stats.loop_count)
+        if stats.cancelled:
+            self.metrics.inc(ASKS_CANCELLED_TOTAL)
+        self.metrics.observe(ASK_SECONDS, stats.total_time)
 
     def _clear_internal_thoughts(self) -> None:
         """Clears the internal thoughts of the agent."""
@@ -304,6 +888,18 @@ class BaseAgent:
         """
         return self.last_response
 
+    def get_last_stats(self) -> AskStats:
+        """Returns the token usage and latency stats of the last ask.
+        :return: The stats of the last ask
+        """
+        return self.last_stats
+
+    def get_stats(self) -> AgentStats:
+        """Returns the token usage and latency stats aggregated over every ask made by this agent.
+        :return: The aggregated stats
+        """
+        return self.stats
+
     def get_chat_history(self) -> list[dict[str, str]]:
         """Returns the chat history.
         :return: The chat history
@@ -323,8 +919,33 @@ class BaseAgent:
 
     def handle_on_complete(self) -> None:
         """Handles the on_complete callback."""
+        self._finish_ask()
         if self.on_complete and self.last_response:
-            self.on_complete(self.last_response)
+            if self._on_complete_accepts_stats:
+                self.on_complete(self.last_response, self.last_stats)
+            else:
+                self.on_complete(self.last_response)
+
+    @staticmethod
+    def _accepts_two_args(func: Callable | None) -> bool:
+        """Checks if a callable can be called with two positional arguments.
+        :param func: The callable to check
+        :return: True if the callable accepts two positional arguments, False otherwise
+        """
+        if func is None:
+            return False
+        try:
+            params = inspect.signature(func).parameters.values()
+        except (TypeError, ValueError):
+            return False
+
+        positional = 0
+        for param in params:
+            if param.kind == param.VAR_POSITIONAL:
+                return True
+            if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+                positional += 1
+        return positional >= 2
 
     def _clear_last_response(self) -> None:
         """Clears the last response."""
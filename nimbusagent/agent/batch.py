@@ -0,0 +1,235 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from typing import IO, Any, Generator, Iterable, Iterator
+
+from nimbusagent.agent.base import BaseAgent
+from nimbusagent.agent.blueprint import AgentBlueprint
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.utils.rate_limit import PRIORITY_BATCH
+
+
+@dataclass
+class BatchItem:
+    """
+    A query of a batch job.
+
+    :param id:  The ID of the item, which must be unique within the job to resume it.  Defaults to its position.
+    :param query:  The query to ask.
+    :param history:  The chat history to ask the query after.
+    :param metadata:  Anything to pass on to the result, e.g. the city of a forecast summary.
+    """
+
+    id: str
+    query: str
+    history: list[dict[str, str]] | None = None
+    metadata: dict[str, Any] | None = None
+
+
+@dataclass
+class BatchResult:
+    """
+    The result of an item of a batch job.
+
+    :param id:  The ID of the item.
+    :param response:  The response of the agent, or None if the item failed.
+    :param error:  The error of a failed item.  Failed items are asked again when the job is resumed.
+    :param stats:  The stats of the ask, as returned by AskStats.to_dict().
+    :param metadata:  The metadata of the item.
+    """
+
+    id: str
+    response: str | None = None
+    error: str | None = None
+    stats: dict[str, Any] = field(default_factory=dict)
+    metadata: dict[str, Any] | None = None
+
+
+def read_jsonl(path: str | os.PathLike) -> Generator[dict[str, Any], None, None]:
+    """
+    Read a JSONL file lazily, skipping blank lines.
+    :param path:  The path of the file.
+    :return:  A generator of the decoded lines.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_finished_ids(path: str | os.PathLike) -> set[str]:
+    """
+    Read the IDs of the items a previous run of a batch job finished, from its output file. The output is the
+    checkpoint of the job: every result is appended and flushed as soon as its item finishes, so an interrupted job
+    loses at most the items that were running. A partially written last line is ignored.
+    :param path:  The path of the output file.
+    :return:  The IDs of the items that finished without an error.
+    """
+    finished: set[str] = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(result, dict) and result.get("error") is None:
+                finished.add(str(result.get("id")))
+    return finished
+
+
+def _to_item(index: int, entry: str | dict[str, Any] | BatchItem) -> BatchItem:
+    if isinstance(entry, BatchItem):
+        return entry
+    if isinstance(entry, str):
+        return BatchItem(str(index), entry)
+    return BatchItem(
+        str(entry.get("id", index)),
+        entry["query"],
+        entry.get("history"),
+        entry.get("metadata"),
+    )
+
+
+class _StartRateLimiter:
+    """Spaces out the start of items to at most max_per_minute, shared by the workers."""
+
+    def __init__(self, max_per_minute: float):
+        self.interval = 60.0 / max_per_minute
+        self._next_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def ask_many(
+    queries: Iterable[str | dict[str, Any] | BatchItem] | str | os.PathLike,
+    output: str | os.PathLike | None = None,
+    blueprint: AgentBlueprint | None = None,
+    agent_options: dict[str, Any] | None = None,
+    max_workers: int = 8,
+    max_items_per_minute: float | None = None,
+    resume: bool = True,
+) -> Generator[BatchResult, None, None]:
+    """
+    Ask many independent queries with a CompletionAgent, e.g. in a nightly batch job. The queries are read lazily
+    and run by a bounded pool of workers; each item gets a fresh agent from the blueprint, so items share the client,
+    the parsed functions and the caches but not their chat history. Results are yielded, and appended to the output
+    JSONL file, in the order the items finish.
+
+    When resume is set, the items the output file already holds a successful result for are skipped, so an
+    interrupted job can be run again with the same input and output and only does the remaining items.
+
+    :param queries:  The queries, as strings, dictionaries with 'query' and optional 'id', 'history' and 'metadata'
+                     fields, or BatchItem objects, or the path of a JSONL file of such dictionaries.
+    :param output:  The path of the JSONL file to append the results to.
+    :param blueprint:  The blueprint to create the agents from.  Created from agent_options if not provided.
+    :param agent_options:  The options to create the agents with (the keyword arguments of CompletionAgent).  Their
+                           rate_limit_priority defaults to PRIORITY_BATCH, so a shared rate limiter serves
+                           interactive asks first.
+    :param max_workers:  The maximum number of items to run at once.
+    :param max_items_per_minute:  The maximum number of items to start per minute.  None for no limit.
+    :param resume:  True to skip the items already finished in the output file.
+    :return:  A generator of the results, in completion order.
+    """
+    if blueprint is None:
+        agent_options = {"rate_limit_priority": PRIORITY_BATCH, **(agent_options or {})}
+        blueprint = AgentBlueprint(CompletionAgent, agent_options)
+    if isinstance(queries, (str, os.PathLike)):
+        queries = read_jsonl(queries)
+
+    finished = read_finished_ids(output) if output is not None and resume else set()
+    limiter = _StartRateLimiter(max_items_per_minute) if max_items_per_minute else None
+
+    def run(item: BatchItem) -> BatchResult:
+        if limiter is not None:
+            limiter.wait()
+        agent: BaseAgent | None = None
+        try:
+            agent = blueprint.new_agent(item.history)
+            response = agent.ask(item.query)
+            return BatchResult(
+                item.id,
+                response=response,
+                stats=agent.get_last_stats().to_dict(),
+                metadata=item.metadata,
+            )
+        except Exception as e:
+            logging.warning("Batch item %s failed: %s", item.id, e)
+            return BatchResult(
+                item.id,
+                error=f"{type(e).__name__}: {e}",
+                stats=agent.get_last_stats().to_dict() if agent is not None else {},
+                metadata=item.metadata,
+            )
+
+    items: Iterator[BatchItem] = (
+        item
+        for item in (_to_item(i, entry) for i, entry in enumerate(queries))
+        if item.id not in finished
+    )
+    sink = _open_output(output) if output is not None else None
+    executor = ThreadPoolExecutor(max_workers, thread_name_prefix="nimbusagent-batch")
+    pending: set[Future] = set()
+    try:
+        # keep a few items queued per worker, without reading the whole input
+        for item in items:
+            pending.add(executor.submit(run, item))
+            if len(pending) < max_workers * 2:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from _emit(done, sink)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from _emit(done, sink)
+    finally:
+        # when the caller stops early, items not started are dropped and the running ones are still checkpointed
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        if sink is not None:
+            for future in pending:
+                if not future.cancelled():
+                    _write(sink, future.result())
+            sink.close()
+
+
+def _open_output(path: str | os.PathLike) -> IO[str]:
+    """
+    Open the output file of a batch job for appending. A partially written last line, e.g. of a job that was killed,
+    is terminated so that the next result starts on a line of its own.
+    """
+    partial = False
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            partial = f.read(1) != b"\n"
+    sink = open(path, "a", encoding="utf-8")
+    if partial:
+        sink.write("\n")
+    return sink
+
+
+def _write(sink, result: BatchResult) -> None:
+    sink.write(json.dumps(asdict(result)) + "\n")
+    sink.flush()
+
+
+def _emit(done: set[Future], sink) -> Generator[BatchResult, None, None]:
+    # checkpoint every finished item before yielding any, in case the caller stops iterating
+    results = [future.result() for future in done]
+    if sink is not None:
+        for result in results:
+            _write(sink, result)
+    yield from results
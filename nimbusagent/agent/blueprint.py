@@ -0,0 +1,110 @@
+import copy
+import os
+import re
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Mapping
+
+from openai import OpenAI
+
+from nimbusagent.agent.base import BaseAgent
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.memory.base import AgentMemory
+from nimbusagent.utils.helper import EmbeddingIndex
+
+
+@dataclass(frozen=True, eq=False)
+class AgentBlueprint:
+    """
+    A frozen agent configuration that compiles everything derivable from the agent options once: the OpenAI client,
+    function definitions and their token counts, compiled function patterns, a matrix of the function embeddings and
+    the token count of the system message. new_agent() then creates agents by copying a template agent, without
+    parsing options again, which makes it cheap to create an agent per request.
+
+    Agents created from a blueprint share its client, caches, metrics and functions, and have their own chat history
+    and stats.
+
+    :param agent_class:  The agent class to create, CompletionAgent or StreamingAgent.
+    :param options:  The options to create agents with (the keyword arguments of the agent class), except
+                     message_history, which is passed to new_agent().
+    """
+
+    agent_class: type[BaseAgent] = CompletionAgent
+    options: Mapping[str, Any] = field(default_factory=dict)
+    system_message_tokens: int = field(init=False)
+    _template: BaseAgent = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        options = dict(self.options)
+        if "message_history" in options:
+            raise ValueError("Pass the message history to new_agent() instead")
+
+        if "client" not in options:
+            options["client"] = OpenAI(
+                api_key=options.pop("openai_api_key", None)
+                or os.getenv("OPENAI_API_KEY"),
+                base_url=options.pop("openai_base_url", None),
+            )
+        if options.get("functions_pattern_groups"):
+            options["functions_pattern_groups"] = [
+                {**group, "pattern": re.compile(group["pattern"])}
+                for group in options["functions_pattern_groups"]
+            ]
+
+        template = self.agent_class(**options)
+        handler = template.function_handler
+        for func_name in handler.orig_functions or {}:
+            handler.get_function_definition(func_name)
+        if handler.embeddings:
+            handler.embedding_index = EmbeddingIndex(handler.embeddings)
+
+        object.__setattr__(self, "options", MappingProxyType(options))
+        object.__setattr__(self, "_template", template)
+        object.__setattr__(
+            self,
+            "system_message_tokens",
+            template.chat_history.tokenize(template.system_message["content"]),
+        )
+
+    @property
+    def client(self) -> OpenAI:
+        """
+        The OpenAI client shared by the blueprint's agents.
+        """
+        return self._template.client
+
+    def warmup(self, keep_alive: bool = False) -> dict[str, float]:
+        """
+        Do the one-time work of a first ask for every agent of the blueprint: import the lazily imported modules and
+        load the token encodings, and optionally open the shared client's connection. See BaseAgent.warmup().
+        :param keep_alive:  True to also make a cheap request to the API to open the client's connection.
+        :return:  The seconds each step took, by step.
+        """
+        return self._template.warmup(keep_alive)
+
+    def new_memory(self) -> AgentMemory:
+        """
+        Create an empty chat history with the blueprint's memory limits and tokenizer.
+        :return:  The chat history.
+        """
+        memory = copy.copy(self._template.chat_history)
+        memory.clear_chat_history()
+        return memory
+
+    def new_agent(self, history: list[dict[str, str]] | None = None) -> BaseAgent:
+        """
+        Create an agent.
+        :param history:  The message history of the agent, which is moderated if moderation is enabled.
+        :return:  The agent.
+        """
+        agent = copy.copy(self._template)
+        agent._init_state()
+        agent.chat_history = self.new_memory()
+        agent.function_handler = copy.copy(self._template.function_handler)
+        agent.function_handler.chat_history = agent.chat_history
+
+        if history is not None:
+            if agent._history_needs_moderation(history):
+                raise ValueError("The message history contains inappropriate content.")
+            agent.chat_history.set_chat_history(history)
+        return agent
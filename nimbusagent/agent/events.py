@@ -0,0 +1,179 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any
+
+EVENT_TYPE_CONTENT = "content"
+EVENT_TYPE_FUNCTION = "function"
+EVENT_TYPE_DATA = "data"
+
+DATA_TOO_LARGE = '{"error":"data too large"}'
+
+
+class StreamEvent(ABC):
+    """
+    Base class of the typed events yielded by StreamingAgent.ask_events().
+    """
+
+    __slots__ = ()
+    type = ""
+
+    @abstractmethod
+    def to_json(self) -> str:
+        """
+        Serialize the event as a single line of JSON, e.g. for NDJSON or SSE output.
+        :return:  The event as JSON.
+        """
+
+    @abstractmethod
+    def to_marker(self) -> str:
+        """
+        Serialize the event in the inline text format, `[[[type:name:data]]]`.
+        :return:  The event as an inline marker.
+        """
+
+
+class ContentChunk(StreamEvent):
+    """
+    A chunk of the response content.
+
+    :param content:  The content.
+    """
+
+    __slots__ = ("content",)
+    type = EVENT_TYPE_CONTENT
+
+    def __init__(self, content: str):
+        self.content = content
+
+    def to_json(self) -> str:
+        return f'{{"type":"content","content":{json.dumps(self.content)}}}'
+
+    def to_marker(self) -> str:
+        return self.content
+
+    def __repr__(self) -> str:
+        return f"ContentChunk({self.content!r})"
+
+
+class FunctionEvent(StreamEvent):
+    """
+    A function (tool) the agent is about to call.
+
+    :param name:  The name of the function.
+    :param arguments:  The arguments of the call, as a JSON formatted string.
+    """
+
+    __slots__ = ("name", "arguments")
+    type = EVENT_TYPE_FUNCTION
+
+    def __init__(self, name: str, arguments: str | None = None):
+        self.name = name
+        self.arguments = arguments
+
+    def to_json(self) -> str:
+        return (
+            f'{{"type":"function","name":{json.dumps(self.name)},'
+            f'"arguments":{json.dumps(self.arguments)}}}'
+        )
+
+    def to_marker(self) -> str:
+        if not self.arguments:
+            return f"[[[{self.type}:{self.name}]]]"
+        return f"[[[{self.type}:{self.name}:{self.arguments}]]]"
+
+    def __repr__(self) -> str:
+        return f"FunctionEvent({self.name!r}, {self.arguments!r})"
+
+
+class DataEvent(StreamEvent):
+    """
+    Data a function asked to stream to the user (FuncResponse.stream_data). Create it with `DataEvent.create()` to
+    serialize the data with a size limit.
+
+    :param name:  The name of the data.
+    :param data:  The data, either as JSON or as a plain string.
+    :param is_json:  True if the data is JSON, False if it is a plain string.
+    """
+
+    __slots__ = ("name", "data", "is_json")
+    type = EVENT_TYPE_DATA
+
+    def __init__(self, name: str, data: str | None, is_json: bool = True):
+        self.name = name
+        self.data = data
+        self.is_json = is_json
+
+    @classmethod
+    def create(cls, name: str, data: Any, max_size: int | None) -> "DataEvent":
+        """
+        Create a data event, serializing the data as JSON unless it is a string. Serialization stops as soon as the
+        data exceeds max_size, in which case the data is replaced with an error.
+        :param name:  The name of the data.
+        :param data:  The data.
+        :param max_size:  The maximum size of the serialized data.  None for no limit.
+        :return:  The event.
+        """
+        if not data:
+            return cls(name, None)
+        if isinstance(data, str):
+            return cls(name, data, is_json=False)
+        serialized = bounded_json(data, max_size)
+        return cls(name, serialized if serialized is not None else DATA_TOO_LARGE)
+
+    def to_json(self) -> str:
+        if self.data is None:
+            data = "null"
+        elif self.is_json:
+            data = self.data
+        else:
+            data = json.dumps(self.data)
+        return f'{{"type":"data","name":{json.dumps(self.name)},"data":{data}}}'
+
+    def to_marker(self) -> str:
+        if not self.data:
+            return f"[[[{self.type}:{self.name}]]]"
+        return f"[[[{self.type}:{self.name}:{self.data}]]]"
+
+    def __repr__(self) -> str:
+        return f"DataEvent({self.name!r}, {self.data!r})"
+
+
+_ENCODER = json.JSONEncoder()
+
+
+def bounded_json(data: Any, max_size: int | None) -> str | None:
+    """
+    Serialize data as JSON, giving up as soon as the output exceeds max_size.
+    :param data:  The data to serialize.
+    :param max_size:  The maximum size of the output.  None for no limit.
+    :return:  The JSON, or None if it would exceed max_size.
+    """
+    if max_size is None:
+        return _ENCODER.encode(data)
+
+    parts = []
+    size = 0
+    for part in _ENCODER.iterencode(data):
+        size += len(part)
+        if size > max_size:
+            return None
+        parts.append(part)
+    return "".join(parts)
+
+
+def encode_ndjson(event: StreamEvent) -> str:
+    """
+    Encode an event as a line of newline delimited JSON.
+    :param event:  The event.
+    :return:  The NDJSON line, including the trailing newline.
+    """
+    return event.to_json() + "\n"
+
+
+def encode_sse(event: StreamEvent) -> str:
+    """
+    Encode an event as a server-sent event, with the event type as the SSE event name.
+    :param event:  The event.
+    :return:  The SSE message, including the blank line that ends it.
+    """
+    return f"event: {event.type}\ndata: {event.to_json()}\n\n"
@@ -0,0 +1,240 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Literal
+
+Tier = Literal["primary", "secondary"]
+
+PRIMARY: Tier = "primary"
+SECONDARY: Tier = "secondary"
+
+GREETING_PATTERN = (
+    r"(?i)^\s*(hi|hello|hey|good (morning|afternoon|evening)|thanks|thank you|thx|ok|okay|yes|no|yep|nope|sure|"
+    r"great|cool|got it|bye|goodbye)\b[\s!.?,]*$"
+)
+_UNIT = (
+    r"(degrees\s+)?(°?\s*[cf]|celsius|fahrenheit|km|kilometers?|miles?|mi|mph|kph|km/h|knots?|inch(es)?|cm|mm|feet|"
+    r"foot|ft|meters?|m|kg|lbs?|pounds?|hpa|mb|millibars?|inhg)"
+)
+# a unit must follow "to" or "in", so that "below 30 f in Chicago" or "5 mi to the storm" are not conversions
+UNIT_CONVERSION_PATTERN = (
+    rf"(?i)\bconvert\b.*\b(to|into|in)\s+{_UNIT}\b"
+    rf"|\bhow many\s+{_UNIT}\s+(are\s+)?in\s+(an?\s+|one\s+|\d+(\.\d+)?\s*)?{_UNIT}\b"
+    rf"|\b\d+(\.\d+)?\s*{_UNIT}\s+(to|into|in)\s+{_UNIT}\b"
+)
+
+
+@dataclass
+class RoutingContext:
+    """
+    What a routing rule can base its decision on.
+
+    :param query:  The query of the turn.
+    :param history:  The chat history before the query.
+    :param functions:  The names of the functions selected for the turn.
+    :param query_embedding:  The embedding of the query computed for function routing, if any.
+    """
+
+    query: str
+    history: list[dict[str, Any]] = field(default_factory=list)
+    functions: list[str] = field(default_factory=list)
+    query_embedding: list[float] | None = None
+
+
+@dataclass
+class RouteDecision:
+    """
+    The model tier chosen for a turn.
+
+    :param tier:  'primary' or 'secondary'.
+    :param reason:  The name of the rule that decided, or why the turn was escalated.
+    :param confidence:  How confident the rule is, from 0 to 1.
+    """
+
+    tier: Tier
+    reason: str
+    confidence: float = 1.0
+
+
+class PatternRule:
+    """
+    Routes queries matching a regular expression to a tier.
+
+    :param pattern:  The regular expression.
+    :param tier:  The tier to route matching queries to.
+    :param name:  The name of the rule, recorded as the reason of its decisions.
+    :param confidence:  The confidence of its decisions.
+    """
+
+    def __init__(
+        self,
+        pattern: str,
+        tier: Tier = SECONDARY,
+        name: str = "pattern",
+        confidence: float = 1.0,
+    ):
+        self.pattern = re.compile(pattern)
+        self.tier = tier
+        self.name = name
+        self.confidence = confidence
+
+    def __call__(self, context: RoutingContext) -> RouteDecision | None:
+        if self.pattern.search(context.query):
+            return RouteDecision(self.tier, self.name, self.confidence)
+        return None
+
+
+class QueryLengthRule:
+    """
+    Routes short queries to the secondary model when no more than max_functions functions were selected for them.
+
+    :param max_words:  The longest query, in words, to route to the secondary model.
+    :param max_functions:  The most functions that may be selected for the turn.
+    :param confidence:  The confidence of its decisions.
+    """
+
+    def __init__(
+        self, max_words: int = 6, max_functions: int = 0, confidence: float = 0.7
+    ):
+        self.max_words = max_words
+        self.max_functions = max_functions
+        self.confidence = confidence
+
+    def __call__(self, context: RoutingContext) -> RouteDecision | None:
+        if (
+            len(context.query.split()) <= self.max_words
+            and len(context.functions) <= self.max_functions
+        ):
+            return RouteDecision(SECONDARY, "query_length", self.confidence)
+        return None
+
+
+class ToolSetRule:
+    """
+    Routes turns to the primary model when any of the given functions, or more than max_functions functions, were
+    selected for them.
+
+    :param functions:  The names of the functions that need the primary model.
+    :param max_functions:  The most functions the secondary model may be offered.  None for no limit.
+    """
+
+    def __init__(
+        self, functions: list[str] | None = None, max_functions: int | None = None
+    ):
+        self.functions = set(functions or [])
+        self.max_functions = max_functions
+
+    def __call__(self, context: RoutingContext) -> RouteDecision | None:
+        if self.functions.intersection(context.functions):
+            return RouteDecision(PRIMARY, "tool_set")
+        if (
+            self.max_functions is not None
+            and len(context.functions) > self.max_functions
+        ):
+            return RouteDecision(PRIMARY, "tool_set")
+        return None
+
+
+class ExemplarRule:
+    """
+    Routes queries like the tier of their most similar labeled exemplars, using the query embedding computed for
+    function routing. The confidence is the similarity-weighted share of the k nearest exemplars agreeing with the
+    chosen tier.
+
+    :param exemplars:  The exemplars, dictionaries with 'embedding' and 'tier' fields.
+    :param k_nearest:  The number of nearest exemplars to vote.
+    :param min_similarity:  The minimum cosine similarity for an exemplar to vote.
+    """
+
+    def __init__(
+        self, exemplars: list[dict], k_nearest: int = 5, min_similarity: float = 0.8
+    ):
+        import numpy as np
+
+        self.tiers = [exemplar["tier"] for exemplar in exemplars]
+        matrix = np.array(
+            [exemplar["embedding"] for exemplar in exemplars], dtype=float
+        )
+        if len(self.tiers):
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix
+        self.k_nearest = k_nearest
+        self.min_similarity = min_similarity
+
+    def __call__(self, context: RoutingContext) -> RouteDecision | None:
+        if not self.tiers or not context.query_embedding:
+            return None
+
+        import numpy as np
+
+        query = np.asarray(context.query_embedding, dtype=float)
+        similarities = self.matrix @ (query / np.linalg.norm(query))
+        nearest = [
+            i
+            for i in np.argsort(-similarities)[: self.k_nearest]
+            if similarities[i] >= self.min_similarity
+        ]
+        if not nearest:
+            return None
+
+        votes: dict[Tier, float] = {PRIMARY: 0.0, SECONDARY: 0.0}
+        for i in nearest:
+            votes[self.tiers[i]] += float(similarities[i])
+        tier = max(votes, key=lambda t: votes[t])
+        return RouteDecision(tier, "exemplars", votes[tier] / sum(votes.values()))
+
+
+class ModelRouter:
+    """
+    Decides per turn whether the primary or the secondary (cheaper, faster) model answers. Rules are tried in order
+    and the first one that decides wins; turns no rule decides on go to the default tier. A secondary decision with
+    a confidence under min_confidence is escalated to the primary model, and so is a secondary turn that makes more
+    than max_secondary_tool_calls tool calls, for the rest of the turn.
+
+    :param rules:  The rules, callables receiving a RoutingContext and returning a RouteDecision or None.
+                   Defaults to default_rules().
+    :param default:  The tier of turns no rule decides on.
+    :param min_confidence:  The minimum confidence to route a turn to the secondary model.
+    :param max_secondary_tool_calls:  The most tool calls a turn may make on the secondary model.
+    """
+
+    def __init__(
+        self,
+        rules: list[Callable[[RoutingContext], RouteDecision | None]] | None = None,
+        default: Tier = PRIMARY,
+        min_confidence: float = 0.6,
+        max_secondary_tool_calls: int = 1,
+    ):
+        self.rules = rules if rules is not None else self.default_rules()
+        self.default = default
+        self.min_confidence = min_confidence
+        self.max_secondary_tool_calls = max_secondary_tool_calls
+
+    @staticmethod
+    def default_rules() -> list[Callable[[RoutingContext], RouteDecision | None]]:
+        """
+        The default rules: turns for which more than one function was selected go to the primary model; otherwise
+        greetings and confirmations, and unit conversions, go to the secondary model, and so do short queries no
+        function was selected for.
+        :return:  The rules.
+        """
+        return [
+            ToolSetRule(max_functions=1),
+            PatternRule(GREETING_PATTERN, SECONDARY, name="greeting"),
+            PatternRule(UNIT_CONVERSION_PATTERN, SECONDARY, name="unit_conversion"),
+            QueryLengthRule(),
+        ]
+
+    def route(self, context: RoutingContext) -> RouteDecision:
+        """
+        Decide which model answers a turn.
+        :param context:  The turn.
+        :return:  The decision.
+        """
+        for rule in self.rules:
+            decision = rule(context)
+            if decision is None:
+                continue
+            if decision.tier == SECONDARY and decision.confidence < self.min_confidence:
+                return RouteDecision(PRIMARY, "low_confidence", decision.confidence)
+            return decision
+        return RouteDecision(self.default, "default")
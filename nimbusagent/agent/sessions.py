@@ -0,0 +1,406 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Generator
+
+from openai import OpenAI
+
+from nimbusagent.agent.base import BaseAgent
+from nimbusagent.agent.blueprint import AgentBlueprint
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.stats import AskStats
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.memory.base import AgentMemory
+
+
+class SessionStore:
+    """
+    Interface for storing evicted sessions. This base class keeps them in a dictionary in memory; subclass it to keep
+    them in a file system, database or cache instead. States are JSON serializable dictionaries.
+    """
+
+    def __init__(self):
+        self._states: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> dict[str, Any] | None:
+        """
+        Load the state of a session.
+        :param session_id:  The ID of the session.
+        :return:  The state of the session, or None if it is not stored.
+        """
+        with self._lock:
+            return self._states.get(session_id)
+
+    def save(self, session_id: str, state: dict[str, Any]) -> None:
+        """
+        Save the state of a session.
+        :param session_id:  The ID of the session.
+        :param state:  The state of the session.
+        """
+        with self._lock:
+            self._states[session_id] = state
+
+    def delete(self, session_id: str) -> None:
+        """
+        Delete the state of a session.
+        :param session_id:  The ID of the session.
+        """
+        with self._lock:
+            self._states.pop(session_id, None)
+
+
+class FileSessionStore(SessionStore):
+    """
+    Stores evicted sessions as JSON files in a directory.
+
+    :param directory:  The directory to store the sessions in.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        safe_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in session_id)
+        return os.path.join(self.directory, f"{safe_id}.json")
+
+    def load(self, session_id: str) -> dict[str, Any] | None:
+        try:
+            with open(self._path(session_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, session_id: str, state: dict[str, Any]) -> None:
+        path = self._path(session_id)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+
+    def delete(self, session_id: str) -> None:
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+class AgentSession:
+    """
+    The state of a single session: its chat history and the stats of its last ask. Its lock guards the history:
+    completion asks hold it while they run, and streaming asks only while they take a snapshot of the history and
+    while they add their turn back, so that a client that stops reading does not block the session.
+    """
+
+    __slots__ = ("session_id", "memory", "last_used", "last_stats", "lock", "streams")
+
+    def __init__(self, session_id: str, memory: AgentMemory):
+        self.session_id = session_id
+        self.memory = memory
+        self.last_used = time.monotonic()
+        self.last_stats: AskStats | None = None
+        self.lock = threading.Lock()
+        # the streaming asks in progress, which keep the session from being evicted
+        self.streams = 0
+
+    def get_state(self) -> dict[str, Any]:
+        """
+        Get the state of the session, to store it.
+        :return:  The state, as a JSON serializable dictionary.
+        """
+        return {"memory": self.memory.get_state()}
+
+
+class SessionManager:
+    """
+    Serves many chat sessions with a small pool of agents. Each session only keeps its chat history (an AgentMemory);
+    the agents are created from an AgentBlueprint on demand, up to the number of concurrent asks, and share its client,
+    parsed functions and embeddings.
+
+    Live sessions are evicted to the store when they have been idle for idle_ttl seconds, or when there are more than
+    max_live_sessions, least recently used first. They are rehydrated from the store on their next ask.
+
+    :param agent_class:  The agent class to use, CompletionAgent or StreamingAgent.
+    :param agent_options:  The options to create agents with (the keyword arguments of the agent class).
+    :param max_live_sessions:  The maximum number of sessions to keep in memory.
+    :param idle_ttl:  The number of seconds after which an idle session is evicted.  None to only evict by count.
+    :param store:  The store to evict sessions to.  Defaults to an in-memory SessionStore.
+    :param client:  The OpenAI client to share between agents.  Created from the agent options if not provided.
+    :param blueprint:  The blueprint to create agents from, instead of agent_class, agent_options and client.
+    """
+
+    def __init__(
+        self,
+        agent_class: type[BaseAgent] = CompletionAgent,
+        agent_options: dict[str, Any] | None = None,
+        max_live_sessions: int = 1000,
+        idle_ttl: float | None = 1800.0,
+        store: SessionStore | None = None,
+        client: OpenAI | None = None,
+        blueprint: AgentBlueprint | None = None,
+    ):
+        self.max_live_sessions = max_live_sessions
+        self.idle_ttl = idle_ttl
+        self.store = store if store is not None else SessionStore()
+
+        if blueprint is None:
+            agent_options = dict(agent_options or {})
+            # sessions are moderated once when they start, not every time an agent is created for them
+            agent_options.pop("message_history", None)
+            if client is not None:
+                agent_options["client"] = client
+            blueprint = AgentBlueprint(agent_class, agent_options)
+        self.blueprint = blueprint
+
+        self._sessions: OrderedDict[str, AgentSession] = OrderedDict()
+        # evicted sessions whose state is still being saved to the store
+        self._evicting: dict[str, AgentSession] = {}
+        self._idle_agents: list[BaseAgent] = []
+        self._lock = threading.Lock()
+
+    def start_session(
+        self, session_id: str, history: list[dict[str, str]] | None = None
+    ) -> AgentSession:
+        """
+        Start a session, replacing any existing session with the same ID.
+        :param session_id:  The ID of the session.
+        :param history:  The initial chat history of the session, which is moderated if moderation is enabled.
+        :return:  The session.
+        """
+        memory = self._new_memory()
+        if history:
+            agent = self._acquire_agent()
+            try:
+                if agent._history_needs_moderation(history):
+                    raise ValueError(
+                        "The message history contains inappropriate content."
+                    )
+            finally:
+                self._release_agent(agent)
+            memory.set_chat_history(history)
+
+        session = AgentSession(session_id, memory)
+        with session.lock:
+            with self._lock:
+                self._sessions[session_id] = session
+                self._sessions.move_to_end(session_id)
+                pending = self._evicting.get(session_id)
+            self._wait_for_eviction(pending)
+            self.store.delete(session_id)
+        self._evict(keep=session_id)
+        return session
+
+    def get_session(self, session_id: str) -> AgentSession:
+        """
+        Get a live session, rehydrating it from the store or starting it if needed.
+        :param session_id:  The ID of the session.
+        :return:  The session.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                # take back a session that is still being evicted; its ask waits for the save to finish
+                session = self._evicting.get(session_id)
+                if session is not None:
+                    self._sessions[session_id] = session
+            if session is not None:
+                session.last_used = time.monotonic()
+                self._sessions.move_to_end(session_id)
+        if session is not None:
+            return session
+
+        state = self.store.load(session_id)
+        if state is None:
+            return self.start_session(session_id)
+
+        memory = self._new_memory()
+        memory.load_state(state.get("memory", {}))
+        session = AgentSession(session_id, memory)
+        with self._lock:
+            # another thread may have rehydrated the session in the meantime
+            session = self._sessions.setdefault(session_id, session)
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        self._evict(keep=session_id)
+        return session
+
+    def ask(
+        self, session_id: str, query: str, **kwargs
+    ) -> str | None | Generator[Any, None, None]:
+        """
+        Ask a question in a session.
+        :param session_id:  The ID of the session.
+        :param query:  The query.
+        :param kwargs:  Extra arguments for the agent's ask().
+        :return:  The response, or a generator of the response for a StreamingAgent.
+        """
+        if issubclass(self.blueprint.agent_class, StreamingAgent):
+            return self._stream(session_id, query, **kwargs)
+
+        session = self._lock_session(session_id)
+        try:
+            agent = self._acquire_agent(session.memory)
+            try:
+                return agent.ask(query, **kwargs)
+            finally:
+                session.last_stats = agent.get_last_stats()
+                self._release_agent(agent)
+        finally:
+            session.lock.release()
+
+    def _stream(
+        self, session_id: str, query: str, **kwargs
+    ) -> Generator[Any, None, None]:
+        """
+        Stream an ask on a snapshot of the session's history, without holding the session's lock while the caller
+        reads it. The entries the ask adds are added to the session when it ends, after those of concurrent asks on
+        the same session that ended first.
+        """
+        session = self._lock_session(session_id)
+        try:
+            memory = session.memory.copy()
+            session.streams += 1
+        finally:
+            session.lock.release()
+        snapshot = set(memory.entries)
+
+        agent = self._acquire_agent(memory)
+        try:
+            yield from agent.ask(query, **kwargs)
+        finally:
+            stats = agent.get_last_stats()
+            self._release_agent(agent)
+            with session.lock:
+                for entry in memory.entries:
+                    if entry not in snapshot:
+                        session.memory.append(entry.to_dict())
+                session.last_stats = stats
+                session.streams -= 1
+
+    def get_chat_history(self, session_id: str) -> list[dict[str, str]]:
+        """
+        Get the chat history of a session.
+        :param session_id:  The ID of the session.
+        :return:  The chat history.
+        """
+        return self.get_session(session_id).memory.get_chat_history()
+
+    def end_session(self, session_id: str) -> None:
+        """
+        End a session, removing it from memory and from the store.
+        :param session_id:  The ID of the session.
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            pending = self._evicting.get(session_id)
+        self._wait_for_eviction(pending)
+        self.store.delete(session_id)
+
+    def evict_idle(self) -> int:
+        """
+        Evict the sessions that have been idle for longer than idle_ttl.
+        :return:  The number of sessions evicted.
+        """
+        return self._evict()
+
+    def flush(self) -> None:
+        """
+        Save every live session to the store, e.g. before shutting down.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            with session.lock:
+                self.store.save(session.session_id, session.get_state())
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict(self, keep: str | None = None) -> int:
+        """
+        Evict idle sessions and the least recently used sessions over max_live_sessions. Sessions with an ask in
+        progress, including streams that are not locked, are skipped. An evicted session stays in _evicting, locked, until its state is saved, so that it is
+        never missing from both the live sessions and the store.
+        :param keep:  The ID of a session not to evict, e.g. the one that is being used.
+        :return:  The number of sessions evicted.
+        """
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for session in list(self._sessions.values()):
+                over_limit = len(self._sessions) > self.max_live_sessions
+                idle = (
+                    self.idle_ttl is not None
+                    and now - session.last_used > self.idle_ttl
+                )
+                if not over_limit and not idle:
+                    # sessions are ordered by last use, so the rest are more recent
+                    break
+                if session.session_id == keep or not session.lock.acquire(
+                    blocking=False
+                ):
+                    continue
+                if session.streams:
+                    session.lock.release()
+                    continue
+                del self._sessions[session.session_id]
+                self._evicting[session.session_id] = session
+                evicted.append(session)
+
+        for session in evicted:
+            try:
+                self.store.save(session.session_id, session.get_state())
+            finally:
+                with self._lock:
+                    if self._evicting.get(session.session_id) is session:
+                        del self._evicting[session.session_id]
+                session.lock.release()
+        return len(evicted)
+
+    @staticmethod
+    def _wait_for_eviction(session: AgentSession | None) -> None:
+        """
+        Wait until an evicted session has been saved to the store.
+        """
+        if session is not None:
+            with session.lock:
+                pass
+
+    def _lock_session(self, session_id: str) -> AgentSession:
+        """
+        Get a live session and acquire its lock. A session that was evicted or replaced while waiting for the lock is
+        released and looked up again, so that an ask never changes a session that is no longer live.
+        """
+        while True:
+            session = self.get_session(session_id)
+            session.lock.acquire()
+            with self._lock:
+                if self._sessions.get(session_id) is session:
+                    return session
+            session.lock.release()
+
+    def _new_memory(self) -> AgentMemory:
+        return self.blueprint.new_memory()
+
+    def _acquire_agent(self, memory: AgentMemory | None = None) -> BaseAgent:
+        """
+        Take an idle agent from the pool, or create one, and give it the memory to ask with.
+        """
+        with self._lock:
+            agent = self._idle_agents.pop() if self._idle_agents else None
+        if agent is None:
+            agent = self.blueprint.new_agent()
+        if memory is not None:
+            agent.chat_history = memory
+            agent.function_handler.chat_history = memory
+        return agent
+
+    def _release_agent(self, agent: BaseAgent) -> None:
+        """
+        Return an agent to the pool.
+        """
+        with self._lock:
+            self._idle_agents.append(agent)
@@ -0,0 +1,278 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+
+@dataclass
+class LoopStats:
+    """
+    Class that stores the usage and timing of a single model call within an ask.
+    All durations are in seconds.
+
+    :param model:  The name of the model that was called.
+    :param prompt_tokens:  The number of prompt tokens reported by the API.
+    :param completion_tokens:  The number of completion tokens reported by the API.
+    :param cached_tokens:  The number of prompt tokens that were served from the prompt cache.
+    :param time_to_first_token:  The time from the request until the first chunk arrived (streaming only).
+    :param duration:  The total time of the model call, including reading the stream.
+    :param hedged:  True if a hedge of the model call was sent.
+    :param hedge_won:  True if the hedge responded first.
+    """
+
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    time_to_first_token: float | None = None
+    duration: float = 0.0
+    hedged: bool = False
+    hedge_won: bool = False
+    started_at: float = field(default_factory=time.perf_counter, repr=False)
+
+    def add_usage(self, usage: Any) -> None:
+        """
+        Add the token usage reported by the API.
+        :param usage:  The `usage` object of a chat completion or of the final stream chunk.
+        """
+        if usage is None:
+            return
+
+        self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        if details is not None:
+            self.cached_tokens += getattr(details, "cached_tokens", 0) or 0
+
+    def mark_first_token(self) -> None:
+        """
+        Record the time to first token, if it has not been recorded yet.
+        """
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.started_at
+
+    def finish(self) -> None:
+        """
+        Record the total duration of the model call.
+        """
+        self.duration = time.perf_counter() - self.started_at
+
+
+@dataclass
+class ToolCallStats:
+    """
+    Class that stores the timing of a single tool (function) call.
+
+    :param name:  The name of the function that was called.
+    :param duration:  The time spent in the function, in seconds.
+    """
+
+    name: str
+    duration: float
+
+
+@dataclass
+class AskStats:
+    """
+    Class that stores token usage and latency for a single call to `ask()`.
+    All durations are in seconds.
+
+    :param loops:  The stats of every model call made during the ask.
+    :param tool_calls:  The stats of every tool call made during the ask.
+    :param moderation_time:  The time spent in the moderation API.
+    :param embedding_time:  The time spent routing functions with embeddings.
+    :param time_to_first_token:  The time from the start of the ask until the first content was yielded (streaming).
+    :param total_time:  The wall time of the ask.
+    :param response_cache:  'exact' or 'semantic' if the response was served from the response cache.
+    :param retries:  The number of API calls retried after transient errors.
+    :param retry_time:  The time spent waiting between retries.
+    :param continuations:  The number of responses continued after their stream failed mid-way.
+    :param rate_limit_wait:  The time API calls waited for the client-side rate limiter.
+    :param moderation_skipped:  True if moderation was unavailable and the query was let through or refused by policy.
+    :param cancelled:  True if the ask was cancelled before it finished.
+    :param model_route:  'primary' or 'secondary', the model tier the model router chose for the ask.
+    :param model_route_reason:  The rule that chose the model tier.
+    :param model_route_escalated:  True if the ask was escalated from the secondary to the primary model mid-turn.
+    """
+
+    loops: list[LoopStats] = field(default_factory=list)
+    tool_calls: list[ToolCallStats] = field(default_factory=list)
+    moderation_time: float = 0.0
+    embedding_time: float = 0.0
+    time_to_first_token: float | None = None
+    total_time: float = 0.0
+    response_cache: str | None = None
+    retries: int = 0
+    retry_time: float = 0.0
+    continuations: int = 0
+    rate_limit_wait: float = 0.0
+    moderation_skipped: bool = False
+    cancelled: bool = False
+    model_route: str | None = None
+    model_route_reason: str | None = None
+    model_route_escalated: bool = False
+    finished: bool = False
+    started_at: float = field(default_factory=time.perf_counter, repr=False)
+
+    def start_loop(self, model: str) -> LoopStats:
+        """
+        Start recording a new model call.
+        :param model:  The name of the model being called.
+        :return:  The LoopStats for the new model call.
+        """
+        loop = LoopStats(model=model)
+        self.loops.append(loop)
+        return loop
+
+    def add_tool_call(self, name: str, duration: float) -> None:
+        """
+        Record a tool call.
+        :param name:  The name of the function that was called.
+        :param duration:  The time spent in the function, in seconds.
+        """
+        self.tool_calls.append(ToolCallStats(name=name, duration=duration))
+
+    def mark_first_token(self) -> None:
+        """
+        Record the time to first token of the ask, if it has not been recorded yet.
+        """
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.started_at
+
+    def finish(self) -> None:
+        """
+        Record the total time of the ask. Calling this more than once has no effect.
+        """
+        if self.finished:
+            return
+        self.total_time = time.perf_counter() - self.started_at
+        self.finished = True
+
+    @property
+    def loop_count(self) -> int:
+        return len(self.loops)
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(loop.prompt_tokens for loop in self.loops)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(loop.completion_tokens for loop in self.loops)
+
+    @property
+    def cached_tokens(self) -> int:
+        return sum(loop.cached_tokens for loop in self.loops)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def tool_time(self) -> float:
+        return sum(tool_call.duration for tool_call in self.tool_calls)
+
+    @property
+    def hedges(self) -> int:
+        return sum(loop.hedged for loop in self.loops)
+
+    @property
+    def hedges_won(self) -> int:
+        return sum(loop.hedge_won for loop in self.loops)
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Convert the stats to a JSON serializable dictionary.
+        :return:  The stats as a dictionary.
+        """
+        return {
+            "loop_count": self.loop_count,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "moderation_time": self.moderation_time,
+            "embedding_time": self.embedding_time,
+            "time_to_first_token": self.time_to_first_token,
+            "total_time": self.total_time,
+            "response_cache": self.response_cache,
+            "retries": self.retries,
+            "retry_time": self.retry_time,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "continuations": self.continuations,
+            "rate_limit_wait": self.rate_limit_wait,
+            "moderation_skipped": self.moderation_skipped,
+            "cancelled": self.cancelled,
+            "model_route": self.model_route,
+            "model_route_reason": self.model_route_reason,
+            "model_route_escalated": self.model_route_escalated,
+            "loops": [
+                {
+                    "model": loop.model,
+                    "prompt_tokens": loop.prompt_tokens,
+                    "completion_tokens": loop.completion_tokens,
+                    "cached_tokens": loop.cached_tokens,
+                    "time_to_first_token": loop.time_to_first_token,
+                    "duration": loop.duration,
+                    "hedged": loop.hedged,
+                    "hedge_won": loop.hedge_won,
+                }
+                for loop in self.loops
+            ],
+            "tool_calls": [
+                {"name": tool_call.name, "duration": tool_call.duration}
+                for tool_call in self.tool_calls
+            ],
+        }
+
+
+@dataclass
+class AgentStats:
+    """
+    Class that aggregates the AskStats of every ask made by an agent.
+    All durations are in seconds.
+    """
+
+    asks: int = 0
+    loops: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    tool_calls: int = 0
+    tool_time: float = 0.0
+    moderation_time: float = 0.0
+    embedding_time: float = 0.0
+    retries: int = 0
+    retry_time: float = 0.0
+    hedges: int = 0
+    hedges_won: int = 0
+    continuations: int = 0
+    rate_limit_wait: float = 0.0
+    cancelled: int = 0
+    secondary_routes: int = 0
+    route_escalations: int = 0
+    total_time: float = 0.0
+
+    def add(self, ask_stats: AskStats) -> None:
+        """
+        Add the stats of a finished ask to the totals.
+        :param ask_stats:  The stats of the ask.
+        """
+        self.asks += 1
+        self.loops += ask_stats.loop_count
+        self.prompt_tokens += ask_stats.prompt_tokens
+        self.completion_tokens += ask_stats.completion_tokens
+        self.cached_tokens += ask_stats.cached_tokens
+        self.tool_calls += len(ask_stats.tool_calls)
+        self.tool_time += ask_stats.tool_time
+        self.moderation_time += ask_stats.moderation_time
+        self.embedding_time += ask_stats.embedding_time
+        self.retries += ask_stats.retries
+        self.retry_time += ask_stats.retry_time
+        self.hedges += ask_stats.hedges
+        self.hedges_won += ask_stats.hedges_won
+        self.continuations += ask_stats.continuations
+        self.rate_limit_wait += ask_stats.rate_limit_wait
+        self.cancelled += ask_stats.cancelled
+        self.secondary_routes += ask_stats.model_route == "secondary"
+        self.route_escalations += ask_stats.model_route_escalated
+        self.total_time += ask_stats.total_time
@@ -1,67 +1,334 @@
 import json
 import logging
 import time
-from typing import Any, Generator, List
+from typing import Any, Generator, Iterable, Iterator, List, cast
 
 from nimbusagent.agent.base import BaseAgent, HAVING_TROUBLE_MSG
+from nimbusagent.agent.events import (
+    ContentChunk,
+    DataEvent,
+    FunctionEvent,
+    StreamEvent,
+    EVENT_TYPE_DATA,
+    EVENT_TYPE_FUNCTION,
+)
+from nimbusagent.agent.stats import LoopStats
+from nimbusagent.utils.cancellation import AskCancelled, CancellationToken
+
+SENTENCE_ENDINGS = (".", "!", "?", ":", ";")
+CONTINUATION_PROMPT = (
+    "Your previous response was cut off. Continue it exactly where it stopped, without repeating any of it and "
+    "without any introduction."
+)
+
+
+def _is_boundary(chunk: str) -> bool:
+    """Checks if a chunk ends a line or a sentence."""
+    return "\n" in chunk or chunk.rstrip().endswith(SENTENCE_ENDINGS)
+
+
+def coalesce_chunks(
+    chunks: Iterable[str | StreamEvent],
+    max_bytes: int = 0,
+    max_ms: float = 0.0,
+    on_boundary: bool = False,
+) -> Generator[str | StreamEvent, None, None]:
+    """
+    Coalesce small chunks into larger ones. The first chunk is passed on immediately, to keep the time to first token
+    low. After that, chunks are buffered until the buffer reaches max_bytes, the oldest buffered chunk is max_ms
+    old, or (if on_boundary is set) a chunk ends a line or a sentence. Empty chunks are dropped, and events are passed
+    on in order after flushing the buffer.
+    The age of the buffer is only checked when a chunk arrives; whatever is left is flushed at the end of the stream.
+    :param chunks:  The chunks to coalesce.
+    :param max_bytes:  Flush when the buffer reaches this many bytes (UTF-8).  0 to disable.
+    :param max_ms:  Flush when the oldest buffered chunk is this many milliseconds old.  0 to disable.
+    :param on_boundary:  Flush at the end of a line or a sentence.
+    :return:  A generator that yields the coalesced chunks.
+    """
+    buffer: list[str] = []
+    size = 0
+    started_at = 0.0
+    first = True
+    for chunk in chunks:
+        if not isinstance(chunk, str):
+            if buffer:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+            yield chunk
+            continue
+        if not chunk:
+            continue
+        if first:
+            first = False
+            yield chunk
+            continue
+
+        if not buffer:
+            started_at = time.perf_counter()
+        buffer.append(chunk)
+        size += len(chunk) if chunk.isascii() else len(chunk.encode())
+
+        if (
+            (max_bytes and size >= max_bytes)
+            or (max_ms and (time.perf_counter() - started_at) * 1000 >= max_ms)
+            or (on_boundary and _is_boundary(chunk))
+        ):
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+
+    if buffer:
+        yield "".join(buffer)
+
+
+class ContinuationStitcher:
+    """
+    Stitches the continuation of a response that was cut off to the content already sent. Models asked to continue
+    often repeat the last few words, so the start of the continuation is held back until it can be compared to the
+    end of the content already sent, and the repeated part is dropped.
+
+    :param prefix:  The content already sent.
+    :param window:  The number of characters at the end of the prefix to look for a repetition in.
+    :param min_overlap:  The shortest repetition to drop, so that a continuation that happens to start with the last
+                         character or two of the prefix is left alone.
+    """
 
-EVENT_TYPE_FUNCTION = "function"
-EVENT_TYPE_DATA = "data"
+    def __init__(self, prefix: str, window: int = 200, min_overlap: int = 4):
+        self.tail = prefix[-window:]
+        self.min_overlap = min_overlap
+        self._buffer: str | None = ""
+
+    def feed(self, content: str) -> str:
+        """
+        Add content of the continuation.
+        :param content:  The content.
+        :return:  The content to send, empty while the start of the continuation is held back.
+        """
+        if self._buffer is None:
+            return content
+        self._buffer += content
+        if len(self._buffer) < len(self.tail) and self._buffer in self.tail:
+            return ""
+        return self.flush()
+
+    def flush(self) -> str:
+        """
+        Release the start of the continuation held back, without the part repeating the prefix.
+        :return:  The content to send.
+        """
+        if self._buffer is None:
+            return ""
+        buffer, self._buffer = self._buffer, None
+        for size in range(min(len(buffer), len(self.tail)), self.min_overlap - 1, -1):
+            if self.tail.endswith(buffer[:size]):
+                return buffer[size:]
+        return buffer
 
 
 class StreamingAgent(BaseAgent):
     """Agent that streams responses to the user and can hanldle openai function calls.
     This agent is meant to be used in a streaming context, where the user can see the response as it is generated.
+
+    Content fragments from the model are often only a few characters long. To yield fewer, larger chunks, set any of
+    the coalescing options: the first token is still yielded immediately, after which fragments are buffered until
+    one of the limits is reached (see `coalesce_chunks()`).
+
+    :param coalesce_max_bytes:  Flush buffered content when it reaches this many bytes.  0 to disable.
+    :param coalesce_max_ms:  Flush buffered content when it is this many milliseconds old.  0 to disable.
+    :param coalesce_on_boundary:  Flush buffered content at the end of a line or a sentence.
+    :param max_continuations:  The maximum number of times to continue a response whose stream fails with a transient
+                               error after content was yielded, by asking the model to continue from the partial
+                               content.  0 to give up instead.
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        coalesce_max_bytes: int = 0,
+        coalesce_max_ms: float = 0.0,
+        coalesce_on_boundary: bool = False,
+        max_continuations: int = 1,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
-
-    def ask(self, query: str, max_retries: int = 1) -> Generator[str, None, None]:
+        self.coalesce_max_bytes = coalesce_max_bytes
+        self.coalesce_max_ms = coalesce_max_ms
+        self.coalesce_on_boundary = coalesce_on_boundary
+        self.max_continuations = max_continuations
+
+    def _init_state(self) -> None:
+        super()._init_state()
+        self._active_stream = None
+
+    def ask(
+        self,
+        query: str,
+        max_retries: int | None = None,
+        cancellation: CancellationToken | None = None,
+    ) -> Generator[str, None, None]:
         """
-        Ask the agent a question and return a generator that yields the response.
+        Ask the agent a question and return a generator that yields the response. The generator ends early if the
+        ask is cancelled; closing it before the end cancels the ask too.
         :param query:  The query to ask the agent.
-        :param max_retries:  The maximum number of times to retry the query if the AI fails to respond.
-        :return:  A generator that yields the response.
+        :param max_retries:  The maximum number of times to retry a model call whose stream fails with a transient
+                             error before any content was yielded.  Defaults to the retry policy's max_retries.
+        :param cancellation:  A token to cancel the ask with, in addition to cancel().
+        :return:  A generator that yields the response, with events as inline `[[[type:name:data]]]` markers.
         """
-        if self._needs_moderation(query):
-            self.last_response = self.moderation_fail_message
-            yield self.moderation_fail_message
-
-        else:
-            self._clear_internal_thoughts()
-            self._clear_last_response()
-            self.function_handler.get_functions_from_query_and_history(
-                query, self.get_chat_history()
-            )
-            self._append_to_chat_history("user", query)
-
-            ai_response = self._generate_streaming_response(max_retries=max_retries)
-            content_accumulated = []
-            for content in ai_response:
-                content_accumulated.append(content)
-                yield content
-
-            self.last_response = "".join(content_accumulated)
-            self._append_to_chat_history("assistant", self.last_response)
-
-        self.handle_on_complete()
+        # set before the generator starts, so that cancel() called before the first chunk is not lost
+        self._cancellation = cancellation or CancellationToken()
+        return cast(
+            Generator[str, None, None],
+            self._stream_ask(query, max_retries, self._cancellation, False),
+        )
+
+    def ask_events(
+        self,
+        query: str,
+        max_retries: int | None = None,
+        cancellation: CancellationToken | None = None,
+    ) -> Generator[StreamEvent, None, None]:
+        """
+        Ask the agent a question like ask(), but yield ContentChunk, FunctionEvent and DataEvent objects instead of
+        strings with inline event markers.  Events are only sent if send_events is set.
+        :param query:  The query to ask the agent.
+        :param max_retries:  The maximum number of times to retry a model call whose stream fails with a transient
+                             error before any content was yielded.  Defaults to the retry policy's max_retries.
+        :param cancellation:  A token to cancel the ask with, in addition to cancel().
+        :return:  A generator that yields the response as StreamEvent objects.
+        """
+        self._cancellation = cancellation or CancellationToken()
+        return cast(
+            Generator[StreamEvent, None, None],
+            self._stream_ask(query, max_retries, self._cancellation, True),
+        )
+
+    def _stream_ask(
+        self,
+        query: str,
+        max_retries: int | None,
+        cancellation: CancellationToken,
+        typed_events: bool,
+    ) -> Generator[str | StreamEvent, None, None]:
+        """
+        The generator of ask() and ask_events(). A cancellation is noticed between chunks: the ask stops at the next
+        chunk of the open stream, and the stream is closed by this thread, which reads it.
+        """
+        self._start_ask(cancellation)
+        try:
+            if self._needs_moderation(query):
+                self.last_response = self.moderation_fail_message
+                self.last_stats.mark_first_token()
+                self._pause_profiling()
+                if typed_events:
+                    yield ContentChunk(self.moderation_fail_message)
+                else:
+                    yield self.moderation_fail_message
+                self._resume_profiling()
+
+            else:
+                self._clear_internal_thoughts()
+                self._clear_last_response()
+                self._select_functions(query)
+                self._route_model(query)
+                cached = self._get_cached_response(query)
+                self._append_to_chat_history("user", query)
+
+                if cached is not None:
+                    ai_response: Iterator[str | StreamEvent] = iter(cached.get_chunks())
+                else:
+                    ai_response = self._generate_streaming_response(
+                        max_retries=max_retries
+                    )
+                    if (
+                        self.coalesce_max_bytes
+                        or self.coalesce_max_ms
+                        or self.coalesce_on_boundary
+                    ):
+                        ai_response = coalesce_chunks(
+                            ai_response,
+                            max_bytes=self.coalesce_max_bytes,
+                            max_ms=self.coalesce_max_ms,
+                            on_boundary=self.coalesce_on_boundary,
+                        )
+                content_accumulated = []
+                for item in ai_response:
+                    if isinstance(item, str):
+                        content_accumulated.append(item)
+                        if typed_events:
+                            if not item:
+                                continue
+                            output: str | StreamEvent = ContentChunk(item)
+                        else:
+                            output = item
+                    elif typed_events:
+                        output = item
+                    else:
+                        output = item.to_marker()
+                        content_accumulated.append(output)
+
+                    if output:
+                        self.last_stats.mark_first_token()
+                    self._pause_profiling()
+                    yield output
+                    self._resume_profiling()
+
+                if self._cancellation.cancelled:
+                    self._cancel_turn(query)
+                    return
+                self.last_response = "".join(content_accumulated)
+                self._append_to_chat_history("assistant", self.last_response)
+                self._set_cached_response(self.last_response, content_accumulated)
+
+            self.handle_on_complete()
+        except AskCancelled:
+            # cancelled while waiting to retry the stream
+            self._cancel_turn(query)
+        except GeneratorExit:
+            self._cancellation.cancel()
+            self._cancel_turn(query)
+            raise
+        finally:
+            self._close_active_stream()
+            self._finish_ask()
+
+    def _close_active_stream(self) -> None:
+        """
+        Close the response stream of the current model call, if any. When the caller stops iterating early (closing
+        the generator returned by ask()), this releases the upstream connection instead of leaving it to be read to
+        the end or garbage collected.
+        """
+        stream = self._active_stream
+        self._active_stream = None
+        if stream is not None and hasattr(stream, "close"):
+            try:
+                stream.close()
+            except Exception as e:
+                logging.warning("Unable to close the response stream: %s", e)
 
     def _generate_streaming_response(
-        self, max_retries: int = 1
-    ) -> Generator[str, None, None]:
+        self, max_retries: int | None = None
+    ) -> Generator[str | StreamEvent, None, None]:
         """
-        Generate a response from the AI and return a generator that yields the response.
-        :param max_retries:  The maximum number of times to retry the query if the AI fails to respond.
+        Generate a response from the AI and return a generator that yields the response. Errors creating a model call
+        are retried by the retry policy; a stream that fails with a transient error before yielding any content is
+        retried up to max_retries times, and one that fails after yielding content is continued up to
+        max_continuations times, within the same retry budget.
+        :param max_retries:  The maximum number of times to retry a failed stream.  Defaults to the policy's.
         :return:  A generator that yields the response.
         """
 
-        def generate() -> Generator[str, None, None]:
+        def generate() -> Generator[str | StreamEvent, None, None]:
             """
             Generate a response from the AI and return a generator that yields the response.
             :return:  A generator that yields the response.
             """
-            retries = max_retries
+            retries = 0
+            continuations = 0
+            # the content of the current response yielded so far, and the stitcher of its continuation, if any
+            partial_content: list[str] = []
+            stitcher = None
 
             def output_post_content(post_content: List[str]):
                 if post_content:
@@ -74,17 +341,17 @@ class StreamingAgent(BaseAgent):
                     return out_content
                 return ""
 
-            def output_event(event_type: str, name: str, data: Any):
-
-                if not data:
-                    return f"[[[{event_type}:{name}]]]"
+            def finish_stream(finished_stream: Any, stats: LoopStats):
+                """Reads the rest of the stream to collect the usage chunk."""
+                for chunk in finished_stream:
+                    if getattr(chunk, "usage", None):
+                        stats.add_usage(chunk.usage)
+                stats.finish()
 
-                if not isinstance(data, str):
-                    data = json.dumps(data)
-                    if len(data) > self.max_event_size:
-                        data = '{"error":"data too large"}'
-
-                return f"[[[{event_type}:{name}:{data}]]]"
+            def output_event(event_type: str, name: str, data: Any) -> StreamEvent:
+                if event_type == EVENT_TYPE_FUNCTION:
+                    return FunctionEvent(name, data or None)
+                return DataEvent.create(name, data, self.max_event_size)
 
             loops = 0
             post_content_items = []
@@ -94,107 +361,190 @@ class StreamingAgent(BaseAgent):
             while loops < self.loops_max:
                 loops += 1
                 has_content = False
-                try:
-                    if len(self.internal_thoughts) == 1:
-                        if self.function_handler.always_use:
-                            self.function_handler.remove_functions_mappings(
-                                self.function_handler.always_use
-                            )
+                stream: Any = None
+                continuation: list[dict[str, str]] = []
+                if stitcher is not None:
+                    continuation = [
+                        {"role": "assistant", "content": "".join(partial_content)},
+                        {"role": "user", "content": CONTINUATION_PROMPT},
+                    ]
+                else:
+                    partial_content = []
+                with self._trace.span("model_loop", {"loop": loops}):
+                    try:
+                        if len(self.internal_thoughts) == 1:
+                            if self.function_handler.always_use:
+                                self.function_handler.remove_functions_mappings(
+                                    self.function_handler.always_use
+                                )
 
-                    stream = self._create_chat_completion(
-                        messages=[self.system_message]
-                        + self.chat_history.get_chat_history()
-                        + self.internal_thoughts,
-                        stream=True,
-                        use_secondary_model=use_secondary_model,
-                        force_no_functions=force_no_functions,
-                    )
-                    func_call = {
-                        "name": None,
-                        "arguments": "",
-                    }
-                    use_secondary_model = False
-                    force_no_functions = False
-
-                    for message in stream:
-                        if (
-                            message is None
-                            or not message.choices
-                            or not message.choices[0]
-                        ):
-                            continue
+                        stream = self._create_chat_completion(
+                            messages=[self.system_message]
+                            + self.chat_history.get_chat_history()
+                            + self.internal_thoughts
+                            + continuation,
+                            stream=True,
+                            use_secondary_model=use_secondary_model,
+                            force_no_functions=force_no_functions,
+                        )
+                        self._active_stream = stream
+                        loop_stats = self.last_stats.loops[-1]
+                        func_call: dict[str, Any] = {
+                            "name": None,
+                            "arguments": "",
+                        }
+                        use_secondary_model = False
+                        force_no_functions = False
+
+                        for message in stream:
+                            self._cancellation.raise_if_cancelled()
+                            if message is not None and getattr(message, "usage", None):
+                                loop_stats.add_usage(message.usage)
+
+                            if (
+                                message is None
+                                or not message.choices
+                                or not message.choices[0]
+                            ):
+                                continue
+
+                            delta = message.choices[0].delta
+                            if not delta:
+                                break
+                            loop_stats.mark_first_token()
+
+                            if delta.tool_calls:
+                                tool_call = delta.tool_calls[0]
+                                index = tool_call.index
+                                if index == len(tool_calls):
+                                    tool_calls.append(
+                                        {
+                                            "id": None,
+                                            "type": "function",
+                                            "function": {
+                                                "name": "",
+                                                "arguments": "",
+                                            },
+                                        }
+                                    )
 
-                        delta = message.choices[0].delta
-                        if not delta:
-                            break
+                                if tool_call.id:
+                                    tool_calls[index]["id"] = tool_call.id
+                                if tool_call.function:
+                                    if tool_call.function.name:
+                                        tool_calls[index]["function"][
+                                            "name"
+                                        ] = tool_call.function.name
+                                    if tool_call.function.arguments:
+                                        tool_calls[index]["function"][
+                                            "arguments"
+                                        ] += tool_call.function.arguments
+
+                            elif delta.function_call:
+                                if delta.function_call.name:
+                                    func_call["name"] = delta.function_call.name
+                                if delta.function_call.arguments:
+                                    func_call[
+                                        "arguments"
+                                    ] += delta.function_call.arguments
+
+                            finish_reason = message.choices[0].finish_reason
+                            # NEW: If finish_reason is 'stop' but we have tool calls, override to 'tool_calls'
+                            if finish_reason == "stop" and tool_calls:
+                                finish_reason = "tool_calls"
 
-                        if delta.tool_calls:
-                            tool_call = delta.tool_calls[0]
-                            index = tool_call.index
-                            if index == len(tool_calls):
-                                tool_calls.append(
+                            if finish_reason == "tool_calls":
+                                self.internal_thoughts.append(
                                     {
-                                        "id": None,
-                                        "type": "function",
-                                        "function": {
-                                            "name": "",
-                                            "arguments": "",
-                                        },
+                                        "role": "assistant",
+                                        "content": None,
+                                        "tool_calls": tool_calls,
                                     }
                                 )
 
-                            if tool_call.id:
-                                tool_calls[index]["id"] = tool_call.id
-                            if tool_call.function:
-                                if tool_call.function.name:
-                                    tool_calls[index]["function"][
-                                        "name"
-                                    ] = tool_call.function.name
-                                if tool_call.function.arguments:
-                                    tool_calls[index]["function"][
-                                        "arguments"
-                                    ] += tool_call.function.arguments
-
-                        elif delta.function_call:
-                            if delta.function_call.name:
-                                func_call["name"] = delta.function_call.name
-                            if delta.function_call.arguments:
-                                func_call["arguments"] += delta.function_call.arguments
-
-                        finish_reason = message.choices[0].finish_reason
-                        # NEW: If finish_reason is 'stop' but we have tool calls, override to 'tool_calls'
-                        if finish_reason == "stop" and tool_calls:
-                            finish_reason = "tool_calls"
-
-                        if finish_reason == "tool_calls":
-                            self.internal_thoughts.append(
-                                {
-                                    "role": "assistant",
-                                    "content": None,
-                                    "tool_calls": tool_calls,
-                                }
-                            )
+                                # Handle tool calls
+                                logging.info("Handling tool calls: %s", tool_calls)
+                                content_send_directly_to_user = []
+
+                                for tool_call in tool_calls:
+                                    func_name = tool_call["function"]["name"]
+                                    if func_name is None:
+                                        continue
+
+                                    func_args = tool_call["function"]["arguments"]
+
+                                    if self.send_events:
+                                        yield output_event(
+                                            EVENT_TYPE_FUNCTION, func_name, func_args
+                                        )
+
+                                    func_results = self._handle_function_call(
+                                        func_name, func_args
+                                    )
+                                    if func_results is not None:
+                                        if (
+                                            func_results.stream_data
+                                            and self.send_events
+                                        ):
+                                            for (
+                                                key,
+                                                value,
+                                            ) in func_results.stream_data.items():
+                                                yield output_event(
+                                                    EVENT_TYPE_DATA, key, value
+                                                )
+
+                                        if (
+                                            func_results.send_directly_to_user
+                                            and func_results.content
+                                        ):
+                                            content_send_directly_to_user.append(
+                                                func_results.content
+                                            )
+                                            continue
+
+                                        if func_results.content:
+                                            self.internal_thoughts.append(
+                                                {
+                                                    "tool_call_id": tool_call["id"],
+                                                    "role": "tool",
+                                                    "name": func_name,
+                                                    "content": func_results.content,
+                                                }
+                                            )
 
-                            # Handle tool calls
-                            logging.info("Handling tool calls: %s", tool_calls)
-                            content_send_directly_to_user = []
+                                        if func_results.use_secondary_model:
+                                            use_secondary_model = True
+                                        if func_results.force_no_functions:
+                                            force_no_functions = True
 
-                            for tool_call in tool_calls:
-                                func_name = tool_call["function"]["name"]
-                                if func_name is None:
-                                    continue
+                                if content_send_directly_to_user:
+                                    self._skip_cached_response()
+                                    finish_stream(stream, loop_stats)
+                                    yield output_content(
+                                        "\n".join(content_send_directly_to_user)
+                                    )
+                                    yield output_post_content(post_content_items)
+                                    return
 
-                                func_args = tool_call["function"]["arguments"]
+                                tool_calls = []  # reset tool calls
 
+                            elif finish_reason == "function_call":
                                 if self.send_events:
                                     yield output_event(
-                                        EVENT_TYPE_FUNCTION, func_name, func_args
+                                        EVENT_TYPE_FUNCTION,
+                                        func_call["name"],
+                                        json.dumps(
+                                            self.function_handler.get_args(
+                                                func_call["arguments"]
+                                            )
+                                        ),
                                     )
 
-                                func_results = (
-                                    self.function_handler.handle_function_call(
-                                        func_name, func_args
-                                    )
+                                # Handle function call
+                                logging.info("Handling function call: %s", func_call)
+                                func_results = self._handle_function_call(
+                                    func_call["name"], func_call["arguments"]
                                 )
                                 if func_results is not None:
                                     if func_results.stream_data and self.send_events:
@@ -210,130 +560,124 @@ class StreamingAgent(BaseAgent):
                                         func_results.send_directly_to_user
                                         and func_results.content
                                     ):
-                                        content_send_directly_to_user.append(
-                                            func_results.content
-                                        )
-                                        continue
+                                        self._skip_cached_response()
+                                        finish_stream(stream, loop_stats)
+                                        yield func_results.content
+                                        yield output_post_content(post_content_items)
+                                        return
+
+                                    # Add the function call to the internal thoughts so the AI knows it called it
+                                    self.internal_thoughts.append(
+                                        {
+                                            "role": "assistant",
+                                            "content": None,
+                                            "function_call": {
+                                                "name": func_call["name"],
+                                                "arguments": func_call["arguments"],
+                                            },
+                                        }
+                                    )
 
-                                    if func_results.content:
-                                        self.internal_thoughts.append(
-                                            {
-                                                "tool_call_id": tool_call["id"],
-                                                "role": "tool",
-                                                "name": func_name,
-                                                "content": func_results.content,
-                                            }
-                                        )
+                                    self.internal_thoughts.append(
+                                        {
+                                            "role": "function",
+                                            "content": func_results.content,
+                                            "name": func_call["name"],
+                                        }
+                                    )
 
+                                    if func_results.post_content:
+                                        post_content_items.append(
+                                            func_results.post_content
+                                        )
                                     if func_results.use_secondary_model:
                                         use_secondary_model = True
                                     if func_results.force_no_functions:
                                         force_no_functions = True
 
-                            if content_send_directly_to_user:
-                                yield output_content(
-                                    "\n".join(content_send_directly_to_user)
-                                )
+                            content = delta.content
+                            if content is not None:
+                                has_content = True
+                                if stitcher is not None:
+                                    content = stitcher.feed(content)
+                                partial_content.append(content)
+                                yield output_content(content)
+
+                            if finish_reason == "stop":
+                                if stitcher is not None:
+                                    yield output_content(stitcher.flush())
+                                finish_stream(stream, loop_stats)
                                 yield output_post_content(post_content_items)
                                 return
-
-                            tool_calls = []  # reset tool calls
-
-                        elif finish_reason == "function_call":
-                            if self.send_events:
-                                yield output_event(
-                                    EVENT_TYPE_FUNCTION,
-                                    func_call["name"],
-                                    json.dumps(
-                                        self.function_handler.get_args(
-                                            func_call["arguments"]
-                                        )
-                                    ),
-                                )
-
-                            # Handle function call
-                            logging.info("Handling function call: %s", func_call)
-                            func_results = self.function_handler.handle_function_call(
-                                func_call["name"], func_call["arguments"]
-                            )
-                            if func_results is not None:
-                                if func_results.stream_data and self.send_events:
-                                    for key, value in func_results.stream_data.items():
-                                        yield output_event(EVENT_TYPE_DATA, key, value)
-
-                                if (
-                                    func_results.send_directly_to_user
-                                    and func_results.content
-                                ):
-                                    yield func_results.content
+                            if (
+                                len(self.internal_thoughts)
+                                > self.internal_thoughts_max_entries
+                            ):
+                                self._skip_cached_response()
+                                finish_stream(stream, loop_stats)
+                                if post_content_items:
                                     yield output_post_content(post_content_items)
-                                    return
-
-                                # Add the function call to the internal thoughts so the AI knows it called it
-                                self.internal_thoughts.append(
-                                    {
-                                        "role": "assistant",
-                                        "content": None,
-                                        "function_call": {
-                                            "name": func_call["name"],
-                                            "arguments": func_call["arguments"],
-                                        },
-                                    }
-                                )
-
-                                self.internal_thoughts.append(
-                                    {
-                                        "role": "function",
-                                        "content": func_results.content,
-                                        "name": func_call["name"],
-                                    }
-                                )
-
-                                if func_results.post_content:
-                                    post_content_items.append(func_results.post_content)
-                                if func_results.use_secondary_model:
-                                    use_secondary_model = True
-                                if func_results.force_no_functions:
-                                    force_no_functions = True
+                                else:
+                                    num_thoughts = len(self.internal_thoughts)
+                                    logging.error(
+                                        f"Too many internal thoughts: {num_thoughts}."
+                                    )
+                                    yield "Too many internal thoughts."
+                                return
 
-                        content = delta.content
-                        if content is not None:
-                            has_content = True
-                            yield output_content(delta.content)
+                        loop_stats.finish()
+                        if stitcher is not None:
+                            yield output_content(stitcher.flush())
+                            stitcher = None
 
-                        if finish_reason == "stop":
-                            yield output_post_content(post_content_items)
+                    except Exception as e:
+                        if self._cancellation.cancelled:
                             return
+                        # release the connection of the failed stream before retrying or continuing
+                        self._close_active_stream()
+                        logging.error(
+                            "Exception encountered: %s (%s)",
+                            str(e),
+                            type(e).__name__,
+                            exc_info=True,
+                        )
+
+                        # errors creating the call were already retried by the retry policy
                         if (
-                            len(self.internal_thoughts)
-                            > self.internal_thoughts_max_entries
+                            stream is not None
+                            and not has_content
+                            and self._retry.should_retry(
+                                "chat", retries, e, max_retries=max_retries
+                            )
                         ):
-                            if post_content_items:
-                                yield output_post_content(post_content_items)
-                            else:
-                                num_thoughts = len(self.internal_thoughts)
-                                logging.error(
-                                    f"Too many internal thoughts: {num_thoughts}."
-                                )
-                                yield "Too many internal thoughts."
-                            return
-
-                except Exception as e:
-                    logging.error(
-                        "Exception encountered: %s (%s)",
-                        str(e),
-                        type(e).__name__,
-                        exc_info=True,
-                    )
-
-                    if retries > 0 and not has_content:
-                        retries -= 1
-                        time.sleep(1)
-                        continue
-                    yield output_content("AI temporarily unavailable.")
-                    break
+                            retries += 1
+                            tool_calls = []
+                            continue
+                        if (
+                            has_content
+                            and continuations < self.max_continuations
+                            and self._retry.should_retry(
+                                "continuation",
+                                continuations,
+                                e,
+                                max_retries=self.max_continuations,
+                            )
+                        ):
+                            if stitcher is not None:
+                                pending = stitcher.flush()
+                                partial_content.append(pending)
+                                yield output_content(pending)
+                            continuations += 1
+                            self.last_stats.continuations += 1
+                            stitcher = ContinuationStitcher("".join(partial_content))
+                            tool_calls = []
+                            continue
+                        self._skip_cached_response()
+                        yield output_content("AI temporarily unavailable.")
+                        break
 
             if loops >= self.loops_max:
+                self._skip_cached_response()
                 yield output_content(HAVING_TROUBLE_MSG)
 
         return generate()
@@ -3,20 +3,46 @@ import inspect
 import json
 import logging
 import re
+import time
 from dataclasses import dataclass
 from typing import Any, Callable, Type, Literal
 
-import tiktoken
+from openai import OpenAI
 from openai.types.chat import ChatCompletionToolParam
 
 from nimbusagent.functions import parser
-from nimbusagent.functions.responses import FuncResponse, DictFuncResponse
+from nimbusagent.functions.responses import (
+    FuncResponse,
+    DictFuncResponse,
+    FuncResult,
+)
 from nimbusagent.memory.base import AgentMemory
 from nimbusagent.utils.helper import (
     combine_lists_unique,
     FUNCTIONS_EMBEDDING_MODEL,
     find_similar_embedding_list,
+    get_embedding,
+    EmbeddingIndex,
+    LRUCache,
+)
+from nimbusagent.utils.lazy import get_encoding
+from nimbusagent.utils.metrics import (
+    Metrics,
+    NOOP_METRICS,
+    EMBEDDING_CACHE_TOTAL,
+    EMBEDDING_SECONDS,
+    TOOL_CALL_ERRORS_TOTAL,
+    TOOL_CALL_SECONDS,
+)
+from nimbusagent.utils.cancellation import (
+    AskCancelled,
+    CancellationToken,
+    _current_token,
 )
+from nimbusagent.utils.circuit_breaker import CircuitBreaker
+from nimbusagent.utils.rate_limit import PRIORITY_INTERACTIVE, RateLimiter
+from nimbusagent.utils.retry import RetryBudget
+from nimbusagent.utils.tracing import Trace, NOOP_TRACE
 
 
 @dataclass
@@ -26,7 +52,7 @@ class FunctionInfo:
     """
 
     name: str
-    definition: str
+    definition: dict
     mapping: Callable | Any
     mapping_name: str
     tokens: int
@@ -48,9 +74,16 @@ class FunctionHandler:
     :param calling_function_stop_callback:  The callback to call when a function is finished being called.  If None,
                             no callback will be called.
     :param chat_history:  The chat history to use.  If None, no chat history will be used.
+    :param metrics:  The metrics to record tool calls and embedding routing to.  If None, no metrics are recorded.
+    :param embedding_cache:  The cache to store query embeddings in.  If None, query embeddings are not cached.
+    :param client:  The OpenAI client to fetch query embeddings with.  If None, a new client is created per request.
+    :param function_definitions:  Precompiled function definitions and token counts by function name, e.g. from an
+                            AgentBlueprint.  If None, functions are parsed on first use and kept for later asks.
+    :param embedding_index:  A precompiled index of the function embeddings.  If None, the embeddings are compared
+                            one by one.
     """
 
-    functions = None
+    functions: list[dict[str, Any]] | None = None
     functions_class_options = None
     func_mapping = None
     always_use = None
@@ -60,6 +93,15 @@ class FunctionHandler:
     chat_history: AgentMemory | None = None
     processed_functions = None
     max_tokens = 0
+    token_encoding = "cl100k_base"
+    last_embedding_time = 0.0
+    last_query_embedding: list[float] | None = None
+    trace: Trace = NOOP_TRACE
+    retry: RetryBudget | None = None
+    cancellation: CancellationToken | None = None
+    rate_limiter: RateLimiter | None = None
+    rate_limit_priority: int = PRIORITY_INTERACTIVE
+    embeddings_breaker: CircuitBreaker | None = None
 
     def __init__(
         self,
@@ -77,6 +119,11 @@ class FunctionHandler:
         calling_function_stop_callback: Callable | None = None,
         chat_history: AgentMemory | None = None,
         max_tokens: int = 0,
+        metrics: Metrics | None = None,
+        embedding_cache: LRUCache | None = None,
+        client: OpenAI | None = None,
+        function_definitions: dict[str, tuple[dict, int]] | None = None,
+        embedding_index: EmbeddingIndex | None = None,
     ):
 
         self.functions_class_options = functions_class_options
@@ -89,14 +136,28 @@ class FunctionHandler:
         self.pattern_groups = pattern_groups
         self.pattern_mode = pattern_mode
         self.chat_history = chat_history
-        self.encoding = tiktoken.get_encoding("cl100k_base")
+        self._encoding = None
         self.max_tokens = max_tokens
+        self.metrics = metrics if metrics is not None else NOOP_METRICS
+        self.embedding_cache = embedding_cache
+        self.client = client
+        self.function_definitions = (
+            function_definitions if function_definitions is not None else {}
+        )
+        self.embedding_index = embedding_index
 
         self.orig_functions = (
             {func.__name__: func for func in functions} if functions else None
         )
         if not embeddings:
-            self.functions = self.parse_functions(functions)
+            self.functions = [
+                (
+                    self.function_definitions[func.__name__][0]
+                    if func.__name__ in self.function_definitions
+                    else parser.func_metadata(func)
+                )
+                for func in functions or []
+            ]
             self.func_mapping = self.create_func_mapping(functions)
 
         self.calling_function_start_callback = calling_function_start_callback
@@ -127,8 +188,7 @@ class FunctionHandler:
         if not func:
             return None
 
-        func_definition = parser.func_metadata(func)
-        func_tokens = self.tokenize(json.dumps(func_definition))
+        func_definition, func_tokens = self.get_function_definition(func_name)
         mapping_name, mapping = self.create_individual_func_mapping(func)
         return FunctionInfo(
             name=func_name,
@@ -138,6 +198,20 @@ class FunctionHandler:
             mapping_name=mapping_name,
         )
 
+    def get_function_definition(self, func_name: str) -> tuple[dict, int]:
+        """
+        Get the definition of a function and its token count, parsing the function the first time it is used.
+        :param func_name:  The name of the function, which must be one of the handler's functions.
+        :return:  The function definition and its number of tokens.
+        """
+        definition = self.function_definitions.get(func_name)
+        if definition is None:
+            assert self.orig_functions is not None
+            func_definition = parser.func_metadata(self.orig_functions[func_name])
+            definition = (func_definition, self.tokenize(json.dumps(func_definition)))
+            self.function_definitions[func_name] = definition
+        return definition
+
     def _get_group_function(self, query: str) -> list[str] | None:
         """
         Get the list of functions to use based on the pattern groups.
@@ -199,7 +273,7 @@ class FunctionHandler:
                     the function_handler.
         """
         if functions:
-            self.functions = [parser.func_metadata(func.mapping) for func in functions]
+            self.functions = [func.definition for func in functions]
             self.func_mapping = {func.mapping_name: func.mapping for func in functions}
         else:
             self.functions = None
@@ -213,6 +287,19 @@ class FunctionHandler:
         :param query:  The query to use.
         :param history:  The history to use. A list of dictionaries with 'role' and 'content' fields.
         """
+        with self.trace.span("get_functions_from_query_and_history"):
+            self._get_functions_from_query_and_history(query, history)
+
+    def _get_functions_from_query_and_history(
+        self, query: str, history: list[dict[str, Any]]
+    ):
+        """
+        Get the functions to use based on the query and history.
+        :param query:  The query to use.
+        :param history:  The history to use. A list of dictionaries with 'role' and 'content' fields.
+        """
+        self.last_embedding_time = 0.0
+        self.last_query_embedding = None
         if not self.orig_functions:
             return None
 
@@ -232,7 +319,11 @@ class FunctionHandler:
                 actual_function_names = []
 
             if self.embeddings_fetcher:
-                found_functions = self.embeddings_fetcher(query, history)
+                start = time.perf_counter()
+                with self.trace.span("embeddings_fetcher"):
+                    found_functions = self.embeddings_fetcher(query, history)
+                self.last_embedding_time = time.perf_counter() - start
+                self.metrics.observe(EMBEDDING_SECONDS, self.last_embedding_time)
                 if found_functions:
                     actual_function_names = combine_lists_unique(
                         actual_function_names, found_functions
@@ -252,13 +343,31 @@ class FunctionHandler:
                 recent_history_and_query_str = " ".join(recent_history_and_query)
 
                 if self.embeddings:
-                    similar_functions = find_similar_embedding_list(
-                        recent_history_and_query_str,
-                        function_embeddings=self.embeddings,
-                        embeddings_model=self.embeddings_model,
-                        k_nearest_neighbors=self.k_nearest,
+                    start = time.perf_counter()
+                    self.last_query_embedding = self._get_query_embedding(
+                        recent_history_and_query_str
                     )
-                    similar_function_names = [d["name"] for d in similar_functions]
+                    if self.last_query_embedding is None:
+                        # embeddings are unavailable: use always_use and pattern groups only
+                        similar_functions: list[dict] | None = []
+                    elif self.embedding_index is not None:
+                        similar_functions = self.embedding_index.search(
+                            self.last_query_embedding,
+                            k_nearest_neighbors=self.k_nearest,
+                        )
+                    else:
+                        similar_functions = find_similar_embedding_list(
+                            recent_history_and_query_str,
+                            function_embeddings=self.embeddings,
+                            embeddings_model=self.embeddings_model,
+                            k_nearest_neighbors=self.k_nearest,
+                            query_embedding=self.last_query_embedding,
+                        )
+                    self.last_embedding_time = time.perf_counter() - start
+                    self.metrics.observe(EMBEDDING_SECONDS, self.last_embedding_time)
+                    similar_function_names = [
+                        d["name"] for d in similar_functions or []
+                    ]
                     if similar_function_names:
                         actual_function_names = combine_lists_unique(
                             actual_function_names, similar_function_names
@@ -295,6 +404,48 @@ class FunctionHandler:
         # step 6: update self.functions and self.func_mapping
         self._set_functions_and_mappings(processed_functions)
 
+    def _get_query_embedding(self, text: str) -> list[float] | None:
+        """
+        Get the embedding of the given text, using the embedding cache if one is set.
+        :param text:  The text to get the embedding of.
+        :return:  The embedding, or None if it could not be fetched.
+        """
+        if not text:
+            return None
+
+        if self.embedding_cache is None:
+            with self.trace.span("get_embedding"):
+                return get_embedding(
+                    text,
+                    model=self.embeddings_model,
+                    client=self.client,
+                    retry=self.retry,
+                    rate_limiter=self.rate_limiter,
+                    priority=self.rate_limit_priority,
+                    circuit_breaker=self.embeddings_breaker,
+                )
+
+        key = (self.embeddings_model, text)
+        embedding = self.embedding_cache.get(key)
+        if embedding is not None:
+            self.metrics.inc(EMBEDDING_CACHE_TOTAL, labels={"result": "hit"})
+            return embedding
+
+        self.metrics.inc(EMBEDDING_CACHE_TOTAL, labels={"result": "miss"})
+        with self.trace.span("get_embedding"):
+            embedding = get_embedding(
+                text,
+                model=self.embeddings_model,
+                client=self.client,
+                retry=self.retry,
+                rate_limiter=self.rate_limiter,
+                priority=self.rate_limit_priority,
+                circuit_breaker=self.embeddings_breaker,
+            )
+        if embedding:
+            self.embedding_cache.set(key, embedding)
+        return embedding
+
     @staticmethod
     def parse_messages(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
         """
@@ -371,8 +522,7 @@ class FunctionHandler:
                     the result is a dictionary, it will be converted to a DictFuncResponse and returned.  If the
                     result is None, None will be returned.
         """
-        result = self._call_function(func_name, args_str)
-
+        result = self._invoke_function(func_name, args_str)
         if result is None:
             return None
 
@@ -387,6 +537,48 @@ class FunctionHandler:
 
         return response_obj
 
+    def call_function(
+        self, func_name: str, args_str: str
+    ) -> FuncResult | FuncResponse | None:
+        """
+        Handle a function call like handle_function_call(), but convert a dictionary result to a FuncResult instead of
+                a validated DictFuncResponse.  This is the path the agents use for every tool call.
+        :param func_name:  The name of the function to call.
+        :param args_str:  The arguments to pass to the function. The arguments are a JSON formatted string.
+        :return:  The FuncResponse returned by the function, a FuncResult of its dictionary result, or None.
+        """
+        result = self._invoke_function(func_name, args_str)
+        if result is None:
+            return None
+        if isinstance(result, FuncResponse):
+            result.name = func_name
+            result.arguments = args_str
+            return result
+        return FuncResult.from_dict(result, func_name, args_str)
+
+    def _invoke_function(self, func_name: str, args_str: str) -> Any:
+        """
+        Call a function, recording its duration and errors and making the ask's cancellation token current.
+        :return:  The raw result of the function.
+        """
+        labels = {"function": func_name}
+        start = time.perf_counter()
+        token = _current_token.set(self.cancellation)
+        try:
+            with self.trace.span("handle_function_call", labels):
+                result = self._call_function(func_name, args_str)
+        except AskCancelled:
+            raise
+        except Exception:
+            self.metrics.inc(TOOL_CALL_ERRORS_TOTAL, labels=labels)
+            raise
+        finally:
+            _current_token.reset(token)
+            self.metrics.observe(
+                TOOL_CALL_SECONDS, time.perf_counter() - start, labels=labels
+            )
+        return result
+
     @staticmethod
     def _execute_method(item: Any, method_name: str, args: dict[str, Any]) -> Any:
         """
@@ -460,6 +652,13 @@ class FunctionHandler:
         """
         return self.functions
 
+    @property
+    def encoding(self):
+        """The tiktoken encoding, loaded when tokens are first counted."""
+        if self._encoding is None:
+            self._encoding = get_encoding(self.token_encoding)
+        return self._encoding
+
     def tokenize(self, content: str) -> int:
         """
         Tokenize the content and return the number of tokens.
@@ -15,6 +15,9 @@ class FuncResponse(BaseModel):
     :param stream_data:  The data to stream to the user.
     :param use_secondary_model:  Whether to use the secondary model.
     :param force_no_functions:  Whether to force no functions.
+    :param cacheable:  Whether the final response of the ask may be stored in the agent's response cache. Set to
+                       False for time-sensitive data.
+    :param cache_ttl:  The maximum time, in seconds, the final response of the ask may be cached for.
     """
 
     name: str | None = None
@@ -26,6 +29,8 @@ class FuncResponse(BaseModel):
     stream_data: dict | None = None
     use_secondary_model: bool = False
     force_no_functions: bool = False
+    cacheable: bool = True
+    cache_ttl: float | None = None
 
 
 class DictFuncResponse(FuncResponse):
@@ -39,12 +44,114 @@ class DictFuncResponse(FuncResponse):
     data: dict | None = None
 
     def __init__(self, init_data: dict):
-        super().__init__()
+        super().__init__(
+            content=init_data.get("content", ""),
+            summarize_only=init_data.get("summarize_only", False),
+            send_directly_to_user=init_data.get("send_directly_to_user", False),
+            post_content=init_data.get("post_content", None),
+            stream_data=init_data.get("stream_data", None),
+            use_secondary_model=init_data.get("use_secondary_model", False),
+            force_no_functions=init_data.get("force_no_functions", False),
+            cacheable=init_data.get("cacheable", True),
+            cache_ttl=init_data.get("cache_ttl", None),
+        )
         self.data = init_data
-        self.content = init_data.get("content", "")
-        self.summarize_only = init_data.get("summarize_only", False)
-        self.send_directly_to_user = init_data.get("send_directly_to_user", False)
-        self.post_content = init_data.get("post_content", None)
-        self.stream_data = init_data.get("stream_data", None)
-        self.use_secondary_model = init_data.get("use_secondary_model", False)
-        self.force_no_functions = init_data.get("force_no_functions", False)
+
+
+class FuncResult:
+    """
+    The result of a function call as the agents use it internally: the fields of a FuncResponse in a plain slotted
+    object, built from a function's dictionary result without validation and without keeping the dictionary.
+    Convert it with to_func_response() where it leaves the library.
+
+    :param name:  The name of the function.
+    :param arguments:  The arguments of the call, as a JSON formatted string.
+    :param content:  The content of the response.
+    :param summarize_only:  Whether to only summarize the content.
+    :param send_directly_to_user:  Whether to send the response directly to the user.
+    :param post_content:  The content to post to the chat history.
+    :param stream_data:  The data to stream to the user.
+    :param use_secondary_model:  Whether to use the secondary model.
+    :param force_no_functions:  Whether to force no functions.
+    :param cacheable:  Whether the final response of the ask may be stored in the agent's response cache.
+    :param cache_ttl:  The maximum time, in seconds, the final response of the ask may be cached for.
+    """
+
+    __slots__ = (
+        "name",
+        "arguments",
+        "content",
+        "summarize_only",
+        "send_directly_to_user",
+        "post_content",
+        "stream_data",
+        "use_secondary_model",
+        "force_no_functions",
+        "cacheable",
+        "cache_ttl",
+    )
+
+    def __init__(
+        self,
+        name: str | None = None,
+        arguments: str | None = None,
+        content: str | None = None,
+        summarize_only: bool = False,
+        send_directly_to_user: bool = False,
+        post_content: str | None = None,
+        stream_data: dict | None = None,
+        use_secondary_model: bool = False,
+        force_no_functions: bool = False,
+        cacheable: bool = True,
+        cache_ttl: float | None = None,
+    ):
+        self.name = name
+        self.arguments = arguments
+        self.content = content
+        self.summarize_only = summarize_only
+        self.send_directly_to_user = send_directly_to_user
+        self.post_content = post_content
+        self.stream_data = stream_data
+        self.use_secondary_model = use_secondary_model
+        self.force_no_functions = force_no_functions
+        self.cacheable = cacheable
+        self.cache_ttl = cache_ttl
+
+    @classmethod
+    def from_dict(
+        cls, data: dict, name: str | None = None, arguments: str | None = None
+    ) -> "FuncResult":
+        """
+        Create a result from a function's dictionary result, with the defaults of DictFuncResponse.
+        :param data:  The dictionary returned by the function.
+        :param name:  The name of the function.
+        :param arguments:  The arguments of the call, as a JSON formatted string.
+        :return:  The result.
+        """
+        get = data.get
+        return cls(
+            name,
+            arguments,
+            get("content", ""),
+            get("summarize_only", False),
+            get("send_directly_to_user", False),
+            get("post_content"),
+            get("stream_data"),
+            get("use_secondary_model", False),
+            get("force_no_functions", False),
+            get("cacheable", True),
+            get("cache_ttl"),
+        )
+
+    def to_func_response(self) -> FuncResponse:
+        """
+        Convert the result to a validated FuncResponse.
+        :return:  The FuncResponse.
+        """
+        return FuncResponse(**{field: getattr(self, field) for field in self.__slots__})
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            f"{field}={getattr(self, field)!r}" for field in self.__slots__
+        )
+        return f"FuncResult({fields})"
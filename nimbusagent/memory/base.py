@@ -1,4 +1,65 @@
-import tiktoken
+import copy
+import sys
+from array import array
+from typing import Any
+
+from nimbusagent.utils.lazy import get_encoding
+
+
+class MemoryEntry:
+    """
+    A message of the chat history. Roles are interned, so every entry of a role shares the same string.
+
+    :param role:  The role of the message.
+    :param content:  The content of the message.
+    """
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = content
+
+    def to_dict(self) -> dict[str, str]:
+        """
+        Get the entry as a message of the chat completions API.
+        :return:  The message, with 'role' and 'content' fields.
+        """
+        return {"role": self.role, "content": self.content}
+
+    def __repr__(self) -> str:
+        return f"MemoryEntry(role={self.role!r}, content={self.content!r})"
+
+
+def message_to_dict(message: Any) -> dict[str, Any]:
+    """
+    Convert an assistant message of a chat completion to the minimal dictionary needed to send it back to the API, so
+    the pydantic model (and the response it came from) is not kept alive by the internal thoughts.
+    :param message:  The ChatCompletionMessage.
+    :return:  The message, with 'role' and 'content' fields and its 'tool_calls' or 'function_call' if any.
+    """
+    result: dict[str, Any] = {
+        "role": sys.intern(message.role),
+        "content": message.content,
+    }
+    if getattr(message, "tool_calls", None):
+        result["tool_calls"] = [
+            {
+                "id": tool_call.id,
+                "type": tool_call.type,
+                "function": {
+                    "name": tool_call.function.name,
+                    "arguments": tool_call.function.arguments,
+                },
+            }
+            for tool_call in message.tool_calls
+        ]
+    elif getattr(message, "function_call", None):
+        result["function_call"] = {
+            "name": message.function_call.name,
+            "arguments": message.function_call.arguments,
+        }
+    return result
 
 
 class AgentMemory:
@@ -7,11 +68,27 @@ class AgentMemory:
     This is basic memory that utilizes a simple list to store the chat history, and limits the list to a maximum
     number of tokens and entries. Tiktoken is used to tokenize the content.
 
+    A server keeps one memory per live session, so the history is stored compactly: each message is a MemoryEntry
+    that only keeps its role and content (other fields of an entry are dropped), and the token counts are an array of
+    unsigned ints. get_chat_history() returns the messages as dictionaries, built once and cached until the history
+    changes.
+
     :param max_tokens:  The maximum number of tokens to store in the chat history.
     :param max_messages:  The maximum number of messages to store in the chat history.
     :param initial_history:  The initial chat history to use.  If None, the chat history will be empty.
     """
 
+    __slots__ = (
+        "token_encoding",
+        "_encoding",
+        "entries",
+        "_chat_history",
+        "token_counts",
+        "num_tokens",
+        "max_tokens",
+        "max_messages",
+    )
+
     def __init__(
         self,
         max_tokens: int,
@@ -19,11 +96,13 @@ class AgentMemory:
         token_encoding: str,
         initial_history: list[dict[str, str]] | None = None,
     ):
-        self.encoding = tiktoken.get_encoding(token_encoding)
-        self.chat_history = []
-        self.token_counts = (
-            []
-        )  # Stores token counts for corresponding chat_history entries
+        self.token_encoding = token_encoding
+        self._encoding = None
+        self.entries: list[MemoryEntry] = []
+        # the entries as dictionaries, None until get_chat_history() is called after a change
+        self._chat_history: list[dict[str, str]] | None = None
+        # the token counts of the corresponding entries
+        self.token_counts = array("I")
         self.num_tokens = 0
         self.max_tokens = max_tokens
         self.max_messages = max_messages
@@ -31,6 +110,25 @@ class AgentMemory:
         if initial_history:
             self.set_chat_history(initial_history)
 
+    @property
+    def chat_history(self) -> list[dict[str, str]]:
+        """
+        The chat history, as returned by get_chat_history(). Setting it calls set_chat_history(); changing the
+        returned list does not change the memory.
+        """
+        return self.get_chat_history()
+
+    @chat_history.setter
+    def chat_history(self, new_history: list[dict[str, str]]):
+        self.set_chat_history(new_history)
+
+    @property
+    def encoding(self):
+        """The tiktoken encoding, loaded when tokens are first counted."""
+        if self._encoding is None:
+            self._encoding = get_encoding(self.token_encoding)
+        return self._encoding
+
     def tokenize(self, content: str) -> int:
         """
         Tokenize the content and return the number of tokens.
@@ -43,14 +141,16 @@ class AgentMemory:
         """
         Clear the chat history.
         """
-        self.chat_history = []
-        self.token_counts = []
+        self.entries = []
+        self._chat_history = None
+        self.token_counts = array("I")
         self.num_tokens = 0
 
     def add_entry(self, entry: dict[str, str]):
         """
         Add an entry to the chat history.
-        :param entry:  The entry to add. The entry must have both 'role' and 'content' fields.
+        :param entry:  The entry to add. The entry must have both 'role' and 'content' fields; other fields are not
+                       kept.
         """
         # logging.info(entry)
         if "role" not in entry or "content" not in entry:
@@ -63,7 +163,8 @@ class AgentMemory:
 
         token_count = self.tokenize(entry["content"])
         self.token_counts.append(token_count)
-        self.chat_history.append(entry)  # content remains untokenized
+        self.entries.append(MemoryEntry(entry["role"], entry["content"]))
+        self._chat_history = None
         self.num_tokens += token_count
         self._trim_excess_entries()
 
@@ -74,31 +175,50 @@ class AgentMemory:
         """
         self.add_entry(entry)
 
+    def pop_entry(self) -> dict[str, str] | None:
+        """
+        Remove the last entry of the chat history, e.g. the query of an ask that was cancelled.
+        :return:  The entry, or None if the chat history is empty.
+        """
+        if not self.entries:
+            return None
+        self._chat_history = None
+        self.num_tokens -= self.token_counts.pop()
+        return self.entries.pop().to_dict()
+
+    def get_last_entry(self) -> dict[str, str] | None:
+        """
+        Get the last entry of the chat history.
+        :return:  The entry, or None if the chat history is empty.
+        """
+        return self.entries[-1].to_dict() if self.entries else None
+
     def _trim_excess_entries(self):
         """
         Trim the chat history to the maximum number of tokens and entries.
         """
         while (self.num_tokens > self.max_tokens) or (
-            len(self.chat_history) > self.max_messages
+            len(self.entries) > self.max_messages
         ):
             self.num_tokens -= self.token_counts.pop(0)
-            self.chat_history.pop(0)
+            self.entries.pop(0)
+            self._chat_history = None
 
     def get_chat_history(self) -> list[dict[str, str]]:
         """
         Get the chat history.
-        :return:  The chat history.
+        :return:  The chat history, a new list of the cached message dictionaries.
         """
-        return self.chat_history.copy()
+        if self._chat_history is None:
+            self._chat_history = [entry.to_dict() for entry in self.entries]
+        return list(self._chat_history)
 
     def get_chat_history_as_text(self) -> str:
         """
         Get the chat history as text.
         :return:  The chat history as text, in "role: content" format.
         """
-        return "\n".join(
-            [f"{entry['role']}: {entry['content']}" for entry in self.chat_history]
-        )
+        return "\n".join([f"{entry.role}: {entry.content}" for entry in self.entries])
 
     def set_chat_history(self, new_history: list[dict[str, str]]):
         """
@@ -123,12 +243,56 @@ class AgentMemory:
                 self.add_entry(filtered_entry)
                 last_entry = filtered_entry
 
+    def get_state(self) -> dict:
+        """
+        Get the state of the memory, to store it and restore it later with load_state() without re-tokenizing.
+        :return:  The chat history and its token counts, as a JSON serializable dictionary.
+        """
+        return {
+            "chat_history": self.get_chat_history(),
+            "token_counts": self.token_counts.tolist(),
+        }
+
+    def load_state(self, state: dict):
+        """
+        Restore a state returned by get_state(), trimming it to the current limits.
+        :param state:  The state to restore.
+        """
+        chat_history = state.get("chat_history") or []
+        token_counts = state.get("token_counts") or []
+        if len(token_counts) != len(chat_history):
+            self.set_chat_history(chat_history)
+            return
+
+        try:
+            self.token_counts = array("I", token_counts)
+        except (TypeError, OverflowError):
+            self.set_chat_history(chat_history)
+            return
+        self.entries = [
+            MemoryEntry(entry["role"], entry["content"]) for entry in chat_history
+        ]
+        self._chat_history = None
+        self.num_tokens = sum(self.token_counts)
+        self._trim_excess_entries()
+
+    def copy(self) -> "AgentMemory":
+        """
+        Copy the memory, e.g. to ask with a snapshot of it. The copy shares the entries but not the lists holding
+        them, so adding or removing entries in one does not change the other.
+        :return:  The copy.
+        """
+        memory = copy.copy(self)
+        memory.entries = list(self.entries)
+        memory.token_counts = array("I", self.token_counts)
+        return memory
+
     def get_chat_length(self) -> int:
         """
         Get the number of entries in the chat history.
         :return:  The number of entries in the chat history.
         """
-        return len(self.chat_history)
+        return len(self.entries)
 
     def get_total_tokens(self) -> int:
         """
@@ -154,6 +318,4 @@ class AgentMemory:
 
         if max_messages_resize is not None:
             self.max_messages = max_messages_resize
-            while len(self.chat_history) > self.max_messages:
-                dropped_tokens = self.chat_history.pop(0)
-                self.num_tokens -= len(dropped_tokens)
+            self._trim_excess_entries()
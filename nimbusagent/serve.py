@@ -0,0 +1,709 @@
+"""
+A small asyncio HTTP server that serves agents, with completion and streaming (server-sent events) endpoints.
+
+    python -m nimbusagent.serve --host 0.0.0.0 --port 8000 --agent weather=myapp.agents:WEATHER_AGENT_OPTIONS
+
+Every configured agent is a dictionary of agent options (the keyword arguments of CompletionAgent and
+StreamingAgent), or a callable returning one. The options are compiled into an AgentBlueprint on first use, a new
+agent is created from it per request with the chat history sent by the client, and all agents share one OpenAI client
+and metrics registry.
+
+Routes:
+    POST /v1/agents/<name>/ask      {"query": "...", "history": [...]}  ->  {"response": "...", "stats": {...}}
+    POST /v1/agents/<name>/stream   {"query": "...", "history": [...]}  ->  text/event-stream of content, function
+                                    and data events, followed by a `done` event with the stats
+    POST /v1/ask, POST /v1/stream   The same, for the first configured agent
+    GET  /health                    {"status": "ok", "in_flight": n, ...}
+    GET  /ready                     200 once the agents are warmed up (see --warmup), 503 before
+    GET  /metrics                   Prometheus text format
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import concurrent.futures
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from openai import OpenAI
+
+from nimbusagent.agent.base import BaseAgent
+from nimbusagent.agent.blueprint import AgentBlueprint
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.events import encode_sse
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.utils.metrics import (
+    MetricsRegistry,
+    HTTP_CLIENT_DISCONNECTS_TOTAL,
+    HTTP_REQUEST_SECONDS,
+    HTTP_REQUESTS_TOTAL,
+)
+
+DEFAULT_AGENT_NAME = "default"
+WARMUP_RETRY_SECONDS = 5.0
+MAX_BODY_SIZE = 1024 * 1024
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+_DONE = object()
+
+
+class HTTPError(Exception):
+    """
+    An error to respond to the client with.
+
+    :param status:  The HTTP status code.
+    :param message:  The error message.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class AgentServer:
+    """
+    An asyncio HTTP server for agents. Agents are synchronous, so each request runs its agent in a worker thread; a
+    streaming request hands its events to the connection through a bounded queue, so a slow client slows down the
+    worker (and the upstream stream) instead of buffering the whole response. When a streaming client disconnects,
+    the agent's generator is closed, which closes the upstream stream.
+
+    :param agents:  The agent options by agent name.  Defaults to a single agent with default options.
+    :param host:  The host to listen on.
+    :param port:  The port to listen on.  0 picks a free port.
+    :param max_in_flight:  The maximum number of agent requests served at once. Further requests get a 503.
+    :param queue_size:  The number of events a streaming request may buffer before its worker waits for the client.
+    :param metrics:  The registry to record agent and HTTP metrics to, exposed on /metrics.
+    :param client:  The OpenAI client shared by agents that do not set their own client, API key or base URL.
+                    Created on first use if not provided.
+    :param warmup_on_start:  True to warm up every agent once the server is listening; /ready reports 503 until done.
+    :param warmup_keep_alive:  True to also open the API connections when warming up.
+    """
+
+    def __init__(
+        self,
+        agents: dict[str, dict[str, Any]] | None = None,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        max_in_flight: int = 64,
+        queue_size: int = 16,
+        metrics: MetricsRegistry | None = None,
+        client: OpenAI | None = None,
+        warmup_on_start: bool = False,
+        warmup_keep_alive: bool = False,
+    ):
+        self.agents = agents or {DEFAULT_AGENT_NAME: {}}
+        self.host = host
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.client = client
+        self.warmup_on_start = warmup_on_start
+        self.warmup_keep_alive = warmup_keep_alive
+        self.ready = not warmup_on_start
+        self.in_flight = 0
+        self._client_lock = threading.Lock()
+        self._blueprints: dict[tuple[type[BaseAgent], str], AgentBlueprint] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="nimbusagent-serve"
+        )
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.base_events.Server | None = None
+        self._thread: threading.Thread | None = None
+        self._writers: set[asyncio.StreamWriter] = set()
+        self._stopped = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "AgentServer":
+        """
+        Start the server in a background thread.
+        :return:  The server, once it is accepting connections.
+        """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, self.host, self.port)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            self._start_warmup()
+            started.set()
+            self._loop.run_forever()
+
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            tasks = asyncio.all_tasks(self._loop)
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True)
+            )
+            self._loop.close()
+
+        self._thread = threading.Thread(
+            target=run, name="nimbusagent-serve", daemon=True
+        )
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop the server started with start().
+        """
+        self._stopped.set()
+        if self._loop is not None and self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+            self._thread = None
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> "AgentServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    async def serve_forever(self) -> None:
+        """
+        Run the server on the current event loop until cancelled.
+        """
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info("Serving agents %s on %s", list(self.agents), self.base_url)
+        self._start_warmup()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            self._stopped.set()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def warmup(self, keep_alive: bool = False) -> dict[str, dict[str, float]]:
+        """
+        Compile and warm up the completion and streaming blueprints of every agent (see BaseAgent.warmup()), then
+        report the server ready.
+        :param keep_alive:  True to also make a cheap request to the API through every client, opening its connection.
+        :return:  The seconds each step took, by agent name and class.
+        """
+        timings = {}
+        warmed_clients = set()
+        for name in self.agents:
+            for agent_class, kwargs in (
+                (CompletionAgent, {}),
+                (StreamingAgent, {}),
+            ):
+                blueprint = self._get_blueprint(agent_class, name, **kwargs)
+                open_connection = (
+                    keep_alive and id(blueprint.client) not in warmed_clients
+                )
+                warmed_clients.add(id(blueprint.client))
+                timings[f"{name}.{agent_class.__name__}"] = blueprint.warmup(
+                    open_connection
+                )
+        self.ready = True
+        logging.info("Agents warmed up: %s", timings)
+        return timings
+
+    def _start_warmup(self) -> None:
+        """
+        Warm up the agents in a worker thread if warmup_on_start is set, retrying until it succeeds or the server
+        stops.
+        """
+        if not self.warmup_on_start:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.warmup(self.warmup_keep_alive)
+                    return
+                except Exception as e:
+                    logging.error(
+                        "Warming up the agents failed, retrying in %ss: %s",
+                        WARMUP_RETRY_SECONDS,
+                        e,
+                    )
+                    if self._stopped.wait(WARMUP_RETRY_SECONDS):
+                        return
+
+        threading.Thread(target=run, name="nimbusagent-warmup", daemon=True).start()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        try:
+            keep_alive = True
+            while keep_alive:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close"
+
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._send_json(
+                        writer, 400, {"error": "Invalid Content-Length"}, False
+                    )
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self._send_json(
+                        writer, 413, {"error": "Request body too large"}, False
+                    )
+                    break
+                raw_body = await reader.readexactly(length) if length else b""
+
+                keep_alive = await self._route(
+                    method, path.split("?")[0], raw_body, reader, writer, keep_alive
+                )
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _route(
+        self,
+        method: str,
+        path: str,
+        raw_body: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        keep_alive: bool,
+    ) -> bool:
+        """
+        Serve a request.
+        :return:  True if the connection can be kept alive for another request.
+        """
+        start = time.perf_counter()
+        route = "other"
+        status = 200
+        try:
+            if path == "/health":
+                route = "health"
+                await self._send_json(writer, 200, self._health(), keep_alive)
+                return keep_alive
+            if path == "/ready":
+                route = "ready"
+                status = 200 if self.ready else 503
+                await self._send_json(
+                    writer,
+                    status,
+                    {"status": "ready" if self.ready else "warming_up"},
+                    keep_alive,
+                )
+                return keep_alive
+            if path == "/metrics":
+                route = "metrics"
+                await self._send(
+                    writer,
+                    200,
+                    self._render_metrics().encode(),
+                    "text/plain; version=0.0.4",
+                    keep_alive,
+                )
+                return keep_alive
+
+            name, route = self._parse_agent_path(path)
+            if method != "POST":
+                raise HTTPError(405, f"Use POST for {path}")
+            if self.in_flight >= self.max_in_flight:
+                raise HTTPError(503, "Too many requests in flight")
+            query, history = self._parse_body(raw_body)
+
+            self.in_flight += 1
+            try:
+                if route == "stream":
+                    await self._stream(name, query, history, reader, writer)
+                    return False
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._run_ask, name, query, history
+                )
+                await self._send_json(writer, 200, result, keep_alive)
+                return keep_alive
+            finally:
+                self.in_flight -= 1
+
+        except HTTPError as e:
+            status = e.status
+            headers = {"Retry-After": "1"} if e.status == 503 else None
+            await self._send_json(
+                writer, e.status, {"error": e.message}, keep_alive, headers
+            )
+            return keep_alive
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status = 499
+            raise
+        except Exception as e:
+            logging.error("Error serving %s: %s", path, e, exc_info=True)
+            status = 500
+            await self._send_json(writer, 500, {"error": "Internal error"}, False)
+            return False
+        finally:
+            labels = {"route": route}
+            self.metrics.inc(
+                HTTP_REQUESTS_TOTAL, labels={**labels, "status": str(status)}
+            )
+            self.metrics.observe(
+                HTTP_REQUEST_SECONDS, time.perf_counter() - start, labels=labels
+            )
+
+    def _parse_agent_path(self, path: str) -> tuple[str, str]:
+        """
+        Get the agent name and route (ask or stream) from a path.
+        """
+        parts = path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "v1" and parts[1] in ("ask", "stream"):
+            return next(iter(self.agents)), parts[1]
+        if (
+            len(parts) == 4
+            and parts[:2] == ["v1", "agents"]
+            and parts[3] in ("ask", "stream")
+        ):
+            if parts[2] not in self.agents:
+                raise HTTPError(404, f"Unknown agent {parts[2]}")
+            return parts[2], parts[3]
+        raise HTTPError(404, f"Unknown route {path}")
+
+    @staticmethod
+    def _parse_body(raw_body: bytes) -> tuple[str, list[dict[str, str]] | None]:
+        """
+        Get the query and chat history from a request body.
+        """
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            raise HTTPError(400, "The request body must be JSON")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "The request body must be a JSON object")
+
+        query = body.get("query")
+        if not isinstance(query, str) or not query.strip():
+            raise HTTPError(400, "A non-empty 'query' is required")
+        history = body.get("history")
+        if history is not None and not isinstance(history, list):
+            raise HTTPError(400, "'history' must be a list of messages")
+        return query, history
+
+    def _create_agent(
+        self,
+        agent_class: type[BaseAgent],
+        name: str,
+        history: list[dict[str, str]] | None,
+        **kwargs,
+    ) -> BaseAgent:
+        """
+        Create an agent for a request from the blueprint of the configured options.
+        """
+        try:
+            return self._get_blueprint(agent_class, name, **kwargs).new_agent(
+                history or None
+            )
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+    def _get_blueprint(
+        self, agent_class: type[BaseAgent], name: str, **kwargs
+    ) -> AgentBlueprint:
+        """
+        Get the blueprint of an agent, compiling it on first use.
+        """
+        key = (agent_class, name)
+        blueprint = self._blueprints.get(key)
+        if blueprint is not None:
+            return blueprint
+
+        options = {**self.agents[name], **kwargs}
+        options.setdefault("metrics", self.metrics)
+        if not {"client", "openai_api_key", "openai_base_url"} & options.keys():
+            options["client"] = self._get_client()
+        blueprint = AgentBlueprint(agent_class, options)
+        with self._client_lock:
+            return self._blueprints.setdefault(key, blueprint)
+
+    def _get_client(self) -> OpenAI:
+        with self._client_lock:
+            if self.client is None:
+                self.client = OpenAI()
+            return self.client
+
+    def _run_ask(
+        self, name: str, query: str, history: list[dict[str, str]] | None
+    ) -> dict[str, Any]:
+        """
+        Run a completion request in a worker thread.
+        """
+        agent = self._create_agent(CompletionAgent, name, history)
+        response = agent.ask(query)
+        return {"response": response, "stats": agent.get_last_stats().to_dict()}
+
+    async def _stream(
+        self,
+        name: str,
+        query: str,
+        history: list[dict[str, str]] | None,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """
+        Serve a streaming request as server-sent events, until the agent is done or the client disconnects.
+        """
+        agent = await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            lambda: self._create_agent(StreamingAgent, name, history),
+        )
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        cancelled = threading.Event()
+        worker = loop.run_in_executor(
+            self._executor, self._run_stream, agent, query, queue, loop, cancelled
+        )
+
+        disconnected: asyncio.Future | None = None
+        finished = False
+        try:
+            await self._send_head(writer, 200, "text/event-stream", None, False)
+            disconnected = asyncio.ensure_future(reader.read(1))
+            while True:
+                get = asyncio.ensure_future(queue.get())
+                await asyncio.wait(
+                    {get, disconnected}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnected.done():
+                    get.cancel()
+                    raise ConnectionResetError("The client disconnected")
+                item = get.result()
+                if item is _DONE:
+                    finished = True
+                    break
+                writer.write(item)
+                await writer.drain()
+        except ConnectionError:
+            self.metrics.inc(HTTP_CLIENT_DISCONNECTS_TOTAL)
+        finally:
+            if disconnected is not None:
+                disconnected.cancel()
+            if not finished:
+                cancelled.set()
+                agent.cancel()
+                while await queue.get() is not _DONE:
+                    pass
+            await worker
+
+    def _run_stream(
+        self,
+        agent: BaseAgent,
+        query: str,
+        queue: asyncio.Queue,
+        loop: asyncio.AbstractEventLoop,
+        cancelled: threading.Event,
+    ) -> None:
+        """
+        Run a streaming request in a worker thread, handing the encoded events to the connection through the queue.
+        Waits while the queue is full, and stops the agent when the request is cancelled.
+        """
+
+        def put(item: Any) -> bool:
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=1.0)
+                    return not cancelled.is_set()
+                except concurrent.futures.TimeoutError:
+                    if cancelled.is_set() or loop.is_closed():
+                        future.cancel()
+                        return False
+
+        assert isinstance(agent, StreamingAgent)
+        events = agent.ask_events(query)
+        try:
+            for event in events:
+                if not put(encode_sse(event).encode()):
+                    break
+            else:
+                done = {"stats": agent.get_last_stats().to_dict()}
+                put(f"event: done\ndata: {json.dumps(done)}\n\n".encode())
+        except Exception as e:
+            logging.error("Error streaming: %s", e, exc_info=True)
+            error = json.dumps({"error": "Internal error"})
+            put(f"event: error\ndata: {error}\n\n".encode())
+        finally:
+            events.close()
+            if not loop.is_closed():
+                asyncio.run_coroutine_threadsafe(queue.put(_DONE), loop)
+
+    def _health(self) -> dict[str, Any]:
+        return {
+            "status": "ok",
+            "ready": self.ready,
+            "agents": list(self.agents),
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+        }
+
+    def _render_metrics(self) -> str:
+        return (
+            self.metrics.render_prometheus()
+            + "# HELP nimbusagent_http_in_flight Agent requests currently being served.\n"
+            + "# TYPE nimbusagent_http_in_flight gauge\n"
+            + f"nimbusagent_http_in_flight {self.in_flight}\n"
+        )
+
+    @staticmethod
+    async def _send_head(
+        writer: asyncio.StreamWriter,
+        status: int,
+        content_type: str,
+        length: int | None,
+        keep_alive: bool,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        lines = [
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'Unknown')}",
+            f"Content-Type: {content_type}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if length is not None:
+            lines.append(f"Content-Length: {length}")
+        else:
+            lines.append("Cache-Control: no-cache")
+        for key, value in (headers or {}).items():
+            lines.append(f"{key}: {value}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    async def _send(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        data: bytes,
+        content_type: str,
+        keep_alive: bool,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        await self._send_head(
+            writer, status, content_type, len(data), keep_alive, headers
+        )
+        writer.write(data)
+        await writer.drain()
+
+    async def _send_json(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: dict[str, Any],
+        keep_alive: bool,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        await self._send(
+            writer,
+            status,
+            json.dumps(payload).encode(),
+            "application/json",
+            keep_alive,
+            headers,
+        )
+
+
+def load_agent_options(path: str) -> dict[str, Any]:
+    """
+    Load agent options from a 'module:attribute' path. The attribute is a dictionary of agent options, or a callable
+    returning one.
+    :param path:  The path, e.g. 'myapp.agents:WEATHER_AGENT_OPTIONS'.
+    :return:  The agent options.
+    """
+    module_name, _, attribute = path.partition(":")
+    options = getattr(importlib.import_module(module_name), attribute)
+    if callable(options):
+        options = options()
+    if not isinstance(options, dict):
+        raise ValueError(f"{path} is not a dictionary of agent options")
+    return options
+
+
+def main(args: list[str] | None = None) -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    arg_parser.add_argument("--max-in-flight", type=int, default=64)
+    arg_parser.add_argument("--queue-size", type=int, default=16)
+    arg_parser.add_argument(
+        "--agent",
+        action="append",
+        metavar="NAME=MODULE:ATTRIBUTE",
+        help="serve an agent with the options at MODULE:ATTRIBUTE (repeatable)",
+    )
+    arg_parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="warm up every agent on start; /ready reports 503 until done",
+    )
+    arg_parser.add_argument(
+        "--warmup-keep-alive",
+        action="store_true",
+        help="also open the API connections when warming up",
+    )
+    arg_parser.add_argument("--log-level", default="INFO")
+    parsed = arg_parser.parse_args(args)
+    logging.basicConfig(level=parsed.log_level.upper())
+
+    agents: dict[str, dict[str, Any]] = {}
+    for agent in parsed.agent or []:
+        name, _, path = agent.partition("=")
+        if not path:
+            arg_parser.error(f"--agent must be NAME=MODULE:ATTRIBUTE, got {agent}")
+        agents[name] = load_agent_options(path)
+
+    server = AgentServer(
+        agents=agents or None,
+        host=parsed.host,
+        port=parsed.port,
+        max_in_flight=parsed.max_in_flight,
+        queue_size=parsed.queue_size,
+        warmup_on_start=parsed.warmup or parsed.warmup_keep_alive,
+        warmup_keep_alive=parsed.warmup_keep_alive,
+    )
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Record/replay transports for the OpenAI client, to capture real conversations once and replay them offline.
+
+A cassette is a JSONL file with one line per HTTP interaction (chat completions including every streamed chunk with
+its timing, moderations and embeddings). Use `cassette_client()` to create an OpenAI client that records to or
+replays from a cassette, and pass it to an agent with `client=`.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Iterator, Literal
+
+import httpx
+from openai import OpenAI
+
+TimingMode = Literal["preserve", "collapse"]
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    """Passes the response body through while recording every chunk and its time offset."""
+
+    def __init__(
+        self,
+        transport: "RecordingTransport",
+        stream: httpx.SyncByteStream,
+        interaction: dict[str, Any],
+        started_at: float,
+    ):
+        self.transport = transport
+        self.stream = stream
+        self.interaction = interaction
+        self.started_at = started_at
+        self.written = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        chunks = self.interaction["chunks"]
+        for chunk in self.stream:
+            offset = round(time.perf_counter() - self.started_at, 6)
+            chunks.append([offset, chunk.decode("latin-1")])
+            yield chunk
+
+    def close(self) -> None:
+        self.stream.close()
+        if not self.written:
+            self.written = True
+            self.transport.write(self.interaction)
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """
+    httpx transport that sends requests through another transport and appends every interaction to a cassette.
+    Request headers (including the API key) are not recorded.
+
+    :param path:  The path of the JSONL cassette to append to.
+    :param transport:  The transport to send requests with.  Defaults to a new httpx.HTTPTransport.
+    :param record_request_body:  True to record request bodies, which are needed to match requests on replay
+                                 by body and to extract the queries of the recorded conversations.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        transport: httpx.BaseTransport | None = None,
+        record_request_body: bool = True,
+    ):
+        self.path = path
+        self.transport = transport or httpx.HTTPTransport()
+        self.record_request_body = record_request_body
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started_at = time.perf_counter()
+        response = self.transport.handle_request(request)
+
+        interaction: dict[str, Any] = {
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "headers": {
+                key: value
+                for key, value in response.headers.items()
+                if key.lower() in ("content-type", "retry-after")
+            },
+            "latency": round(time.perf_counter() - started_at, 6),
+            "chunks": [],
+        }
+        if self.record_request_body:
+            body = request.read()
+            interaction["request"] = json.loads(body) if body else None
+
+        if not isinstance(response.stream, httpx.SyncByteStream):
+            # only the streams of a synchronous transport can be recorded
+            return response
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(self, response.stream, interaction, started_at),
+            extensions=response.extensions,
+        )
+
+    def write(self, interaction: dict[str, Any]) -> None:
+        """
+        Append an interaction to the cassette.
+        :param interaction:  The interaction to append.
+        """
+        line = json.dumps(interaction, separators=(",", ":"))
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    """Serves the recorded chunks of a response, sleeping to preserve their timing if requested."""
+
+    def __init__(self, chunks: list, started_at: float, speed: float | None):
+        self.chunks = chunks
+        self.started_at = started_at
+        self.speed = speed
+
+    def __iter__(self) -> Iterator[bytes]:
+        for offset, data in self.chunks:
+            if self.speed:
+                delay = self.started_at + offset / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            yield data.encode("latin-1")
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """
+    httpx transport that serves the interactions of a cassette instead of calling the API.
+    Interactions are served in recorded order per endpoint (method and path), so the order of moderation,
+    embedding and chat requests may differ between recording and replay.
+
+    :param path:  The path of the JSONL cassette to replay.
+    :param timing:  'preserve' to wait for the recorded latency and chunk timing, 'collapse' to serve everything
+                    immediately.
+    :param speed:  The speed factor when preserving timing, e.g. 2.0 replays twice as fast.
+    :param cycle:  True to start over when the interactions of an endpoint run out, False to raise an error.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        timing: TimingMode = "collapse",
+        speed: float = 1.0,
+        cycle: bool = False,
+    ):
+        self.path = path
+        self.timing = timing
+        self.speed = speed
+        self.cycle = cycle
+        self.interactions = load_cassette(path)
+        self._queues: dict[tuple[str, str], deque] = {}
+        for interaction in self.interactions:
+            key = (interaction["method"], interaction["path"])
+            self._queues.setdefault(key, deque()).append(interaction)
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started_at = time.perf_counter()
+        key = (request.method, request.url.path)
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                raise RuntimeError(
+                    f"No recorded interaction left for {request.method} {request.url.path}"
+                )
+            interaction = queue.popleft()
+            if self.cycle:
+                queue.append(interaction)
+
+        speed = self.speed if self.timing == "preserve" else None
+        if speed:
+            time.sleep(interaction.get("latency", 0) / speed)
+
+        return httpx.Response(
+            status_code=interaction["status"],
+            headers=interaction.get("headers", {}),
+            stream=_ReplayStream(interaction["chunks"], started_at, speed),
+        )
+
+
+def load_cassette(path: str) -> list[dict[str, Any]]:
+    """
+    Load the interactions of a cassette.
+    :param path:  The path of the JSONL cassette.
+    :return:  The interactions, in recorded order.
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def cassette_queries(path: str) -> list[str]:
+    """
+    Extract the user queries of the conversations recorded in a cassette, i.e. the last message of every chat
+    completion request that ends with a user message. Requires request bodies to have been recorded.
+    :param path:  The path of the JSONL cassette.
+    :return:  The queries, in recorded order.
+    """
+    queries = []
+    for interaction in load_cassette(path):
+        if not interaction["path"].endswith("/chat/completions"):
+            continue
+        messages = (interaction.get("request") or {}).get("messages") or []
+        if messages and messages[-1].get("role") == "user":
+            queries.append(messages[-1].get("content", ""))
+    return queries
+
+
+def cassette_client(
+    path: str,
+    mode: Literal["record", "replay"],
+    api_key: str | None = None,
+    base_url: str | None = None,
+    timing: TimingMode = "collapse",
+    speed: float = 1.0,
+    cycle: bool = False,
+) -> OpenAI:
+    """
+    Create an OpenAI client that records to or replays from a cassette. Pass it to an agent with `client=`.
+    :param path:  The path of the JSONL cassette.
+    :param mode:  'record' to call the API and append to the cassette, 'replay' to serve the cassette.
+    :param api_key:  The OpenAI API key to record with.  Uses the OPENAI_API_KEY environment variable if not provided.
+    :param base_url:  The base URL of the API to record from.
+    :param timing:  When replaying, 'preserve' to keep the recorded timing or 'collapse' to serve immediately.
+    :param speed:  When replaying with preserved timing, the speed factor.
+    :param cycle:  When replaying, True to start over when the interactions of an endpoint run out.
+    :return:  The OpenAI client.
+    """
+    if mode == "record":
+        transport: httpx.BaseTransport = RecordingTransport(path)
+    elif mode == "replay":
+        transport = ReplayTransport(path, timing=timing, speed=speed, cycle=cycle)
+        api_key = api_key or "replay"
+    else:
+        raise ValueError(f"Unknown cassette mode {mode}")
+
+    return OpenAI(
+        api_key=api_key or os.getenv("OPENAI_API_KEY"),
+        base_url=base_url,
+        http_client=httpx.Client(transport=transport),
+        max_retries=0 if mode == "replay" else 2,
+    )
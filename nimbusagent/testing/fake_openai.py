@@ -0,0 +1,574 @@
+"""
+A local stand-in for the OpenAI API, for measuring the library's own overhead without calling the real API.
+
+It speaks the chat completions (streaming and non-streaming, with tool calls), moderations, embeddings and model
+retrieval endpoints over plain HTTP using only the standard library. Point an agent at it with
+`openai_base_url=server.base_url`.
+
+Run it standalone with:
+
+    python -m nimbusagent.testing.fake_openai --port 8001 --latency 0.2 --tokens-per-second 100
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, Callable
+
+DEFAULT_CONTENT = (
+    "This is a response from the fake OpenAI server. It is long enough to be streamed as a "
+    "number of small chunks, like a real model response would be."
+)
+DEFAULT_EMBEDDING_DIMENSIONS = 64
+
+
+@dataclass
+class FakeToolCall:
+    """
+    A tool call the fake server should respond with.
+
+    :param name:  The name of the function to call.
+    :param arguments:  The arguments to call the function with.
+    """
+
+    name: str
+    arguments: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class FakeResponse:
+    """
+    A chat completion the fake server should respond with. Either content or tool calls, or an error status.
+
+    :param content:  The content of the response.
+    :param tool_calls:  The tool calls of the response.
+    :param status:  The HTTP status to respond with.  Anything but 200 responds with an error instead.
+    :param retry_after:  The Retry-After header of an error response, in seconds.
+    :param delay:  Extra seconds to wait before responding, on top of the server's latency.
+    :param disconnect:  True to drop the connection after streaming the content, before the stream is finished.
+    """
+
+    content: str = ""
+    tool_calls: list[FakeToolCall] = field(default_factory=list)
+    status: int = 200
+    retry_after: float | None = None
+    delay: float = 0.0
+    disconnect: bool = False
+
+
+def _example_value(schema: dict[str, Any]) -> Any:
+    """Returns a plausible value for a JSON schema property."""
+    if schema.get("enum"):
+        return schema["enum"][0]
+    schema_type = schema.get("type")
+    if schema_type == "integer":
+        return 1
+    if schema_type == "number":
+        return 1.5
+    if schema_type == "array":
+        return [_example_value(schema.get("items", {}))]
+    return "Minneapolis, MN"
+
+
+def _example_arguments(parameters: dict[str, Any]) -> dict[str, Any]:
+    """Returns plausible values for the required parameters of a function."""
+    properties = parameters.get("properties", {})
+    return {
+        name: _example_value(properties.get(name, {}))
+        for name in parameters.get("required", [])
+    }
+
+
+def default_responder(body: dict[str, Any], max_tool_calls: int = 2) -> FakeResponse:
+    """
+    Responds like a model running a tool-using conversation: when tools are offered and the last message is from
+    the user, it calls up to max_tool_calls of them with plausible arguments, otherwise it answers with content.
+    :param body:  The JSON body of the chat completion request.
+    :param max_tool_calls:  The maximum number of tools to call at once.
+    :return:  The response to send.
+    """
+    messages = body.get("messages") or []
+    last_role = messages[-1].get("role") if messages else None
+    if last_role == "user":
+        functions = [tool["function"] for tool in body.get("tools") or []]
+        functions = functions or body.get("functions") or []
+        if functions:
+            return FakeResponse(
+                tool_calls=[
+                    FakeToolCall(
+                        name=function["name"],
+                        arguments=_example_arguments(function.get("parameters", {})),
+                    )
+                    for function in functions[:max_tool_calls]
+                ]
+            )
+    return FakeResponse(content=DEFAULT_CONTENT)
+
+
+class ScriptedResponder:
+    """
+    Responds with a fixed list of responses in order, starting over when the list is exhausted.
+
+    :param responses:  The responses to send, as FakeResponse objects or strings of content.
+    """
+
+    def __init__(self, responses: list[FakeResponse | str]):
+        self.responses = [
+            FakeResponse(content=r) if isinstance(r, str) else r for r in responses
+        ]
+        self._cycle = itertools.cycle(self.responses)
+        self._lock = threading.Lock()
+
+    def __call__(self, body: dict[str, Any]) -> FakeResponse:
+        with self._lock:
+            return next(self._cycle)
+
+
+def _split_tokens(content: str) -> list[str]:
+    """Splits content into small pieces, roughly like model tokens."""
+    tokens = []
+    for word in content.split(" "):
+        while len(word) > 4:
+            tokens.append(word[:4])
+            word = word[4:]
+        tokens.append(word + " ")
+    if tokens:
+        tokens[-1] = tokens[-1][:-1]
+    return [token for token in tokens if token]
+
+
+def _count_tokens(value: Any) -> int:
+    """Estimates a token count, at about four characters per token."""
+    return max(1, math.ceil(len(json.dumps(value)) / 4))
+
+
+def fake_embedding(
+    text: str, dimensions: int = DEFAULT_EMBEDDING_DIMENSIONS
+) -> list[float]:
+    """
+    Returns a deterministic unit-length embedding for the text, so equal texts get equal embeddings.
+    :param text:  The text to embed.
+    :param dimensions:  The number of dimensions of the embedding.
+    :return:  The embedding.
+    """
+    values: list[float] = []
+    counter = 0
+    while len(values) < dimensions:
+        digest = hashlib.sha256(f"{counter}:{text}".encode()).digest()
+        values.extend((byte - 127.5) / 127.5 for byte in digest)
+        counter += 1
+    values = values[:dimensions]
+    norm = math.sqrt(sum(value * value for value in values)) or 1.0
+    return [value / norm for value in values]
+
+
+class FakeOpenAIServer:
+    """
+    A local HTTP server that stands in for the OpenAI API.
+
+    :param host:  The host to listen on.
+    :param port:  The port to listen on.  0 picks a free port.
+    :param latency:  Seconds to wait before sending the first byte of every response.
+    :param tokens_per_second:  The rate at which streamed content is sent.  None sends it as fast as possible.
+    :param responder:  A callable receiving the chat completion request body and returning a FakeResponse.
+                       Defaults to default_responder.
+    :param flag_words:  Words that get a moderation request flagged.
+    :param embedding_dimensions:  The number of dimensions of the embeddings returned.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        tokens_per_second: float | None = None,
+        responder: Callable[[dict[str, Any]], FakeResponse] | None = None,
+        flag_words: list[str] | None = None,
+        embedding_dimensions: int = DEFAULT_EMBEDDING_DIMENSIONS,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.responder = responder or default_responder
+        self.flag_words = [word.lower() for word in flag_words or []]
+        self.embedding_dimensions = embedding_dimensions
+        self.request_counts: dict[str, int] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.base_events.Server | None = None
+        self._thread: threading.Thread | None = None
+        self._ids = itertools.count(1)
+        self._writers: set[asyncio.StreamWriter] = set()
+
+    @property
+    def base_url(self) -> str:
+        """The base URL to pass to the OpenAI client (or `openai_base_url` of an agent)."""
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        """
+        Start the server in a background thread.
+        :return:  The server, once it is accepting connections.
+        """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, self.host, self.port)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            tasks = asyncio.all_tasks(self._loop)
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True)
+            )
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="fake-openai", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop the server started with start().
+        """
+        if self._loop is not None and self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+            self._thread = None
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    async def serve_forever(self) -> None:
+        """
+        Run the server on the current event loop until cancelled.
+        """
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                raw_body = await reader.readexactly(length) if length else b""
+                body = json.loads(raw_body) if raw_body else {}
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._route(method, path.split("?")[0], body, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _route(
+        self,
+        method: str,
+        path: str,
+        body: dict[str, Any],
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        endpoint = path.rstrip("/").rsplit("/v1", 1)[-1]
+        self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "POST" and endpoint == "/chat/completions":
+            response = self.responder(body)
+            if response.delay:
+                await asyncio.sleep(response.delay)
+            if response.status != 200:
+                headers = {}
+                if response.retry_after is not None:
+                    headers["Retry-After"] = f"{response.retry_after:g}"
+                await self._send_json(
+                    writer,
+                    {"error": {"message": "Fake error", "code": None}},
+                    status=response.status,
+                    headers=headers,
+                )
+            elif body.get("stream"):
+                await self._send_stream(writer, body, response)
+            else:
+                await self._send_json(writer, self._completion(body, response))
+        elif method == "POST" and endpoint == "/moderations":
+            await self._send_json(writer, self._moderation(body))
+        elif method == "POST" and endpoint == "/embeddings":
+            await self._send_json(writer, self._embeddings(body))
+        elif method == "GET" and endpoint.startswith("/models/"):
+            model = endpoint[len("/models/") :]
+            await self._send_json(
+                writer,
+                {"id": model, "object": "model", "created": 0, "owned_by": "fake"},
+            )
+        else:
+            await self._send_json(
+                writer,
+                {"error": {"message": f"Unknown endpoint {method} {path}"}},
+                status=404,
+            )
+
+    @staticmethod
+    async def _send_json(
+        writer: asyncio.StreamWriter,
+        payload: dict[str, Any],
+        status: int = 200,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        data = json.dumps(payload).encode()
+        reason = HTTPStatus(status).phrase
+        extra_headers = "".join(
+            f"{name}: {value}\r\n" for name, value in (headers or {}).items()
+        )
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json\r\n{extra_headers}"
+            f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+
+    async def _send_stream(
+        self,
+        writer: asyncio.StreamWriter,
+        body: dict[str, Any],
+        response: FakeResponse,
+    ) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        completion_id = f"chatcmpl-fake-{next(self._ids)}"
+        created = int(time.time())
+        model = body.get("model", "fake-model")
+
+        async def send_chunk(delta: dict | None, finish_reason=None, usage=None):
+            chunk: dict[str, Any] = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [],
+            }
+            if delta is not None:
+                chunk["choices"] = [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ]
+            if usage is not None:
+                chunk["usage"] = usage
+            data = f"data: {json.dumps(chunk)}\n\n".encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+
+        delay = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        if response.tool_calls:
+            await send_chunk({"role": "assistant", "content": None})
+            for index, tool_call in enumerate(response.tool_calls):
+                await send_chunk(
+                    {
+                        "tool_calls": [
+                            {
+                                "index": index,
+                                "id": f"call_{completion_id}_{index}",
+                                "type": "function",
+                                "function": {"name": tool_call.name, "arguments": ""},
+                            }
+                        ]
+                    }
+                )
+                arguments = json.dumps(tool_call.arguments)
+                for start in range(0, len(arguments), 8):
+                    await send_chunk(
+                        {
+                            "tool_calls": [
+                                {
+                                    "index": index,
+                                    "function": {
+                                        "arguments": arguments[start : start + 8]
+                                    },
+                                }
+                            ]
+                        }
+                    )
+            await send_chunk({}, finish_reason="tool_calls")
+        else:
+            await send_chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(_split_tokens(response.content)):
+                if delay and i:
+                    await asyncio.sleep(delay)
+                await send_chunk({"content": token})
+            if response.disconnect:
+                writer.transport.abort()
+                raise ConnectionResetError("Fake disconnect")
+            await send_chunk({}, finish_reason="stop")
+
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send_chunk(None, usage=self._usage(body, response))
+
+        data = b"data: [DONE]\n\n"
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n0\r\n\r\n")
+        await writer.drain()
+
+    def _completion(self, body: dict[str, Any], response: FakeResponse) -> dict:
+        message: dict[str, Any] = {"role": "assistant", "content": None}
+        if response.tool_calls:
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{index}",
+                    "type": "function",
+                    "function": {
+                        "name": tool_call.name,
+                        "arguments": json.dumps(tool_call.arguments),
+                    },
+                }
+                for index, tool_call in enumerate(response.tool_calls)
+            ]
+        else:
+            message["content"] = response.content
+
+        return {
+            "id": f"chatcmpl-fake-{next(self._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake-model"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if response.tool_calls else "stop",
+                }
+            ],
+            "usage": self._usage(body, response),
+        }
+
+    @staticmethod
+    def _usage(body: dict[str, Any], response: FakeResponse) -> dict[str, Any]:
+        prompt_tokens = _count_tokens(body.get("messages", []))
+        if response.tool_calls:
+            completion_tokens = _count_tokens(
+                [[t.name, t.arguments] for t in response.tool_calls]
+            )
+        else:
+            completion_tokens = len(_split_tokens(response.content))
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+    def _moderation(self, body: dict[str, Any]) -> dict[str, Any]:
+        inputs = body.get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return {
+            "id": f"modr-fake-{next(self._ids)}",
+            "model": body.get("model") or "omni-moderation-latest",
+            "results": [
+                {
+                    "flagged": any(word in text.lower() for word in self.flag_words),
+                    "categories": {},
+                    "category_scores": {},
+                }
+                for text in inputs
+            ],
+        }
+
+    def _embeddings(self, body: dict[str, Any]) -> dict[str, Any]:
+        inputs = body.get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return {
+            "object": "list",
+            "model": body.get("model", "fake-embedding"),
+            "data": [
+                {
+                    "object": "embedding",
+                    "index": index,
+                    "embedding": fake_embedding(text, self.embedding_dimensions),
+                }
+                for index, text in enumerate(inputs)
+            ],
+            "usage": {
+                "prompt_tokens": _count_tokens(inputs),
+                "total_tokens": _count_tokens(inputs),
+            },
+        }
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description="Run a fake OpenAI API server.")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8001)
+    arg_parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="seconds to wait before the first byte of every response",
+    )
+    arg_parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=None,
+        help="rate at which streamed content is sent",
+    )
+    args = arg_parser.parse_args()
+
+    server = FakeOpenAIServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+    )
+    print(f"Fake OpenAI server listening on http://{args.host}:{args.port}/v1")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
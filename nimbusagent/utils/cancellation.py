@@ -0,0 +1,77 @@
+import contextvars
+import logging
+import threading
+from typing import Callable
+
+
+class AskCancelled(Exception):
+    """Raised inside an ask when it has been cancelled, to stop it at the next model loop or tool call."""
+
+
+class CancellationToken:
+    """
+    Signals that an ask should stop. Cancelling is thread safe and can be done from any thread, e.g. the one serving
+    the connection of a client that went away. The agent stops before its next model loop or tool call and closes its
+    open stream; tools that run for long should check `cancelled` (or wait with `wait()`) to stop early, getting the
+    token of the ask they run for with `current_cancellation_token()`.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: list[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """True once the token has been cancelled."""
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """Cancel, calling the callbacks the first time."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.warning("Cancellation callback failed: %s", e)
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """
+        Call a function when the token is cancelled, right away if it already is.
+        :param callback:  The function, called without arguments in the cancelling thread.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the token is cancelled, e.g. instead of sleeping in a tool.
+        :param timeout:  The longest time to wait, in seconds.
+        :return:  True if the token was cancelled.
+        """
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self) -> None:
+        """Raise AskCancelled if the token has been cancelled."""
+        if self._event.is_set():
+            raise AskCancelled()
+
+
+_current_token: contextvars.ContextVar[CancellationToken | None] = (
+    contextvars.ContextVar("nimbusagent_cancellation_token", default=None)
+)
+
+
+def current_cancellation_token() -> CancellationToken | None:
+    """
+    Get the cancellation token of the ask the calling tool runs for.
+    :return:  The token, or None outside of a tool call.
+    """
+    return _current_token.get()
@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from nimbusagent.utils.metrics import (
+    CIRCUIT_BREAKER_REJECTIONS_TOTAL,
+    CIRCUIT_BREAKER_TRANSITIONS_TOTAL,
+    Metrics,
+    NOOP_METRICS,
+)
+from nimbusagent.utils.retry import classify_error
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+    def __init__(self, endpoint: str):
+        super().__init__(f"The {endpoint} endpoint is unavailable (circuit open)")
+        self.endpoint = endpoint
+
+
+class CircuitBreaker:
+    """
+    Stops calling an endpoint that keeps failing, so callers fail fast instead of each waiting for it to time out.
+    After failure_threshold consecutive transient failures (rate limits, server errors, timeouts and connection
+    errors) the circuit opens and calls are rejected. After recovery_time seconds it is half-open: up to
+    half_open_max_calls probe calls are let through, and the circuit closes again if they succeed or opens again if
+    one fails.
+
+    :param endpoint:  The name of the endpoint, for logs and metrics.
+    :param failure_threshold:  The number of consecutive failures that opens the circuit.
+    :param recovery_time:  The number of seconds to reject calls for before probing the endpoint.
+    :param half_open_max_calls:  The number of probe calls to let through at once while half-open.
+    :param metrics:  The metrics to record state changes and rejected calls to.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        failure_threshold: int = 5,
+        recovery_time: float = 30.0,
+        half_open_max_calls: int = 1,
+        metrics: Metrics | None = None,
+    ):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.half_open_max_calls = half_open_max_calls
+        self.metrics = metrics if metrics is not None else NOOP_METRICS
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        # whether the call the current thread was allowed to make is a probe
+        self._admission = threading.local()
+
+    @property
+    def state(self) -> str:
+        """'closed', 'open' or 'half_open'."""
+        with self._lock:
+            if self._state == OPEN and self._recovered():
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        Check whether a call may be made, taking a probe slot if the circuit is half-open. Every allowed call must be
+        followed by record_success() or record_failure() on the same thread.
+        :return:  True if the call may be made.
+        """
+        with self._lock:
+            if self._state == OPEN and self._recovered():
+                self._transition(HALF_OPEN)
+            if self._state == CLOSED:
+                self._admission.probe = False
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                self._admission.probe = True
+                return True
+        self.metrics.inc(
+            CIRCUIT_BREAKER_REJECTIONS_TOTAL, labels={"endpoint": self.endpoint}
+        )
+        return False
+
+    def record_success(self) -> None:
+        """Record a successful call, closing a half-open circuit."""
+        probe = self._take_admission()
+        with self._lock:
+            self._failures = 0
+            if self._state == HALF_OPEN and probe:
+                self._probes -= 1
+                self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        """Record a failed call, opening the circuit after failure_threshold consecutive failures."""
+        probe = self._take_admission()
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN and probe:
+                self._probes -= 1
+                self._open()
+            elif self._state == CLOSED and self._failures >= self.failure_threshold:
+                self._open()
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Call a function through the breaker. Only transient errors count as failures; others, e.g. a bad request,
+        show the endpoint is up.
+        :param func:  The function to call.
+        :return:  The result of the function.
+        :raises CircuitOpenError:  If the circuit is open.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.endpoint)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if classify_error(e) is not None:
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def _take_admission(self) -> bool:
+        """
+        Take whether the call being recorded was allowed as a probe of a half-open circuit.
+        """
+        probe = getattr(self._admission, "probe", False)
+        self._admission.probe = False
+        return probe
+
+    def _recovered(self) -> bool:
+        return time.monotonic() - self._opened_at >= self.recovery_time
+
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self._probes = 0
+        self._transition(OPEN)
+
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        logging.warning(
+            "Circuit breaker of the %s endpoint is now %s", self.endpoint, state
+        )
+        self._state = state
+        self.metrics.inc(
+            CIRCUIT_BREAKER_TRANSITIONS_TOTAL,
+            labels={"endpoint": self.endpoint, "state": state},
+        )
+
+
+class CircuitBreakers:
+    """
+    The circuit breakers of the chat, moderation and embedding endpoints, and how agents degrade while they are open.
+    Share one instance between the agents of a process.
+
+    - chat: asks fail fast with CircuitOpenError (a StreamingAgent yields its "temporarily unavailable" message).
+    - moderation: queries are treated as safe if moderation_fail_open is set, and refused otherwise.
+    - embeddings: function routing skips the embeddings and only uses always_use functions and pattern groups.
+
+    Moderation calls that fail with a transient error are degraded the same way as when the circuit is open.
+
+    :param failure_threshold:  The number of consecutive failures that opens a circuit.
+    :param recovery_time:  The number of seconds to reject calls for before probing an endpoint.
+    :param moderation_fail_open:  True to let queries through unmoderated while moderation is unavailable.
+    :param metrics:  The metrics to record state changes and rejected calls to.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        recovery_time: float = 30.0,
+        moderation_fail_open: bool = False,
+        metrics: Metrics | None = None,
+    ):
+        self.moderation_fail_open = moderation_fail_open
+        self.chat = CircuitBreaker(
+            "chat", failure_threshold, recovery_time, metrics=metrics
+        )
+        self.moderation = CircuitBreaker(
+            "moderation", failure_threshold, recovery_time, metrics=metrics
+        )
+        self.embeddings = CircuitBreaker(
+            "embeddings", failure_threshold, recovery_time, metrics=metrics
+        )
+
+    def get_states(self) -> dict[str, str]:
+        """
+        Get the state of every circuit.
+        :return:  The states by endpoint.
+        """
+        return {
+            breaker.endpoint: breaker.state
+            for breaker in (self.chat, self.moderation, self.embeddings)
+        }
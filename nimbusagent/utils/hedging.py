@@ -0,0 +1,244 @@
+import atexit
+import contextvars
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from nimbusagent.utils.cancellation import CancellationToken
+
+
+@dataclass
+class HedgeResult:
+    """
+    The outcome of a hedged call.
+
+    :param result:  The result of the attempt that finished first.
+    :param hedged:  True if a hedge was sent.
+    :param hedge_won:  True if the hedge finished first.
+    :param latency:  The time until the winning attempt finished, in seconds.
+    """
+
+    result: Any
+    hedged: bool = False
+    hedge_won: bool = False
+    latency: float = 0.0
+
+
+class HedgePolicy:
+    """
+    Hedges slow model calls: when the first attempt has not responded after a delay, a second attempt is sent and
+    whichever responds first is used. The delay is the given percentile of recently observed latencies, so only the
+    slowest calls are hedged, and hedges are capped to a fraction of recent calls so that an upstream slowdown does not
+    double the load. Share one instance between agents; it keeps the latency samples and the hedge counts. Its threads
+    are shut down at exit, or with shutdown().
+
+    :param percentile:  The percentile of recent latencies after which a call is hedged.
+    :param initial_delay:  The delay to use until min_samples latencies have been observed, in seconds.
+    :param min_delay:  The shortest delay, in seconds.
+    :param max_delay:  The longest delay, in seconds.
+    :param max_hedge_rate:  The maximum fraction of recent calls that may be hedged.
+    :param use_secondary_model:  True to send the hedge to the agent's secondary model.
+    :param window:  The number of recent calls to compute the percentile and hedge rate over.
+    :param min_samples:  The number of latencies to observe before using the percentile.
+    :param max_workers:  The number of threads to run attempts in.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        initial_delay: float = 2.0,
+        min_delay: float = 0.05,
+        max_delay: float = 10.0,
+        max_hedge_rate: float = 0.1,
+        use_secondary_model: bool = False,
+        window: int = 200,
+        min_samples: int = 20,
+        max_workers: int = 32,
+    ):
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_hedge_rate = max_hedge_rate
+        self.use_secondary_model = use_secondary_model
+        self.min_samples = min_samples
+        self.calls = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._recent_hedges: deque[bool] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="nimbusagent-hedge"
+        )
+        atexit.register(self.shutdown)
+
+    def get_delay(self) -> float:
+        """
+        Get the time to wait for the first attempt before hedging.
+        :return:  The delay in seconds.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                delay = self.initial_delay
+            else:
+                latencies = sorted(self._latencies)
+                index = math.ceil(self.percentile / 100 * len(latencies)) - 1
+                delay = latencies[min(max(index, 0), len(latencies) - 1)]
+        return min(max(delay, self.min_delay), self.max_delay)
+
+    def shutdown(self) -> None:
+        """
+        Stop the threads of the policy, cancelling the attempts that have not started. Attempts that are running
+        finish in the background.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> dict[str, Any]:
+        """
+        Get the hedge counts since the policy was created.
+        :return:  The number of calls, hedges and hedges that won, and the current delay.
+        """
+        with self._lock:
+            stats: dict[str, float] = {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedges_won": self.hedges_won,
+            }
+        stats["delay"] = self.get_delay()
+        return stats
+
+    def _can_hedge(self) -> bool:
+        if self.max_hedge_rate <= 0:
+            return False
+        with self._lock:
+            hedged = sum(self._recent_hedges)
+            return hedged < max(1.0, self.max_hedge_rate * len(self._recent_hedges))
+
+    def _record(self, latency: float, hedged: bool, hedge_won: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self._latencies.append(latency)
+            self._recent_hedges.append(hedged)
+            if hedged:
+                self.hedges += 1
+            if hedge_won:
+                self.hedges_won += 1
+
+    def call(
+        self,
+        attempt: Callable[[CancellationToken], Any],
+        hedge: Callable[[CancellationToken], Any],
+        discard: Callable[[Any], None] | None = None,
+    ) -> HedgeResult:
+        """
+        Call attempt, and hedge it with a call to hedge if it has not finished after the delay, counted from when the
+        attempt starts running. Both run in the context of the caller, e.g. with its cancellation token. The attempt
+        that finishes first wins. The other one is cancelled: it does not start if it is still queued, and its token is
+        cancelled so that it can stop early, e.g. before retrying. If it still finishes, its result is passed to
+        discard, e.g. to close its stream.
+        :param attempt:  The first attempt, called with a token that is cancelled if it loses.
+        :param hedge:  The hedge, called with a token that is cancelled if it loses.
+        :param discard:  Called with the result of the losing attempt.
+        :return:  The outcome.
+        """
+        first_token, second_token = CancellationToken(), CancellationToken()
+        if not self._can_hedge():
+            start = time.perf_counter()
+            result = attempt(first_token)
+            latency = time.perf_counter() - start
+            self._record(latency, False, False)
+            return HedgeResult(result, latency=latency)
+
+        started = threading.Event()
+        started_at: list[float] = []
+
+        def run_first() -> Any:
+            started_at.append(time.perf_counter())
+            started.set()
+            return attempt(first_token)
+
+        first = self._executor.submit(contextvars.copy_context().run, run_first)
+        # the time spent queued for a thread does not count toward the delay
+        first.add_done_callback(lambda f: started.set())
+        started.wait()
+        start = started_at[0] if started_at else time.perf_counter()
+        done, _ = wait([first], timeout=self.get_delay())
+        if done:
+            latency = time.perf_counter() - start
+            self._record(latency, False, False)
+            return HedgeResult(first.result(), latency=latency)
+
+        second = self._executor.submit(
+            contextvars.copy_context().run, hedge, second_token
+        )
+        pending = {first, second}
+        winner: Future | None = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in (first, second):
+                if future in done and winner is None and future.exception() is None:
+                    winner = future
+
+        latency = time.perf_counter() - start
+        hedge_won = winner is second
+        self._record(latency, True, hedge_won)
+        if winner is None:
+            # both attempts failed: result() raises the error of the first one
+            return HedgeResult(first.result(), True, False, latency)
+
+        loser, loser_token = (
+            (first, first_token) if hedge_won else (second, second_token)
+        )
+        loser_token.cancel()
+        if not loser.cancel():
+            loser.add_done_callback(lambda f: _discard(f, discard))
+        logging.info(
+            "Hedged model call after %.2fs, %s won",
+            latency,
+            "hedge" if hedge_won else "first attempt",
+        )
+        return HedgeResult(winner.result(), True, hedge_won, latency)
+
+
+class PrefetchedStream:
+    """
+    A chat completion stream whose first chunk has already been read, to race streams on their time to first chunk.
+    Iterating it yields the first chunk and then the rest of the stream.
+
+    :param stream:  The stream.
+    """
+
+    _NO_CHUNK = object()
+
+    def __init__(self, stream: Any):
+        self.stream = stream
+        self._iterator = iter(stream)
+        self._first = next(self._iterator, self._NO_CHUNK)
+
+    def __iter__(self) -> "PrefetchedStream":
+        return self
+
+    def __next__(self) -> Any:
+        if self._first is not self._NO_CHUNK:
+            first, self._first = self._first, self._NO_CHUNK
+            return first
+        return next(self._iterator)
+
+    def close(self) -> None:
+        if hasattr(self.stream, "close"):
+            self.stream.close()
+
+
+def _discard(future: Future, discard: Callable[[Any], None] | None) -> None:
+    if discard is None or future.cancelled() or future.exception() is not None:
+        return
+    try:
+        discard(future.result())
+    except Exception as e:
+        logging.warning("Unable to discard the losing hedged call: %s", e)
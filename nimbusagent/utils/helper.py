@@ -1,23 +1,91 @@
+import functools
 import logging
 import os
-from typing import Iterable, Any
+import threading
+from collections import OrderedDict
+from typing import Iterable, Any, Hashable
 
-import numpy as np
 from openai import OpenAI
 
+from nimbusagent.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from nimbusagent.utils.rate_limit import PRIORITY_INTERACTIVE, RateLimiter
+from nimbusagent.utils.retry import RetryBudget, classify_error
+
 FUNCTIONS_EMBEDDING_MODEL = "text-embedding-ada-002"
 
 
-def is_query_safe(query: str, api_key=None) -> bool:
+def is_query_safe(
+    query: str,
+    api_key=None,
+    client: OpenAI | None = None,
+    retry: RetryBudget | None = None,
+    rate_limiter: RateLimiter | None = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    circuit_breaker: CircuitBreaker | None = None,
+    fail_open: bool = False,
+) -> bool:
     """Returns True if the query is considered safe, False otherwise.
     :param query: The query to check.
     :param api_key: The OpenAI API key to use. Uses the OPENAI_API_KEY environment variable if not provided.
+    :param client: The OpenAI client to use. A new client is created if not provided.
+    :param retry: The retry budget to retry transient API errors with. Not retried if not provided.
+    :param rate_limiter: The rate limiter to wait for before the request. Not limited if not provided.
+    :param priority: The priority of the request for the rate limiter.
+    :param circuit_breaker: The circuit breaker of the moderation endpoint.
+    :param fail_open: True to consider the query safe when moderation is unavailable: its circuit breaker is open or
+                      the request failed with a transient error.
     :return: True if the query is considered safe, False otherwise.
     """
-    client = OpenAI(api_key=api_key if api_key else os.environ["OPENAI_API_KEY"])
+    is_safe = check_query_safety(
+        query,
+        api_key=api_key,
+        client=client,
+        retry=retry,
+        rate_limiter=rate_limiter,
+        priority=priority,
+        circuit_breaker=circuit_breaker,
+    )
+    if is_safe is None:
+        if fail_open:
+            logging.warning("Moderation is unavailable, letting the query through")
+        return fail_open
+    return is_safe
+
+
+def check_query_safety(
+    query: str,
+    api_key=None,
+    client: OpenAI | None = None,
+    retry: RetryBudget | None = None,
+    rate_limiter: RateLimiter | None = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    circuit_breaker: CircuitBreaker | None = None,
+) -> bool | None:
+    """Checks the query with OpenAI's moderation API, telling an unavailable API apart from an unsafe query.
+    :param query: The query to check.
+    :param api_key: The OpenAI API key to use. Uses the OPENAI_API_KEY environment variable if not provided.
+    :param client: The OpenAI client to use. A new client is created if not provided.
+    :param retry: The retry budget to retry transient API errors with. Not retried if not provided.
+    :param rate_limiter: The rate limiter to wait for before the request. Not limited if not provided.
+    :param priority: The priority of the request for the rate limiter.
+    :param circuit_breaker: The circuit breaker of the moderation endpoint.
+    :return: True if the query is considered safe, False if it was flagged or could not be checked because of a
+             non-transient error, and None if the API is unavailable: its circuit breaker is open or the request
+             failed with a transient error.
+    """
+    if client is None:
+        client = OpenAI(api_key=api_key if api_key else os.environ["OPENAI_API_KEY"])
 
+    create = client.moderations.create
+    if circuit_breaker is not None:
+        create = functools.partial(circuit_breaker.call, create)
     try:
-        response = client.moderations.create(input=query)
+        if rate_limiter is not None:
+            rate_limiter.acquire(0, priority)
+        if retry is not None:
+            response = retry.call("moderation", create, input=query)
+        else:
+            response = create(input=query)
 
         if response and response.results:
             result = response.results[0]
@@ -32,21 +100,49 @@ def is_query_safe(query: str, api_key=None) -> bool:
 
     except Exception as e:
         logging.info(f"An error occurred while checking query safety: {e}")
+        if isinstance(e, CircuitOpenError) or classify_error(e) is not None:
+            return None
 
     return False
 
 
-def get_embedding(text, model=FUNCTIONS_EMBEDDING_MODEL, api_key=None):
+def get_embedding(
+    text,
+    model=FUNCTIONS_EMBEDDING_MODEL,
+    api_key=None,
+    client: OpenAI | None = None,
+    retry: RetryBudget | None = None,
+    rate_limiter: RateLimiter | None = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    circuit_breaker: CircuitBreaker | None = None,
+):
     """Returns the embedding of the given text.
     :param text: The text to get the embedding of.
     :param model: The model to use. Defaults to the text-embedding-3-small model.
     :param api_key: The OpenAI API key to use. Uses the OPENAI_API_KEY environment variable if not provided.
-    :return: The embedding of the given text.
+    :param client: The OpenAI client to use. A new client is created if not provided.
+    :param retry: The retry budget to retry transient API errors with. Not retried if not provided.
+    :param rate_limiter: The rate limiter to wait for before the request, charged about 4 characters per token.
+                         Not limited if not provided.
+    :param priority: The priority of the request for the rate limiter.
+    :param circuit_breaker: The circuit breaker of the embeddings endpoint.
+    :return: The embedding of the given text, or None if it could not be fetched.
     """
     try:
         text = text.replace("\n", " ")
-        client = OpenAI(api_key=api_key if api_key else os.environ["OPENAI_API_KEY"])
-        embedding = client.embeddings.create(input=text, model=model)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key if api_key else os.environ["OPENAI_API_KEY"]
+            )
+        create = client.embeddings.create
+        if circuit_breaker is not None:
+            create = functools.partial(circuit_breaker.call, create)
+        if rate_limiter is not None:
+            rate_limiter.acquire(len(text) // 4 + 1, priority)
+        if retry is not None:
+            embedding = retry.call("embedding", create, input=text, model=model)
+        else:
+            embedding = create(input=text, model=model)
         return embedding.data[0].embedding
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -59,6 +155,8 @@ def cosine_similarity(a, b):
     :param b: The second vector.
     :return: The cosine similarity of the two vectors.
     """
+    import numpy as np
+
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
 
@@ -68,6 +166,8 @@ def find_similar_embedding_list(
     embeddings_model: str = FUNCTIONS_EMBEDDING_MODEL,
     k_nearest_neighbors: int = 1,
     min_similarity: float = 0.1,
+    query_embedding: list[float] | None = None,
+    client: OpenAI | None = None,
 ):
     """
     Return the k function descriptions most similar to given query.
@@ -76,12 +176,15 @@ def find_similar_embedding_list(
     :param function_embeddings: The list of function embeddings to compare to.
     :param k_nearest_neighbors: The number of nearest neighbors to return.
     :param min_similarity: The minimum cosine similarity to consider a function relevant.
+    :param query_embedding: The embedding of the query, if already known. Fetched from the API if not provided.
+    :param client: The OpenAI client to fetch the query embedding with. A new client is created if not provided.
     :return: The k function descriptions most similar to given query.
     """
     if not function_embeddings or len(function_embeddings) == 0 or not query:
         return None
 
-    query_embedding = get_embedding(query, model=embeddings_model)
+    if query_embedding is None:
+        query_embedding = get_embedding(query, model=embeddings_model, client=client)
     if not query_embedding:
         return None
 
@@ -102,6 +205,58 @@ def find_similar_embedding_list(
     return sorted_similarities[:k_nearest_neighbors]
 
 
+class EmbeddingIndex:
+    """
+    Function embeddings stacked into a normalized matrix once, so a query is compared to all of them with a single
+    matrix product instead of one cosine similarity per function. Returns the same results as
+    find_similar_embedding_list.
+
+    :param function_embeddings:  The function embeddings, dictionaries with 'name' and 'embedding' fields.
+    """
+
+    def __init__(self, function_embeddings: list[dict]):
+        import numpy as np
+
+        self.names = [embedding["name"] for embedding in function_embeddings]
+        matrix = np.array(
+            [embedding["embedding"] for embedding in function_embeddings],
+            dtype=float,
+        )
+        if len(self.names):
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def search(
+        self,
+        query_embedding: list[float] | None,
+        k_nearest_neighbors: int = 1,
+        min_similarity: float = 0.1,
+    ) -> list[dict] | None:
+        """
+        Return the k functions most similar to the query embedding.
+        :param query_embedding: The embedding of the query.
+        :param k_nearest_neighbors: The number of nearest neighbors to return.
+        :param min_similarity: The minimum cosine similarity to consider a function relevant.
+        :return: The names and similarities of the k most similar functions, most similar first.
+        """
+        if not self.names or not query_embedding:
+            return None
+
+        import numpy as np
+
+        query = np.asarray(query_embedding, dtype=float)
+        similarities = self.matrix @ (query / np.linalg.norm(query))
+        found = [
+            {"name": self.names[i], "similarity": float(similarities[i])}
+            for i in np.flatnonzero(similarities >= min_similarity)
+        ]
+        found.sort(key=lambda x: x["similarity"], reverse=True)
+        return found[:k_nearest_neighbors]
+
+
 def combine_lists_unique(list1: Iterable[Any], set2: Iterable[Any] | set) -> list[Any]:
     """Combine two lists, removing duplicates.
     :param list1: The first list.
@@ -118,3 +273,48 @@ def combine_lists_unique(list1: Iterable[Any], set2: Iterable[Any] | set) -> lis
             new_list.append(item)
 
     return new_list
+
+
+class LRUCache:
+    """
+    A small thread safe least-recently-used cache. Share one instance between agents to cache moderation results or
+    query embeddings across asks.
+
+    :param max_entries: The maximum number of entries to keep.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the cached value for the key, marking it as recently used.
+        :param key: The key to look up.
+        :param default: The value to return if the key is not cached.
+        :return: The cached value, or the default.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Caches a value, evicting the least recently used entries when full.
+        :param key: The key to cache the value under.
+        :param value: The value to cache.
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
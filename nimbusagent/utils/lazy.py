@@ -0,0 +1,46 @@
+import importlib
+import logging
+import time
+from typing import Any, Iterable
+
+# The optional heavy modules the library imports on first use, and what needs them.
+LAZY_MODULES = {
+    "numpy": "embedding routing, exemplar model routing and the semantic response cache",
+    "tiktoken": "token counting of the chat history and function results",
+}
+
+DEFAULT_TOKEN_ENCODINGS = ("cl100k_base",)
+
+
+def get_encoding(name: str) -> Any:
+    """
+    Get a tiktoken encoding, importing tiktoken on first use. Tiktoken keeps every loaded encoding, so only the first
+    call for an encoding reads (or downloads) its BPE file.
+    :param name:  The name of the encoding, e.g. 'cl100k_base'.
+    :return:  The encoding.
+    """
+    import tiktoken
+
+    return tiktoken.get_encoding(name)
+
+
+def warmup(
+    token_encodings: Iterable[str] = DEFAULT_TOKEN_ENCODINGS,
+) -> dict[str, float]:
+    """
+    Import the modules the library loads lazily and load the token encodings now, so the first ask of a long-running
+    server does not pay for them. Short-lived workers that only need some of them can skip this.
+    :param token_encodings:  The tiktoken encodings to load.
+    :return:  The seconds each step took, by module or encoding name.
+    """
+    timings = {}
+    for module in LAZY_MODULES:
+        start = time.perf_counter()
+        importlib.import_module(module)
+        timings[module] = time.perf_counter() - start
+    for name in token_encodings:
+        start = time.perf_counter()
+        get_encoding(name)
+        timings[name] = time.perf_counter() - start
+    logging.info("Warmed up in %.3fs: %s", sum(timings.values()), timings)
+    return timings
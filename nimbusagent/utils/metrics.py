@@ -0,0 +1,255 @@
+import bisect
+import math
+import threading
+from typing import Iterable
+
+MODEL_CALL_SECONDS = "nimbusagent_model_call_seconds"
+TIME_TO_FIRST_TOKEN_SECONDS = "nimbusagent_time_to_first_token_seconds"
+PROMPT_TOKENS_TOTAL = "nimbusagent_prompt_tokens_total"
+COMPLETION_TOKENS_TOTAL = "nimbusagent_completion_tokens_total"
+CACHED_TOKENS_TOTAL = "nimbusagent_cached_tokens_total"
+TOOL_CALL_SECONDS = "nimbusagent_tool_call_seconds"
+TOOL_CALL_ERRORS_TOTAL = "nimbusagent_tool_call_errors_total"
+MODERATION_SECONDS = "nimbusagent_moderation_seconds"
+MODERATION_CACHE_TOTAL = "nimbusagent_moderation_cache_total"
+EMBEDDING_SECONDS = "nimbusagent_embedding_seconds"
+EMBEDDING_CACHE_TOTAL = "nimbusagent_embedding_cache_total"
+RESPONSE_CACHE_TOTAL = "nimbusagent_response_cache_total"
+RETRIES_TOTAL = "nimbusagent_retries_total"
+HEDGES_TOTAL = "nimbusagent_hedges_total"
+MODEL_ROUTES_TOTAL = "nimbusagent_model_routes_total"
+ASKS_CANCELLED_TOTAL = "nimbusagent_asks_cancelled_total"
+RATE_LIMIT_WAIT_SECONDS = "nimbusagent_rate_limit_wait_seconds"
+CIRCUIT_BREAKER_TRANSITIONS_TOTAL = "nimbusagent_circuit_breaker_transitions_total"
+CIRCUIT_BREAKER_REJECTIONS_TOTAL = "nimbusagent_circuit_breaker_rejections_total"
+ASK_SECONDS = "nimbusagent_ask_seconds"
+ASK_LOOPS = "nimbusagent_ask_loops"
+HTTP_REQUESTS_TOTAL = "nimbusagent_http_requests_total"
+HTTP_REQUEST_SECONDS = "nimbusagent_http_request_seconds"
+HTTP_CLIENT_DISCONNECTS_TOTAL = "nimbusagent_http_client_disconnects_total"
+
+METRIC_DESCRIPTIONS = {
+    MODEL_CALL_SECONDS: "Duration of chat completion calls, including reading the stream.",
+    TIME_TO_FIRST_TOKEN_SECONDS: "Time from a chat completion request to its first chunk.",
+    PROMPT_TOKENS_TOTAL: "Prompt tokens reported by the API.",
+    COMPLETION_TOKENS_TOTAL: "Completion tokens reported by the API.",
+    CACHED_TOKENS_TOTAL: "Prompt tokens served from the prompt cache.",
+    TOOL_CALL_SECONDS: "Duration of tool (function) calls.",
+    TOOL_CALL_ERRORS_TOTAL: "Tool (function) calls that raised an exception.",
+    MODERATION_SECONDS: "Duration of moderation checks.",
+    MODERATION_CACHE_TOTAL: "Moderation cache lookups by result.",
+    EMBEDDING_SECONDS: "Duration of embedding function routing.",
+    EMBEDDING_CACHE_TOTAL: "Query embedding cache lookups by result.",
+    RESPONSE_CACHE_TOTAL: "Response cache lookups by result.",
+    RETRIES_TOTAL: "Retries of API calls after transient errors, by operation and reason.",
+    HEDGES_TOTAL: "Hedged model calls, by whether the hedge won.",
+    MODEL_ROUTES_TOTAL: "Model router decisions, by tier and reason.",
+    ASKS_CANCELLED_TOTAL: "Asks cancelled before they finished.",
+    RATE_LIMIT_WAIT_SECONDS: "Time API calls waited for the client-side rate limiter.",
+    CIRCUIT_BREAKER_TRANSITIONS_TOTAL: "Circuit breaker state changes, by endpoint and new state.",
+    CIRCUIT_BREAKER_REJECTIONS_TOTAL: "Calls rejected by an open circuit breaker, by endpoint.",
+    ASK_SECONDS: "Wall time of ask() calls.",
+    ASK_LOOPS: "Number of model loops per ask() call.",
+    HTTP_REQUESTS_TOTAL: "HTTP requests served by nimbusagent.serve, by route and status.",
+    HTTP_REQUEST_SECONDS: "Duration of HTTP requests served by nimbusagent.serve, by route.",
+    HTTP_CLIENT_DISCONNECTS_TOTAL: "Streaming requests cancelled because the client disconnected.",
+}
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+DEFAULT_METRIC_BUCKETS = {ASK_LOOPS: (1, 2, 3, 4, 5, 6, 8, 10)}
+
+
+class Metrics:
+    """
+    Interface for recording metrics. This base class records nothing and is used when no metrics are configured.
+    Subclass it to forward the metrics to your own metrics library, or use MetricsRegistry.
+    """
+
+    def inc(
+        self, name: str, value: float = 1.0, labels: dict[str, str] | None = None
+    ) -> None:
+        """
+        Increment a counter.
+        :param name:  The name of the counter.
+        :param value:  The amount to increment the counter by.
+        :param labels:  The labels of the counter.
+        """
+
+    def observe(
+        self, name: str, value: float, labels: dict[str, str] | None = None
+    ) -> None:
+        """
+        Record an observation in a histogram.
+        :param name:  The name of the histogram.
+        :param value:  The value to record.
+        :param labels:  The labels of the histogram.
+        """
+
+
+NOOP_METRICS = Metrics()
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels: Iterable[tuple[str, str]]) -> str:
+    parts = []
+    for key, value in labels:
+        value = (
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        )
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry(Metrics):
+    """
+    In-process metrics registry that keeps counters and histograms in memory and renders them in the Prometheus text
+    exposition format, so they can be scraped without any extra dependencies. It is thread safe.
+
+    :param buckets:  The histogram buckets to use, by metric name. Metrics not listed use DEFAULT_BUCKETS.
+    :param descriptions:  The help text to render, by metric name. Defaults to METRIC_DESCRIPTIONS.
+    """
+
+    def __init__(
+        self,
+        buckets: dict[str, tuple[float, ...]] | None = None,
+        descriptions: dict[str, str] | None = None,
+    ):
+        self.buckets = {**DEFAULT_METRIC_BUCKETS, **(buckets or {})}
+        self.descriptions = {**METRIC_DESCRIPTIONS, **(descriptions or {})}
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, _Histogram]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _label_key(labels: dict[str, str] | None) -> tuple:
+        return tuple(sorted(labels.items())) if labels else ()
+
+    def inc(
+        self, name: str, value: float = 1.0, labels: dict[str, str] | None = None
+    ) -> None:
+        key = self._label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(
+        self, name: str, value: float, labels: dict[str, str] | None = None
+    ) -> None:
+        key = self._label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = _Histogram(
+                    tuple(sorted(self.buckets.get(name, DEFAULT_BUCKETS)))
+                )
+                series[key] = histogram
+            histogram.observe(value)
+
+    def get_counter(self, name: str, labels: dict[str, str] | None = None) -> float:
+        """
+        Get the current value of a counter.
+        :param name:  The name of the counter.
+        :param labels:  The labels of the counter.
+        :return:  The value of the counter, 0 if it has not been incremented.
+        """
+        with self._lock:
+            return self._counters.get(name, {}).get(self._label_key(labels), 0.0)
+
+    def get_histogram_count(
+        self, name: str, labels: dict[str, str] | None = None
+    ) -> int:
+        """
+        Get the number of observations recorded in a histogram.
+        :param name:  The name of the histogram.
+        :param labels:  The labels of the histogram.
+        :return:  The number of observations, 0 if nothing has been observed.
+        """
+        with self._lock:
+            histogram = self._histograms.get(name, {}).get(self._label_key(labels))
+            return histogram.count if histogram else 0
+
+    def reset(self) -> None:
+        """
+        Remove all recorded metrics.
+        """
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def render_prometheus(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format (version 0.0.4).
+        :return:  The metrics as text.
+        """
+        lines: list[str] = []
+        with self._lock:
+            for name in sorted(self._counters):
+                self._render_header(lines, name, "counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+            for name in sorted(self._histograms):
+                self._render_header(lines, name, "histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        bucket_labels = key + (("le", _format_value(bound)),)
+                        lines.append(
+                            f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                        )
+                    inf_labels = key + (("le", "+Inf"),)
+                    lines.append(
+                        f"{name}_bucket{_format_labels(inf_labels)} {histogram.count}"
+                    )
+                    lines.append(
+                        f"{name}_sum{_format_labels(key)} {_format_value(histogram.sum)}"
+                    )
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def _render_header(self, lines: list[str], name: str, metric_type: str) -> None:
+        description = self.descriptions.get(name)
+        if description:
+            lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
@@ -0,0 +1,185 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import tracemalloc
+
+_MEMORY_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class ProfileSession:
+    """
+    The cProfile and tracemalloc recording of a single ask. Created by AskProfiler.start_ask().
+
+    :param profiler:  The AskProfiler that started the session.
+    :param number:  The number of the ask, counting every ask seen by the profiler.
+    """
+
+    def __init__(self, profiler: "AskProfiler", number: int):
+        self.profiler = profiler
+        self.number = number
+        self.profile = cProfile.Profile()
+        self.started_tracemalloc = False
+        self.active = False
+
+    def start(self) -> bool:
+        """
+        Start recording.
+        :return:  True if recording started, False if another profiler is already active on this thread.
+        """
+        if self.profiler.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(self.profiler.memory_frames)
+            self.started_tracemalloc = True
+        return self.resume()
+
+    def pause(self) -> None:
+        """
+        Pause CPU profiling, e.g. while a streaming response is handed back to the caller.
+        """
+        if self.active:
+            self.profile.disable()
+            self.active = False
+
+    def resume(self) -> bool:
+        """
+        Resume CPU profiling after a pause.
+        :return:  True if profiling is active, False if another profiler is already active on this thread.
+        """
+        if self.active:
+            return True
+        try:
+            self.profile.enable()
+        except ValueError as e:
+            logging.warning("Unable to profile ask: %s", e)
+            return False
+        self.active = True
+        return True
+
+    def stop(self) -> None:
+        """
+        Stop recording and write the reports.
+        """
+        self.pause()
+        snapshot = None
+        if self.profiler.trace_memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS)
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+        self.profiler._write_reports(self, snapshot)
+
+
+class AskProfiler:
+    """
+    Opt-in profiler that wraps asks in cProfile and tracemalloc and writes a report per profiled ask to a directory:
+    `ask-<n>.cpu.txt` with the top functions by cumulative time, `ask-<n>.prof` with the raw cProfile stats (for
+    tools like snakeviz), and `ask-<n>.mem.txt` with the allocations made during the ask that are still alive at
+    the end of it, diffed against the previous profiled ask.
+
+    Only the library's own work is profiled. For a StreamingAgent, profiling is paused while the response is
+    handed back to the caller.
+
+    :param output_dir:  The directory to write the reports to.
+    :param every_n:  Profile every Nth ask.  Defaults to every ask.
+    :param top_n:  The number of functions and allocation sites to include in the reports.
+    :param trace_memory:  True to record allocations with tracemalloc.
+    :param memory_frames:  The number of frames tracemalloc keeps per allocation.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        every_n: int = 1,
+        top_n: int = 30,
+        trace_memory: bool = True,
+        memory_frames: int = 1,
+    ):
+        self.output_dir = output_dir
+        self.every_n = max(1, every_n)
+        self.top_n = top_n
+        self.trace_memory = trace_memory
+        self.memory_frames = memory_frames
+        self.last_report: str | None = None
+        self._count = 0
+        self._previous_snapshot: tracemalloc.Snapshot | None = None
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def start_ask(self) -> ProfileSession | None:
+        """
+        Start profiling an ask, if it is one of the every_n asks to profile.
+        :return:  The running ProfileSession, or None if the ask is not profiled.
+        """
+        with self._lock:
+            self._count += 1
+            number = self._count
+        if (number - 1) % self.every_n:
+            return None
+
+        session = ProfileSession(self, number)
+        if not session.start():
+            if session.started_tracemalloc:
+                tracemalloc.stop()
+            return None
+        return session
+
+    def _write_reports(
+        self, session: ProfileSession, snapshot: tracemalloc.Snapshot | None
+    ) -> None:
+        """
+        Write the reports of a finished session.
+        :param session:  The finished session.
+        :param snapshot:  The tracemalloc snapshot taken at the end of the ask, if memory was traced.
+        """
+        base_path = os.path.join(self.output_dir, f"ask-{session.number}")
+
+        stream = io.StringIO()
+        stats = pstats.Stats(session.profile, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+        with open(f"{base_path}.cpu.txt", "w") as f:
+            f.write(stream.getvalue())
+        stats.dump_stats(f"{base_path}.prof")
+
+        if snapshot is not None:
+            with self._lock:
+                previous_snapshot = self._previous_snapshot
+                self._previous_snapshot = snapshot
+            self._write_memory_report(
+                f"{base_path}.mem.txt", snapshot, previous_snapshot
+            )
+
+        self.last_report = base_path
+
+    def _write_memory_report(
+        self,
+        path: str,
+        snapshot: tracemalloc.Snapshot,
+        previous_snapshot: tracemalloc.Snapshot | None,
+    ) -> None:
+        """
+        Write the allocation report of a finished session.
+        :param path:  The path of the report.
+        :param snapshot:  The tracemalloc snapshot taken at the end of the ask.
+        :param previous_snapshot:  The snapshot of the previous profiled ask, if any.
+        """
+        lines = []
+        statistics = snapshot.statistics("lineno")
+        total = sum(stat.size for stat in statistics)
+        lines.append(f"Allocations alive at the end of the ask: {total / 1024:.1f} KiB")
+        for stat in statistics[: self.top_n]:
+            lines.append(str(stat))
+
+        if previous_snapshot is not None:
+            lines.append("")
+            lines.append("Difference from the previous profiled ask:")
+            for diff in snapshot.compare_to(previous_snapshot, "lineno")[: self.top_n]:
+                lines.append(str(diff))
+
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
@@ -0,0 +1,201 @@
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Iterator
+
+fcntl: Any
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+
+class RateLimitReservation:
+    """
+    The capacity taken from a RateLimiter for one API call, pre-charged with an estimate of its tokens.
+
+    :param limiter:  The rate limiter.
+    :param tokens:  The tokens charged.
+    :param wait_time:  The time the call waited for capacity, in seconds.
+    """
+
+    __slots__ = ("limiter", "tokens", "wait_time")
+
+    def __init__(self, limiter: "RateLimiter", tokens: int, wait_time: float):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.wait_time = wait_time
+
+    def settle(self, tokens: int) -> None:
+        """
+        Correct the tokens charged with the actual usage of the call, giving back the difference (or charging it, if
+        the call used more than estimated).
+        :param tokens:  The tokens the call actually used.
+        """
+        if tokens != self.tokens:
+            self.limiter._refund(self.tokens - tokens)
+            self.tokens = tokens
+
+
+class RateLimiter:
+    """
+    A client-side limit on requests per minute and tokens per minute, as token buckets refilled continuously. Share
+    one instance between every agent of a process (and its helper calls) so that together they stay under the
+    organization's limits instead of all hitting 429s and retrying at once.
+
+    Calls are pre-charged with an estimate of their tokens (the prompt plus max_tokens) and corrected with their
+    actual usage once it is known. A call without enough capacity waits; waiting calls are served in priority order
+    (lowest first, so interactive asks go ahead of batch jobs), then in arrival order.
+
+    With state_file, the buckets are kept in a file locked on every update, so the worker processes of a host share
+    them. Priorities then only order the calls within each process.
+
+    :param requests_per_minute:  The maximum number of requests per minute.  None for no limit.
+    :param tokens_per_minute:  The maximum number of tokens per minute.  None for no limit.
+    :param state_file:  The path of the file to share the buckets between processes through.  None to keep them in
+                        memory.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        state_file: str | os.PathLike | None = None,
+    ):
+        if state_file is not None and fcntl is None:
+            raise RuntimeError(
+                "A shared state_file needs fcntl, which is not available"
+            )
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.state_file = state_file
+        self.waits = 0
+        self.wait_time = 0.0
+        self._levels = self._full()
+        self._cond = threading.Condition()
+        self._waiters: list[tuple[int, int]] = []
+        self._ids = itertools.count()
+
+    def acquire(
+        self, tokens: int = 0, priority: int = PRIORITY_INTERACTIVE
+    ) -> RateLimitReservation:
+        """
+        Wait until there is capacity for a request of the given number of tokens, and take it. A request of more
+        tokens than tokens_per_minute only waits for a full bucket.
+        :param tokens:  The estimated tokens of the request.
+        :param priority:  The priority of the request, lowest first, e.g. PRIORITY_INTERACTIVE or PRIORITY_BATCH.
+        :return:  The reservation, to settle with the actual usage of the request.
+        """
+        ticket = (priority, next(self._ids))
+        start = time.perf_counter()
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            self._cond.notify_all()
+            try:
+                while True:
+                    delay = None
+                    if self._waiters[0] == ticket:
+                        delay = self._take(tokens)
+                        if not delay:
+                            break
+                    self._cond.wait(delay)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+        wait_time = time.perf_counter() - start
+        if wait_time > 0.001:
+            with self._cond:
+                self.waits += 1
+                self.wait_time += wait_time
+        return RateLimitReservation(self, tokens, wait_time)
+
+    def get_stats(self) -> dict[str, Any]:
+        """
+        Get the number of requests that had to wait and the total time they waited.
+        :return:  The stats.
+        """
+        with self._cond:
+            return {"waits": self.waits, "wait_time": self.wait_time}
+
+    def _full(self) -> dict[str, float]:
+        return {
+            "requests": self.requests_per_minute or 0.0,
+            "tokens": self.tokens_per_minute or 0.0,
+            "updated": time.time(),
+        }
+
+    def _take(self, tokens: int) -> float:
+        """Takes a request and tokens from the buckets if they hold enough, or returns how long to wait for them."""
+        with self._state() as levels:
+            delay = 0.0
+            if self.requests_per_minute and levels["requests"] < 1:
+                delay = (1 - levels["requests"]) * 60 / self.requests_per_minute
+            if self.tokens_per_minute:
+                needed = min(tokens, self.tokens_per_minute)
+                if levels["tokens"] < needed:
+                    delay = max(
+                        delay,
+                        (needed - levels["tokens"]) * 60 / self.tokens_per_minute,
+                    )
+            if delay:
+                return delay
+            if self.requests_per_minute:
+                levels["requests"] -= 1
+            if self.tokens_per_minute:
+                levels["tokens"] -= tokens
+            return 0.0
+
+    def _refund(self, tokens: int) -> None:
+        if not self.tokens_per_minute:
+            return
+        with self._cond:
+            with self._state() as levels:
+                levels["tokens"] = min(
+                    levels["tokens"] + tokens, self.tokens_per_minute
+                )
+            self._cond.notify_all()
+
+    def _refill(self, levels: dict[str, float]) -> None:
+        now = time.time()
+        elapsed = max(now - levels["updated"], 0.0)
+        levels["updated"] = now
+        for key, per_minute in (
+            ("requests", self.requests_per_minute),
+            ("tokens", self.tokens_per_minute),
+        ):
+            if per_minute:
+                levels[key] = min(levels[key] + elapsed * per_minute / 60, per_minute)
+
+    @contextlib.contextmanager
+    def _state(self) -> Iterator[dict[str, float]]:
+        """Yields the bucket levels, refilled up to now, and saves them afterwards."""
+        if self.state_file is None:
+            self._refill(self._levels)
+            yield self._levels
+            return
+
+        with open(self.state_file, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    levels = json.loads(f.read())
+                except json.JSONDecodeError:
+                    levels = self._full()
+                self._refill(levels)
+                yield levels
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(levels))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+@dataclass
+class CachedResponse:
+    """
+    A response stored in the ResponseCache.
+
+    :param content:  The content of the response.
+    :param chunks:  The chunks the response was streamed in, to replay it as a stream.  None if it was not streamed.
+    :param expires_at:  The time.monotonic() time the entry expires at.
+    :param scope:  The scope of the entry for semantic lookups (system message, model and tool set).
+    :param embedding:  The normalized query embedding of the entry, for semantic lookups.
+    """
+
+    content: str
+    chunks: list[str] | None = None
+    expires_at: float = 0.0
+    scope: str = ""
+    embedding: Any = field(default=None, repr=False)
+
+    def get_chunks(self) -> list[str]:
+        """
+        Get the chunks to replay the response as a stream.
+        :return:  The recorded chunks, or the content as a single chunk.
+        """
+        return self.chunks if self.chunks is not None else [self.content]
+
+
+class ResponseCache:
+    """
+    A thread safe cache of final responses, consulted before the model loop. Share one instance between agents.
+
+    Entries are found by an exact key made from the system message, the model, the offered tool set, the tail of the
+    chat history and the query. If a semantic threshold is set, a miss on the exact key falls back to the entry in
+    the same scope whose query embedding (the one computed for function routing) is the most similar, if it is at
+    least as similar as the threshold.
+
+    :param max_entries:  The maximum number of entries to keep, evicting the least recently used.
+    :param ttl:  The default time to live of an entry, in seconds.
+    :param history_tail:  The number of most recent chat history messages that are part of the key.
+    :param semantic_threshold:  The minimum cosine similarity for a semantic hit.  None to disable the semantic tier.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 300.0,
+        history_tail: int = 2,
+        semantic_threshold: float | None = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_tail = history_tail
+        self.semantic_threshold = semantic_threshold
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_scope(system_message: str, model: str, functions: list | None) -> str:
+        """
+        Make the scope of an ask: the parts of the key that semantic lookups must match exactly.
+        :param system_message:  The content of the system message.
+        :param model:  The name of the model.
+        :param functions:  The function definitions offered to the model, if any.
+        :return:  The scope, as a hex digest.
+        """
+        data = json.dumps([system_message, model, functions or []], sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def make_key(self, scope: str, history: list[dict[str, Any]], query: str) -> str:
+        """
+        Make the exact key of an ask.
+        :param scope:  The scope of the ask, from make_scope().
+        :param history:  The chat history before the query.
+        :param query:  The query.
+        :return:  The key, as a hex digest.
+        """
+        tail = history[-self.history_tail :] if self.history_tail > 0 else []
+        data = json.dumps(
+            [scope, [(m.get("role"), m.get("content")) for m in tail], query]
+        )
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def get(
+        self, key: str, scope: str = "", embedding: list[float] | None = None
+    ) -> tuple[CachedResponse | None, str | None]:
+        """
+        Look up a response, by exact key and then semantically if an embedding is given.
+        :param key:  The exact key, from make_key().
+        :param scope:  The scope of the ask, from make_scope().
+        :param embedding:  The query embedding of the ask.
+        :return:  The cached response and 'exact' or 'semantic', or (None, None) on a miss.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    return entry, "exact"
+                del self._entries[key]
+
+            if self.semantic_threshold is None or embedding is None:
+                return None, None
+
+            import numpy as np
+
+            query = self._normalize(embedding)
+            best_key, best_similarity = None, self.semantic_threshold
+            for entry_key, entry in list(self._entries.items()):
+                if entry.expires_at <= now:
+                    del self._entries[entry_key]
+                    continue
+                if entry.scope != scope or entry.embedding is None:
+                    continue
+                similarity = float(np.dot(query, entry.embedding))
+                if similarity >= best_similarity:
+                    best_key, best_similarity = entry_key, similarity
+
+            if best_key is None:
+                return None, None
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key], "semantic"
+
+    def set(
+        self,
+        key: str,
+        content: str,
+        chunks: list[str] | None = None,
+        ttl: float | None = None,
+        scope: str = "",
+        embedding: list[float] | None = None,
+    ) -> None:
+        """
+        Cache a response.
+        :param key:  The exact key, from make_key().
+        :param content:  The content of the response.
+        :param chunks:  The chunks the response was streamed in, if it was streamed.
+        :param ttl:  The time to live of the entry, in seconds.  Defaults to the cache's ttl.
+        :param scope:  The scope of the ask, from make_scope().
+        :param embedding:  The query embedding of the ask, for semantic lookups.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+
+        entry = CachedResponse(
+            content=content,
+            chunks=chunks,
+            expires_at=time.monotonic() + ttl,
+            scope=scope,
+            embedding=(
+                self._normalize(embedding)
+                if embedding is not None and self.semantic_threshold is not None
+                else None
+            ),
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> "np.ndarray":
+        import numpy as np
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,223 @@
+import email.utils
+import logging
+import random
+import time
+from typing import Any, Callable
+
+import httpx
+import openai
+
+from nimbusagent.utils.cancellation import AskCancelled, CancellationToken
+
+RETRY_RATE_LIMIT = "rate_limit"
+RETRY_SERVER_ERROR = "server_error"
+RETRY_TIMEOUT = "timeout"
+RETRY_CONNECTION = "connection"
+
+RETRYABLE_STATUS_CODES = {408: RETRY_TIMEOUT, 409: RETRY_SERVER_ERROR}
+
+
+def classify_error(error: BaseException) -> str | None:
+    """
+    Classify an error raised by an API call, to decide whether it is worth retrying.
+    :param error:  The error.
+    :return:  The reason to retry ('rate_limit', 'server_error', 'timeout' or 'connection'), or None if the error
+              is not transient, e.g. a bad request, an authentication error, an exhausted quota or a programming error.
+    """
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code == 429:
+            # an exhausted quota is reported as a 429 too, but waiting does not help
+            if getattr(error, "code", None) == "insufficient_quota":
+                return None
+            return RETRY_RATE_LIMIT
+        if error.status_code >= 500:
+            return RETRY_SERVER_ERROR
+        return RETRYABLE_STATUS_CODES.get(error.status_code)
+    if isinstance(error, (openai.APITimeoutError, httpx.TimeoutException)):
+        return RETRY_TIMEOUT
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return RETRY_CONNECTION
+    return None
+
+
+def get_retry_after(error: BaseException) -> float | None:
+    """
+    Get the delay the API asked for in the Retry-After (or retry-after-ms) header of an error response.
+    :param error:  The error.
+    :return:  The delay in seconds, or None if the response did not ask for one.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(float(retry_after_ms) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class RetryPolicy:
+    """
+    How to retry API calls that fail with a transient error (rate limits, server errors, timeouts and connection
+    errors): up to max_retries times per call, waiting an exponential backoff with full jitter, or the delay the API
+    asked for with Retry-After. The total time an ask may spend waiting between retries is capped by budget.
+    Share one instance between agents.
+
+    :param max_retries:  The maximum number of retries of a single call.
+    :param base_delay:  The backoff of the first retry, in seconds, before jitter.  It doubles with every retry.
+    :param max_delay:  The maximum backoff, in seconds, before jitter.
+    :param max_retry_after:  The longest Retry-After to honor, in seconds.  Calls asked to wait longer are not
+                             retried.
+    :param budget:  The total time an ask may spend waiting between retries, in seconds.
+    :param sleep:  The function to wait with.  Defaults to waiting on the cancellation token of the ask, so that
+                   cancelling the ask interrupts the wait.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 2,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        max_retry_after: float = 30.0,
+        budget: float = 30.0,
+        sleep: Callable[[float], Any] | None = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+        self.sleep = sleep
+
+    def get_delay(self, retry: int, error: BaseException) -> float | None:
+        """
+        Get the time to wait before a retry.
+        :param retry:  The number of the retry, starting at 0.
+        :param error:  The error of the failed attempt.
+        :return:  The delay in seconds, or None if the Retry-After of the error is longer than max_retry_after.
+        """
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))
+
+    def new_budget(
+        self,
+        on_retry: Callable | None = None,
+        cancellation: CancellationToken | None = None,
+    ) -> "RetryBudget":
+        """
+        Start the retry budget of an ask.
+        :param on_retry:  Called with the operation, the reason and the delay before every retry.
+        :param cancellation:  The cancellation token of the ask, which stops the waits between retries.
+        :return:  The budget.
+        """
+        return RetryBudget(self, on_retry, cancellation)
+
+
+class RetryBudget:
+    """
+    The retries of a single ask under a RetryPolicy, sharing its total waiting time between every call of the ask.
+
+    :param policy:  The retry policy.
+    :param on_retry:  Called with the operation, the reason and the delay before every retry.
+    :param cancellation:  The cancellation token of the ask, which stops the waits between retries.
+    """
+
+    def __init__(
+        self,
+        policy: RetryPolicy,
+        on_retry: Callable | None = None,
+        cancellation: CancellationToken | None = None,
+    ):
+        self.policy = policy
+        self.on_retry = on_retry
+        self.cancellation = cancellation
+        self.remaining = policy.budget
+        self.retries = 0
+
+    def should_retry(
+        self,
+        operation: str,
+        retry: int,
+        error: BaseException,
+        max_retries: int | None = None,
+    ) -> bool:
+        """
+        Decide whether to retry a failed call, and wait before the retry if so.
+        :param operation:  The name of the call, e.g. 'chat', for logs, stats and metrics.
+        :param retry:  The number of retries of the call so far.
+        :param error:  The error of the failed attempt.
+        :param max_retries:  Overrides the policy's maximum number of retries.
+        :return:  True if the call should be retried.
+        :raises AskCancelled:  If the ask is cancelled while waiting.
+        """
+        reason = classify_error(error)
+        if reason is None:
+            return False
+        if retry >= (self.policy.max_retries if max_retries is None else max_retries):
+            return False
+
+        delay = self.policy.get_delay(retry, error)
+        if delay is None or delay > self.remaining:
+            logging.warning(
+                "Not retrying %s after %s: the retry budget is exhausted",
+                operation,
+                reason,
+            )
+            return False
+
+        logging.info(
+            "Retrying %s in %.2fs after %s: %s", operation, delay, reason, error
+        )
+        self.remaining -= delay
+        self.retries += 1
+        if self.on_retry is not None:
+            self.on_retry(operation, reason, delay)
+        self._wait(delay)
+        return True
+
+    def _wait(self, delay: float) -> None:
+        """
+        Wait before a retry, stopping early if the ask is cancelled.
+        """
+        if self.policy.sleep is not None:
+            self.policy.sleep(delay)
+        elif self.cancellation is not None:
+            self.cancellation.wait(delay)
+        else:
+            time.sleep(delay)
+        if self.cancellation is not None:
+            self.cancellation.raise_if_cancelled()
+
+    def call(self, operation: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        Call a function, retrying it on transient errors.
+        :param operation:  The name of the call, e.g. 'chat', for logs, stats and metrics.
+        :param func:  The function to call.
+        :return:  The result of the function.
+        """
+        retry = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not self.should_retry(operation, retry, e):
+                    raise
+                retry += 1
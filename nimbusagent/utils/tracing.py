@@ -0,0 +1,201 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any
+
+
+class Span:
+    """
+    A timed stage of an ask. Spans can be used as context managers, or ended explicitly with `end()`.
+    This base class records nothing and is returned when a trace is not being recorded.
+    """
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """
+        Set an attribute on the span.
+        :param key:  The name of the attribute.
+        :param value:  The value of the attribute. Should be JSON serializable.
+        """
+
+    def end(self) -> None:
+        """
+        End the span.
+        """
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            self.set_attribute("error", exc_type.__name__)
+        self.end()
+
+
+class Trace:
+    """
+    The spans of a single ask. This base class records nothing and is returned when no tracer is configured or
+    when the ask was not sampled.
+    """
+
+    def span(self, name: str, attributes: dict[str, Any] | None = None) -> Span:
+        """
+        Start a span.
+        :param name:  The name of the span.
+        :param attributes:  The attributes of the span.
+        :return:  The span. End it with `end()` or use it as a context manager.
+        """
+        return NOOP_SPAN
+
+
+class Tracer:
+    """
+    Interface for tracing asks. This base class records nothing and is used when no tracer is configured.
+    To plug in an external tracer (e.g. OpenTelemetry), subclass Tracer, Trace and Span, and return your Trace
+    from `start_trace`.
+    """
+
+    def start_trace(self, name: str, attributes: dict[str, Any] | None = None) -> Trace:
+        """
+        Start tracing an ask.
+        :param name:  The name of the root span.
+        :param attributes:  The attributes of the root span.
+        :return:  The trace to record the spans of the ask in.
+        """
+        return NOOP_TRACE
+
+    def finish_trace(self, trace: Trace) -> None:
+        """
+        Finish tracing an ask.
+        :param trace:  The trace returned by `start_trace`.
+        """
+
+
+NOOP_SPAN = Span()
+NOOP_TRACE = Trace()
+NOOP_TRACER = Tracer()
+
+
+class _RecordedSpan(Span):
+    __slots__ = ("trace", "name", "attributes", "start", "tid", "ended")
+
+    def __init__(self, trace: "RecordedTrace", name: str, attributes: dict | None):
+        self.trace = trace
+        self.name = name
+        self.attributes = dict(attributes) if attributes else {}
+        self.tid = threading.get_ident()
+        self.ended = False
+        self.start = time.perf_counter_ns()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self) -> None:
+        if self.ended:
+            return
+        self.ended = True
+        end = time.perf_counter_ns()
+        event = {
+            "name": self.name,
+            "ph": "X",
+            "ts": self.start / 1000,
+            "dur": (end - self.start) / 1000,
+            "pid": self.trace.pid,
+            "tid": self.tid,
+        }
+        if self.attributes:
+            event["args"] = self.attributes
+        self.trace.events.append(event)
+
+
+class RecordedTrace(Trace):
+    """
+    A trace that keeps its spans in memory as Chrome `trace_event` complete events.
+
+    :param name:  The name of the root span.
+    :param attributes:  The attributes of the root span.
+    """
+
+    def __init__(self, name: str, attributes: dict[str, Any] | None = None):
+        self.pid = os.getpid()
+        self.events: list[dict[str, Any]] = []
+        self.root = _RecordedSpan(self, name, attributes)
+
+    def span(self, name: str, attributes: dict[str, Any] | None = None) -> Span:
+        return _RecordedSpan(self, name, attributes)
+
+    def to_chrome_trace(self) -> dict[str, Any]:
+        """
+        Get the trace in the Chrome/Perfetto `trace_event` JSON format.
+        :return:  The trace as a JSON serializable dictionary.
+        """
+        return {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+
+
+class TraceCollector(Tracer):
+    """
+    Tracer that records sampled asks in memory, and optionally writes each of them to a Chrome/Perfetto
+    `trace_event` JSON file that can be opened in chrome://tracing or https://ui.perfetto.dev.
+    A collector can be shared between agents.
+
+    :param output_dir:  The directory to write a trace file per sampled ask to.  If None, no files are written.
+    :param sample_rate:  The fraction of asks to record, between 0 and 1.  Defaults to every ask.
+    :param max_traces:  The number of recent traces to keep in memory.
+    """
+
+    def __init__(
+        self,
+        output_dir: str | None = None,
+        sample_rate: float = 1.0,
+        max_traces: int = 100,
+    ):
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.traces: deque[RecordedTrace] = deque(maxlen=max_traces)
+        self._count = 0
+        self._lock = threading.Lock()
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def start_trace(self, name: str, attributes: dict[str, Any] | None = None) -> Trace:
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return NOOP_TRACE
+        return RecordedTrace(name, attributes)
+
+    def finish_trace(self, trace: Trace) -> None:
+        if not isinstance(trace, RecordedTrace):
+            return
+
+        trace.root.end()
+        with self._lock:
+            self._count += 1
+            count = self._count
+            self.traces.append(trace)
+
+        if self.output_dir:
+            file_name = f"trace-{int(time.time() * 1000)}-{count}.json"
+            with open(os.path.join(self.output_dir, file_name), "w") as f:
+                json.dump(trace.to_chrome_trace(), f)
+
+    def get_traces(self) -> list[RecordedTrace]:
+        """
+        Get the recent traces kept in memory, oldest first.
+        :return:  The traces.
+        """
+        with self._lock:
+            return list(self.traces)
+
+    def dump(self, path: str) -> None:
+        """
+        Write all traces kept in memory to a single Chrome/Perfetto `trace_event` JSON file.
+        :param path:  The path of the file to write.
+        """
+        events = []
+        for trace in self.get_traces():
+            events.extend(trace.events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
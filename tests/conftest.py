@@ -0,0 +1,77 @@
+import contextlib
+from unittest.mock import patch
+
+import pytest
+
+from nimbusagent.testing.fake_openai import FakeOpenAIServer
+
+
+class FakeEncoding:
+    """Counts whitespace-separated words as tokens, so tests need no tiktoken BPE file."""
+
+    @staticmethod
+    def encode(content):
+        return content.split()
+
+
+@pytest.fixture
+def fake_encoding():
+    """Patches tiktoken.get_encoding to return a FakeEncoding for the whole test."""
+    with patch("tiktoken.get_encoding", return_value=FakeEncoding()) as get_encoding:
+        yield get_encoding
+
+
+@pytest.fixture
+def fake_openai(fake_encoding):
+    """
+    Starts FakeOpenAIServers, stopped at the end of the test: fake_openai(responder, **server_options) returns a
+    running server.
+    """
+    with contextlib.ExitStack() as stack:
+
+        def start(responder=None, **options) -> FakeOpenAIServer:
+            return stack.enter_context(FakeOpenAIServer(responder=responder, **options))
+
+        yield start
+
+
+@pytest.fixture
+def agent_options():
+    """
+    Builds the options of an agent talking to a fake server: agent_options(server, **options), without moderation
+    unless options enable it.
+    """
+
+    def build(server: FakeOpenAIServer, **options) -> dict:
+        return {
+            "openai_base_url": server.base_url,
+            "openai_api_key": "fake",
+            "perform_moderation": False,
+            **options,
+        }
+
+    return build
+
+
+@pytest.fixture
+def make_agent(agent_options):
+    """Creates an agent talking to a fake server: make_agent(agent_class, server, **options)."""
+
+    def make(agent_class, server: FakeOpenAIServer, **options):
+        return agent_class(**agent_options(server, **options))
+
+    return make
+
+
+@pytest.fixture
+def get_weather():
+    """A weather tool for the agents under test."""
+
+    def get_weather(location: str) -> dict:
+        """
+        Get the current weather
+        :param location: The city
+        """
+        return {"content": f"It is sunny in {location}."}
+
+    return get_weather
@@ -2,33 +2,40 @@ import os
 import unittest
 from unittest.mock import patch, MagicMock
 
+import pytest
+
 from nimbusagent.agent.base import BaseAgent
 
 os.environ["OPENAI_API_KEY"] = "some key"
 
 
+class Agent(BaseAgent):
+    def ask(self, query, *args, **kwargs):
+        return None
+
+
 class TestBaseAgent:
 
     @patch("openai.OpenAI")
     def test_initialization(self, mock_openai):
-        agent = BaseAgent(openai_api_key="test_key")
+        agent = Agent(openai_api_key="test_key")
         assert agent.model_name == "gpt-4-turbo"
         assert agent.client is not None
 
     def test_set_system_message(self):
-        agent = BaseAgent()
+        agent = Agent()
         agent.set_system_message("Test Message")
         expected_message = {"role": "system", "content": "Test Message"}
         assert agent.system_message == expected_message
 
     @patch("nimbusagent.utils.helper.is_query_safe", return_value=False)
     def test_history_needs_moderation(self, mock_is_query_safe):
-        agent = BaseAgent()
+        agent = Agent()
         history = [{"role": "user", "content": "inappropriate content"}]
         assert agent._history_needs_moderation(history) == True
 
     def test_create_chat_completion(self):
-        agent = BaseAgent(openai_api_key="test_key")
+        agent = Agent(openai_api_key="test_key")
 
         # Mock the create method on the instance
         mock_chat_create = MagicMock()
@@ -53,3 +60,7 @@ class TestBaseAgent:
 
         # Validate that the response is a MagicMock (mocked response)
         assert isinstance(response, MagicMock)
+
+    def test_ask_is_abstract(self):
+        with pytest.raises(TypeError):
+            BaseAgent()  # type: ignore[abstract]
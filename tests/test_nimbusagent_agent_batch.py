@@ -0,0 +1,115 @@
+import io
+import json
+from concurrent.futures import Future
+
+import pytest
+
+from nimbusagent.agent.batch import BatchResult, _emit, ask_many, read_finished_ids
+from nimbusagent.testing.fake_openai import FakeResponse
+
+
+def echo(body):
+    query = body["messages"][-1]["content"]
+    if "fail" in query:
+        return FakeResponse(status=400)
+    return FakeResponse(f"Answer to {query}")
+
+
+class TestAskMany:
+    @pytest.fixture(autouse=True)
+    def server(self, fake_openai, agent_options):
+        self.server = fake_openai(echo)
+        self.options = agent_options(self.server)
+
+    def test_results_stream_to_jsonl(self, tmp_path):
+        queries = tmp_path / "queries.jsonl"
+        queries.write_text(
+            "\n".join(
+                json.dumps({"id": f"city-{i}", "query": f"q{i}", "metadata": {"i": i}})
+                for i in range(20)
+            )
+        )
+        output = tmp_path / "results.jsonl"
+
+        results = list(
+            ask_many(queries, output, agent_options=self.options, max_workers=4)
+        )
+
+        assert sorted(result.id for result in results) == sorted(
+            f"city-{i}" for i in range(20)
+        )
+        by_id = {result.id: result for result in results}
+        assert by_id["city-3"].response == "Answer to q3"
+        assert by_id["city-3"].metadata == {"i": 3}
+        assert by_id["city-3"].stats["loop_count"] == 1
+        lines = [json.loads(line) for line in output.read_text().splitlines()]
+        assert [line["id"] for line in lines] == [result.id for result in results]
+
+    def test_resume_skips_finished_items(self, tmp_path):
+        output = tmp_path / "results.jsonl"
+        queries = ["q0", "fail", "q2", "q3"]
+        first = list(ask_many(queries[:2], output, agent_options=self.options))
+        assert [
+            result.error is None for result in sorted(first, key=lambda r: r.id)
+        ] == [
+            True,
+            False,
+        ]
+        assert read_finished_ids(output) == {"0"}
+
+        requests = self.server.request_counts["/chat/completions"]
+        second = list(ask_many(queries, output, agent_options=self.options))
+        assert sorted(result.id for result in second) == ["1", "2", "3"]
+        assert self.server.request_counts["/chat/completions"] - requests == 3
+        assert read_finished_ids(output) == {"0", "2", "3"}
+
+    def test_resume_after_a_partial_line(self, tmp_path):
+        output = tmp_path / "results.jsonl"
+        output.write_text(
+            json.dumps({"id": "0", "response": "Answer to q0", "error": None})
+            + '\n{"id": "1", "resp'
+        )
+
+        results = list(ask_many(["q0", "q1", "q2"], output, agent_options=self.options))
+        assert sorted(result.id for result in results) == ["1", "2"]
+        assert read_finished_ids(output) == {"0", "1", "2"}
+
+    def test_finished_items_are_written_before_yielding(self):
+        done = set()
+        for i in range(3):
+            future: Future = Future()
+            future.set_result(BatchResult(str(i), response="ok"))
+            done.add(future)
+        sink = io.StringIO()
+
+        results = _emit(done, sink)
+        next(results)
+        results.close()
+        assert len(sink.getvalue().splitlines()) == 3
+
+    def test_items_are_isolated(self):
+        sizes = {}
+
+        def record(body):
+            sizes[body["messages"][-1]["content"]] = len(body["messages"])
+            return echo(body)
+
+        self.server.responder = record
+        history = [
+            {"role": "user", "content": "Hi"},
+            {"role": "assistant", "content": "Hello!"},
+        ]
+        results = list(
+            ask_many(
+                [{"query": "q1", "history": history}, "q2", "q3"],
+                agent_options=self.options,
+                max_workers=1,
+            )
+        )
+        assert {result.response for result in results} == {
+            "Answer to q1",
+            "Answer to q2",
+            "Answer to q3",
+        }
+        # system message, history and query; then system message and query only
+        assert sizes == {"q1": 4, "q2": 2, "q3": 2}
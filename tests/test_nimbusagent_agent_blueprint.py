@@ -0,0 +1,78 @@
+import re
+
+import pytest
+
+from nimbusagent.agent.blueprint import AgentBlueprint
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.testing.fake_openai import ScriptedResponder, fake_embedding
+
+
+class TestAgentBlueprint:
+    @pytest.fixture(autouse=True)
+    def upstream(self, fake_openai, agent_options, get_weather):
+        self.upstream = fake_openai(ScriptedResponder(["It is sunny today."]))
+        self.options = agent_options(
+            self.upstream,
+            functions=[get_weather],
+            functions_pattern_groups=[
+                {"pattern": r"(?i)weather", "functions": ["get_weather"]}
+            ],
+            system_message="You are a weather assistant.",
+        )
+
+    def test_compiles_options(self):
+        blueprint = AgentBlueprint(CompletionAgent, self.options)
+        handler = blueprint._template.function_handler
+        assert set(handler.function_definitions) == {"get_weather"}
+        assert isinstance(handler.pattern_groups[0]["pattern"], re.Pattern)
+        assert blueprint.system_message_tokens == 5
+        with pytest.raises(AttributeError):
+            blueprint.agent_class = StreamingAgent
+        with pytest.raises(ValueError):
+            AgentBlueprint(CompletionAgent, {"message_history": []})
+
+    def test_new_agents_have_their_own_state(self):
+        blueprint = AgentBlueprint(CompletionAgent, self.options)
+        first = blueprint.new_agent(history=[{"role": "user", "content": "Hello"}])
+        second = blueprint.new_agent()
+
+        assert first.ask("What's the weather?") == "It is sunny today."
+        assert len(first.get_chat_history()) == 3
+        assert second.get_chat_history() == []
+        assert second.get_stats().asks == 0
+        assert first.client is second.client is blueprint.client
+        assert (
+            first.function_handler.function_definitions
+            is second.function_handler.function_definitions
+        )
+        assert first.function_handler.chat_history is first.chat_history
+
+    def test_streaming_agent(self):
+        blueprint = AgentBlueprint(StreamingAgent, self.options)
+        agent = blueprint.new_agent()
+        assert "".join(agent.ask("Hi")) == "It is sunny today."
+        assert agent._active_stream is None
+
+    def test_agent_warmup(self):
+        agent = CompletionAgent(
+            **self.options,
+            functions_embeddings=[
+                {"name": "get_weather", "embedding": fake_embedding("weather")}
+            ],
+        )
+        handler = agent.function_handler
+        assert handler.function_definitions == {}
+
+        timings = agent.warmup()
+        assert {"numpy", "tiktoken", "cl100k_base", "functions"} <= set(timings)
+        assert set(handler.function_definitions) == {"get_weather"}
+        assert len(handler.embedding_index) == 1
+        assert self.upstream.request_counts == {}
+
+    def test_blueprint_warmup_opens_connection(self):
+        blueprint = AgentBlueprint(CompletionAgent, self.options)
+        timings = blueprint.warmup(keep_alive=True)
+        assert "keep_alive" in timings
+        assert self.upstream.request_counts == {"/models/gpt-4-turbo": 1}
+        assert blueprint.new_agent().ask("Hi") == "It is sunny today."
@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+from nimbusagent.agent.events import (
+    ContentChunk,
+    DataEvent,
+    FunctionEvent,
+    StreamEvent,
+    bounded_json,
+    encode_ndjson,
+    encode_sse,
+)
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.testing.fake_openai import (
+    FakeResponse,
+    FakeToolCall,
+    ScriptedResponder,
+)
+
+
+def get_weather(location: str) -> dict:
+    """
+    Get the current weather
+    :param location: The city
+    """
+    return {"content": "Sunny, 21C", "stream_data": {"weather": {"temp": 21}}}
+
+
+class TestEvents:
+    def test_markers(self):
+        assert ContentChunk("Hi").to_marker() == "Hi"
+        assert FunctionEvent("f", '{"a": 1}').to_marker() == '[[[function:f:{"a": 1}]]]'
+        assert FunctionEvent("f").to_marker() == "[[[function:f]]]"
+        assert (
+            DataEvent.create("d", {"a": 1}, 100).to_marker() == '[[[data:d:{"a": 1}]]]'
+        )
+        assert DataEvent.create("d", "text", 1).to_marker() == "[[[data:d:text]]]"
+        assert DataEvent.create("d", None, 100).to_marker() == "[[[data:d]]]"
+
+    def test_data_too_large(self):
+        event = DataEvent.create("d", {"values": list(range(1000))}, 50)
+        assert json.loads(event.data) == {"error": "data too large"}
+
+    def test_bounded_json(self):
+        assert bounded_json({"a": [1, 2]}, 100) == '{"a": [1, 2]}'
+        assert bounded_json({"a": [1, 2]}, 5) is None
+        assert bounded_json({"a": [1, 2]}, 0) is None
+        assert bounded_json({"a": [1, 2]}, None) == '{"a": [1, 2]}'
+
+    def test_encoders(self):
+        events = [
+            ContentChunk('He said "hi"\n'),
+            FunctionEvent("f", '{"a": 1}'),
+            DataEvent.create("d", {"a": 1}, 100),
+            DataEvent.create("s", "text", 100),
+        ]
+        lines = "".join(encode_ndjson(event) for event in events).splitlines()
+        assert [json.loads(line) for line in lines] == [
+            {"type": "content", "content": 'He said "hi"\n'},
+            {"type": "function", "name": "f", "arguments": '{"a": 1}'},
+            {"type": "data", "name": "d", "data": {"a": 1}},
+            {"type": "data", "name": "s", "data": "text"},
+        ]
+
+        sse = encode_sse(events[0])
+        assert sse.startswith("event: content\ndata: {")
+        assert sse.endswith("\n\n")
+        assert sse.count("\n") == 3
+
+    def test_stream_event_is_abstract(self):
+        with pytest.raises(TypeError):
+            StreamEvent()
+
+    def test_slots(self):
+        with pytest.raises(AttributeError):
+            ContentChunk("Hi").extra = 1
+
+
+class TestTypedEventStream:
+    @pytest.fixture(autouse=True)
+    def server(self, fake_openai, make_agent):
+        responder = ScriptedResponder(
+            [
+                FakeResponse(
+                    tool_calls=[FakeToolCall("get_weather", {"location": "Paris"})]
+                ),
+                "It is sunny in Paris.",
+            ]
+        )
+        self.server = fake_openai(responder)
+        self.new_agent = make_agent
+
+    def make_agent(self, **kwargs):
+        return self.new_agent(
+            StreamingAgent,
+            self.server,
+            functions=[get_weather],
+            send_events=True,
+            **kwargs,
+        )
+
+    def test_typed_events(self):
+        agent = self.make_agent()
+        events = list(agent.ask_events("What's the weather in Paris?"))
+
+        assert isinstance(events[0], FunctionEvent)
+        assert events[0].name == "get_weather"
+        assert json.loads(events[0].arguments) == {"location": "Paris"}
+        assert isinstance(events[1], DataEvent)
+        assert json.loads(events[1].data) == {"temp": 21}
+        assert all(isinstance(event, ContentChunk) for event in events[2:])
+        content = "".join(event.content for event in events[2:])
+        assert content == "It is sunny in Paris."
+        assert agent.get_last_response() == "It is sunny in Paris."
+
+    def test_inline_markers(self):
+        agent = self.make_agent()
+        chunks = list(agent.ask("What's the weather in Paris?"))
+        assert chunks[0].startswith("[[[function:get_weather:")
+        assert chunks[1] == '[[[data:weather:{"temp": 21}]]]'
+        assert "".join(chunks[2:]) == "It is sunny in Paris."
@@ -0,0 +1,133 @@
+import pytest
+
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.routing import (
+    ExemplarRule,
+    ModelRouter,
+    PatternRule,
+    PRIMARY,
+    QueryLengthRule,
+    RoutingContext,
+    SECONDARY,
+    ToolSetRule,
+)
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.testing.fake_openai import (
+    FakeResponse,
+    FakeToolCall,
+    ScriptedResponder,
+)
+
+
+class TestModelRouter:
+    @pytest.mark.parametrize(
+        "query, tier, reason",
+        [
+            ("Hi!", SECONDARY, "greeting"),
+            ("thanks", SECONDARY, "greeting"),
+            ("Convert 20 celsius to fahrenheit please", SECONDARY, "unit_conversion"),
+            ("What is 10 km in miles", SECONDARY, "unit_conversion"),
+            ("How many inches in a foot?", SECONDARY, "unit_conversion"),
+            (
+                "Will it drop below 30 f in Chicago tonight?",
+                PRIMARY,
+                "default",
+            ),
+            ("Is 5 mi to the storm close?", PRIMARY, "default"),
+            ("What is a front?", SECONDARY, "query_length"),
+            (
+                "Why do thunderstorms form more often in the afternoon in summer?",
+                PRIMARY,
+                "default",
+            ),
+        ],
+    )
+    def test_default_rules(self, query, tier, reason):
+        decision = ModelRouter().route(RoutingContext(query))
+        assert (decision.tier, decision.reason) == (tier, reason)
+
+    def test_selected_functions_keep_short_queries_on_primary(self):
+        context = RoutingContext("Weather in Paris?", functions=["get_weather"])
+        assert ModelRouter().route(context).tier == PRIMARY
+
+    def test_tool_sets_are_checked_first(self):
+        context = RoutingContext("thanks", functions=["get_weather", "get_radar"])
+        decision = ModelRouter().route(context)
+        assert (decision.tier, decision.reason) == (PRIMARY, "tool_set")
+
+    def test_low_confidence_is_escalated(self):
+        router = ModelRouter(rules=[QueryLengthRule(confidence=0.5)])
+        decision = router.route(RoutingContext("Hi"))
+        assert (decision.tier, decision.reason) == (PRIMARY, "low_confidence")
+
+    def test_tool_set_rule(self):
+        rule = ToolSetRule(functions=["get_radar"], max_functions=2)
+        assert rule(RoutingContext("q", functions=["get_radar"])).tier == PRIMARY
+        assert rule(RoutingContext("q", functions=["a", "b", "c"])).tier == PRIMARY
+        assert rule(RoutingContext("q", functions=["a"])) is None
+
+    def test_exemplar_rule(self):
+        rule = ExemplarRule(
+            [
+                {"embedding": [1.0, 0.0], "tier": SECONDARY},
+                {"embedding": [0.9, 0.1], "tier": SECONDARY},
+                {"embedding": [0.0, 1.0], "tier": PRIMARY},
+            ],
+            min_similarity=0.5,
+        )
+        decision = rule(RoutingContext("q", query_embedding=[1.0, 0.05]))
+        assert (decision.tier, decision.confidence) == (SECONDARY, 1.0)
+        assert rule(RoutingContext("q", query_embedding=[-1.0, 0.0])) is None
+        assert rule(RoutingContext("q")) is None
+
+
+class TestAgentRouting:
+    @staticmethod
+    def ask(agent, query):
+        response = agent.ask(query)
+        if isinstance(agent, StreamingAgent):
+            response = "".join(response)
+        return response
+
+    @pytest.mark.parametrize("agent_class", [CompletionAgent, StreamingAgent])
+    def test_greeting_goes_to_secondary_model(
+        self, agent_class, fake_openai, make_agent
+    ):
+        server = fake_openai(ScriptedResponder(["Hello!"]))
+        agent = make_agent(agent_class, server, model_router=ModelRouter())
+        assert self.ask(agent, "Hi") == "Hello!"
+        stats = agent.get_last_stats()
+        assert stats.loops[0].model == agent.secondary_model_name
+        assert (stats.model_route, stats.model_route_reason) == (
+            SECONDARY,
+            "greeting",
+        )
+
+        self.ask(agent, "Why do thunderstorms form more often in the afternoon?")
+        assert agent.get_last_stats().loops[0].model == agent.model_name
+        assert agent.get_stats().secondary_routes == 1
+
+    @pytest.mark.parametrize("agent_class", [CompletionAgent, StreamingAgent])
+    def test_tool_heavy_turn_is_escalated(
+        self, agent_class, fake_openai, make_agent, get_weather
+    ):
+        tool_call = FakeResponse(
+            tool_calls=[FakeToolCall("get_weather", {"location": "Paris"})]
+        )
+        responder = ScriptedResponder([tool_call, tool_call, "Sunny."])
+        agent = make_agent(
+            agent_class,
+            fake_openai(responder),
+            functions=[get_weather],
+            model_router=ModelRouter(rules=[PatternRule(".")]),
+        )
+        assert self.ask(agent, "Weather in Paris and Lyon?") == "Sunny."
+
+        stats = agent.get_last_stats()
+        assert [loop.model for loop in stats.loops] == [
+            agent.secondary_model_name,
+            agent.secondary_model_name,
+            agent.model_name,
+        ]
+        assert stats.model_route_escalated
+        assert agent.get_stats().route_escalations == 1
@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from nimbusagent.agent.sessions import FileSessionStore, SessionManager, SessionStore
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.testing.fake_openai import ScriptedResponder
+
+
+class TestSessionManager:
+    @pytest.fixture(autouse=True)
+    def upstream(self, fake_openai, agent_options):
+        self.options = agent_options(
+            fake_openai(ScriptedResponder(["It is sunny today."]))
+        )
+
+    def test_sessions_share_agents(self):
+        manager = SessionManager(agent_options=self.options)
+        assert manager.ask("a", "Hello") == "It is sunny today."
+        assert manager.ask("b", "Hi") == "It is sunny today."
+        assert len(manager) == 2
+        assert len(manager._idle_agents) == 1
+        assert manager.get_chat_history("a") == [
+            {"role": "user", "content": "Hello"},
+            {"role": "assistant", "content": "It is sunny today."},
+        ]
+        assert len(manager.get_session("b").last_stats.loops) == 1
+
+    def test_evict_and_rehydrate(self, tmp_path):
+        manager = SessionManager(
+            agent_options=self.options,
+            max_live_sessions=1,
+            store=FileSessionStore(str(tmp_path)),
+        )
+        manager.start_session("a", [{"role": "user", "content": "Earlier"}])
+        manager.ask("b", "Hi")
+        assert len(manager) == 1
+        assert (tmp_path / "a.json").exists()
+
+        assert manager.get_chat_history("a") == [{"role": "user", "content": "Earlier"}]
+        assert (tmp_path / "b.json").exists()
+
+        manager.end_session("a")
+        assert not (tmp_path / "a.json").exists()
+
+    def test_evict_idle(self):
+        manager = SessionManager(agent_options=self.options, idle_ttl=0)
+        manager.start_session("a")
+        assert manager.evict_idle() == 1
+        assert len(manager) == 0
+        assert manager.store.load("a") is not None
+
+    def test_session_being_evicted_is_not_lost(self):
+        saving, release = threading.Event(), threading.Event()
+
+        class SlowStore(SessionStore):
+            def save(self, session_id, state):
+                saving.set()
+                release.wait(5)
+                super().save(session_id, state)
+
+        manager = SessionManager(
+            agent_options=self.options, idle_ttl=0, store=SlowStore()
+        )
+        session = manager.start_session("a", [{"role": "user", "content": "Earlier"}])
+        evicting = threading.Thread(target=manager.evict_idle)
+        evicting.start()
+        assert saving.wait(5)
+
+        assert manager.get_session("a") is session
+        restarting = threading.Thread(target=manager.start_session, args=("a",))
+        restarting.start()
+        release.set()
+        evicting.join(5)
+        restarting.join(5)
+
+        assert manager.get_chat_history("a") == []
+        assert manager.store.load("a") is None
+
+    def test_streaming(self):
+        manager = SessionManager(agent_class=StreamingAgent, agent_options=self.options)
+        assert "".join(manager.ask("a", "Hello")) == "It is sunny today."
+        assert len(manager.get_chat_history("a")) == 2
+
+    def test_stream_does_not_hold_the_session(self):
+        manager = SessionManager(
+            agent_class=StreamingAgent, agent_options=self.options, idle_ttl=0
+        )
+        first = manager.ask("a", "Hello")
+        next(first)
+        session = manager.get_session("a")
+        assert session.lock.acquire(blocking=False)
+        session.lock.release()
+        assert manager.evict_idle() == 0
+
+        assert "".join(manager.ask("a", "Hi")) == "It is sunny today."
+        list(first)
+        assert manager.get_chat_history("a") == [
+            {"role": "user", "content": "Hi"},
+            {"role": "assistant", "content": "It is sunny today."},
+            {"role": "user", "content": "Hello"},
+            {"role": "assistant", "content": "It is sunny today."},
+        ]
+        assert session.streams == 0
+        assert manager.evict_idle() == 1
+
+    def test_closed_stream_adds_nothing(self):
+        manager = SessionManager(agent_class=StreamingAgent, agent_options=self.options)
+        stream = manager.ask("a", "Hello")
+        next(stream)
+        stream.close()
+        assert manager.get_chat_history("a") == []
+        assert manager.get_session("a").streams == 0
@@ -0,0 +1,108 @@
+import os
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.stats import AskStats, AgentStats, LoopStats
+
+os.environ["OPENAI_API_KEY"] = "some key"
+
+
+def make_usage(prompt_tokens, completion_tokens, cached_tokens=0):
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+
+
+class TestAskStats:
+    def test_loop_usage(self):
+        loop = LoopStats(model="gpt-4")
+        loop.add_usage(make_usage(10, 5, 2))
+        loop.add_usage(None)
+        assert loop.prompt_tokens == 10
+        assert loop.completion_tokens == 5
+        assert loop.cached_tokens == 2
+
+    def test_totals(self):
+        stats = AskStats()
+        stats.start_loop("gpt-4").add_usage(make_usage(10, 5, 2))
+        stats.start_loop("gpt-3.5-turbo").add_usage(make_usage(20, 1))
+        stats.add_tool_call("get_weather", 0.5)
+        stats.finish()
+
+        assert stats.loop_count == 2
+        assert stats.prompt_tokens == 30
+        assert stats.completion_tokens == 6
+        assert stats.cached_tokens == 2
+        assert stats.total_tokens == 36
+        assert stats.tool_time == 0.5
+        assert stats.to_dict()["tool_calls"] == [
+            {"name": "get_weather", "duration": 0.5}
+        ]
+
+    def test_finish_is_idempotent(self):
+        stats = AskStats()
+        stats.finish()
+        total_time = stats.total_time
+        stats.finish()
+        assert stats.total_time == total_time
+
+    def test_agent_stats_aggregation(self):
+        agent_stats = AgentStats()
+        for _ in range(2):
+            stats = AskStats()
+            stats.start_loop("gpt-4").add_usage(make_usage(10, 5))
+            stats.finish()
+            agent_stats.add(stats)
+
+        assert agent_stats.asks == 2
+        assert agent_stats.loops == 2
+        assert agent_stats.prompt_tokens == 20
+        assert agent_stats.completion_tokens == 10
+
+
+@pytest.mark.usefixtures("fake_encoding")
+class TestCompletionAgentStats:
+    def test_usage_recorded_and_passed_to_on_complete(self):
+        completed = []
+        agent = CompletionAgent(
+            perform_moderation=False,
+            on_complete=lambda response, stats: completed.append((response, stats)),
+        )
+        message = SimpleNamespace(role="assistant", content="Hello!", tool_calls=None)
+        agent.client.chat.completions.create = MagicMock(
+            return_value=SimpleNamespace(
+                choices=[SimpleNamespace(finish_reason="stop", message=message)],
+                usage=make_usage(12, 3, 4),
+            )
+        )
+
+        assert agent.ask("Hi") == "Hello!"
+
+        stats = agent.get_last_stats()
+        assert stats.loop_count == 1
+        assert stats.prompt_tokens == 12
+        assert stats.completion_tokens == 3
+        assert stats.cached_tokens == 4
+        assert stats.finished
+        assert completed == [("Hello!", stats)]
+        assert agent.get_stats().asks == 1
+        assert agent.get_stats().prompt_tokens == 12
+
+    def test_on_complete_with_single_argument(self):
+        completed = []
+        agent = CompletionAgent(perform_moderation=False, on_complete=completed.append)
+        message = SimpleNamespace(role="assistant", content="Hello!", tool_calls=None)
+        agent.client.chat.completions.create = MagicMock(
+            return_value=SimpleNamespace(
+                choices=[SimpleNamespace(finish_reason="stop", message=message)],
+                usage=None,
+            )
+        )
+
+        agent.ask("Hi")
+        assert completed == ["Hello!"]
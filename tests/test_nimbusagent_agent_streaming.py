@@ -0,0 +1,141 @@
+import time
+
+import pytest
+
+from nimbusagent.agent.streaming import (
+    ContinuationStitcher,
+    StreamingAgent,
+    coalesce_chunks,
+)
+from nimbusagent.testing.fake_openai import (
+    FakeResponse,
+    ScriptedResponder,
+)
+from nimbusagent.utils.retry import RetryPolicy
+
+
+def slow(chunks, delay):
+    for chunk in chunks:
+        time.sleep(delay)
+        yield chunk
+
+
+class TestCoalesceChunks:
+    def test_first_chunk_is_immediate(self):
+        chunks = list(coalesce_chunks(["He", "llo", " wo", "rld"], max_bytes=100))
+        assert chunks == ["He", "llo world"]
+
+    def test_max_bytes(self):
+        chunks = list(coalesce_chunks(["a", "bb", "cc", "dd", "e", ""], max_bytes=4))
+        assert chunks == ["a", "bbcc", "dde"]
+
+    def test_max_bytes_counts_utf8(self):
+        chunks = list(coalesce_chunks(["a", "é", "é", "x"], max_bytes=4))
+        assert chunks == ["a", "éé", "x"]
+
+    def test_boundary(self):
+        chunks = ["It", " is", " sunny", ".", " Tomorrow", " too", "!\n", "Bye"]
+        assert list(coalesce_chunks(chunks, on_boundary=True)) == [
+            "It",
+            " is sunny.",
+            " Tomorrow too!\n",
+            "Bye",
+        ]
+
+    def test_max_ms(self):
+        chunks = list(coalesce_chunks(slow(["a", "b", "c", "d"], 0.02), max_ms=30))
+        assert chunks[0] == "a"
+        assert "".join(chunks) == "abcd"
+        assert len(chunks) < 4
+
+
+class TestStreamingAgentCoalescing:
+    def test_coalesced_stream(self, fake_openai, make_agent):
+        server = fake_openai(
+            ScriptedResponder(["It is sunny today. Tomorrow it rains."])
+        )
+        agent = make_agent(
+            StreamingAgent,
+            server,
+            coalesce_max_bytes=1000,
+            coalesce_on_boundary=True,
+        )
+        chunks = list(agent.ask("Hi"))
+        assert len(chunks) == 3
+        assert chunks[1].rstrip().endswith("today.")
+        assert agent.get_last_response() == "It is sunny today. Tomorrow it rains."
+
+
+class TestContinuationStitcher:
+    def test_repeated_words_are_dropped(self):
+        stitcher = ContinuationStitcher("It is sunny in Par")
+        assert stitcher.feed("sunny") == ""
+        assert stitcher.feed(" in Paris today.") == "is today."
+        assert stitcher.feed(" Bye.") == " Bye."
+
+    def test_continuation_without_repetition(self):
+        stitcher = ContinuationStitcher("It is sunny in Par")
+        assert stitcher.feed("is") == ""
+        assert stitcher.flush() == "is"
+        assert ContinuationStitcher("Hello").feed(" world") == " world"
+
+
+class TestStreamingAgentContinuation:
+    @pytest.fixture(autouse=True)
+    def setup(self, fake_openai, make_agent):
+        self.fake_openai = fake_openai
+        self.new_agent = make_agent
+
+    def make_agent(self, responder, **kwargs):
+        return self.new_agent(
+            StreamingAgent,
+            self.fake_openai(responder),
+            retry_policy=RetryPolicy(sleep=lambda delay: None),
+            **kwargs,
+        )
+
+    def test_broken_stream_is_continued(self):
+        responder = ScriptedResponder(
+            [
+                FakeResponse("It is sunny in", disconnect=True),
+                "sunny in Paris today.",
+            ]
+        )
+        agent = self.make_agent(responder)
+        response = "".join(agent.ask("Weather in Paris?"))
+
+        assert response == "It is sunny in Paris today."
+        assert agent.get_last_response() == response
+        stats = agent.get_last_stats()
+        assert (stats.continuations, stats.retries) == (1, 1)
+
+    def test_broken_stream_is_closed(self):
+        responder = ScriptedResponder(
+            [
+                FakeResponse("It is sunny in", disconnect=True),
+                "sunny in Paris today.",
+            ]
+        )
+        agent = self.make_agent(responder)
+        create = agent._create_chat_completion
+        streams = []
+
+        def create_and_keep(*args, **kwargs):
+            streams.append(create(*args, **kwargs))
+            return streams[-1]
+
+        agent._create_chat_completion = create_and_keep
+        chunks = agent.ask("Weather in Paris?")
+        next(chunks)
+        while len(streams) < 2:
+            next(chunks)
+        assert streams[0].response.is_closed
+        chunks.close()
+
+    def test_continuations_are_bounded(self):
+        responder = ScriptedResponder([FakeResponse("It is", disconnect=True)])
+        agent = self.make_agent(responder, max_continuations=0)
+        response = "".join(agent.ask("Weather in Paris?"))
+
+        assert response == "It isAI temporarily unavailable."
+        assert agent.get_last_stats().continuations == 0
@@ -2,6 +2,16 @@ import os
 from unittest.mock import patch, Mock
 import pytest
 from nimbusagent.functions.handler import FunctionHandler
+from nimbusagent.functions.responses import (
+    DictFuncResponse,
+    FuncResponse,
+    FuncResult,
+)
+from nimbusagent.utils.metrics import (
+    MetricsRegistry,
+    TOOL_CALL_ERRORS_TOTAL,
+    TOOL_CALL_SECONDS,
+)
 
 os.environ["OPENAI_API_KEY"] = "test"
 
@@ -26,4 +36,41 @@ class TestFunctionHandler:
         args = self.handler.get_args("{}")
         assert args == {}
 
+    def test_tool_call_metrics(self):
+        def broken_tool(value: str):
+            """Always fails"""
+            raise RuntimeError(value)
+
+        metrics = MetricsRegistry()
+        handler = FunctionHandler(functions=[broken_tool], metrics=metrics)
+        with pytest.raises(RuntimeError):
+            handler.handle_function_call("broken_tool", '{"value": "x"}')
+
+        labels = {"function": "broken_tool"}
+        assert metrics.get_counter(TOOL_CALL_ERRORS_TOTAL, labels=labels) == 1
+        assert metrics.get_histogram_count(TOOL_CALL_SECONDS, labels=labels) == 1
+
+    def test_call_function(self):
+        def get_weather(location: str):
+            """Get the weather"""
+            return {"content": f"Sunny in {location}", "send_directly_to_user": True}
+
+        def get_alerts(location: str):
+            """Get the alerts"""
+            return FuncResponse(content="None")
+
+        handler = FunctionHandler(functions=[get_weather, get_alerts])
+        args = '{"location": "Paris"}'
+        result = handler.call_function("get_weather", args)
+        assert isinstance(result, FuncResult)
+        assert (result.name, result.arguments) == ("get_weather", args)
+        assert result.content == "Sunny in Paris" and result.send_directly_to_user
+
+        response = handler.handle_function_call("get_weather", args)
+        assert isinstance(response, DictFuncResponse)
+        assert response.content == result.content
+
+        alerts = handler.call_function("get_alerts", args)
+        assert isinstance(alerts, FuncResponse) and alerts.name == "get_alerts"
+
     # Add more tests for other methods and edge cases
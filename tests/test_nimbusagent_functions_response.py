@@ -1,4 +1,4 @@
-from nimbusagent.functions.responses import FuncResponse, DictFuncResponse
+from nimbusagent.functions.responses import FuncResponse, DictFuncResponse, FuncResult
 
 
 class TestFuncResponses:
@@ -12,3 +12,17 @@ class TestFuncResponses:
         dfr = DictFuncResponse({"content": "hello"})
         assert dfr.data == {"content": "hello"}
         assert dfr.content == "hello"
+
+    def test_func_result_matches_dict_func_response(self):
+        data = {"content": "hello", "stream_data": {"temp": 21}, "cache_ttl": 60}
+        result = FuncResult.from_dict(data, "get_weather", "{}")
+        response = DictFuncResponse(data)
+        for field in FuncResult.__slots__:
+            if field not in ("name", "arguments"):
+                assert getattr(result, field) == getattr(response, field)
+        assert not hasattr(result, "__dict__")
+
+        converted = result.to_func_response()
+        assert isinstance(converted, FuncResponse)
+        assert converted.name == "get_weather"
+        assert converted.content == "hello" and converted.cache_ttl == 60
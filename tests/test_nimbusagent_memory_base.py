@@ -1,4 +1,13 @@
-from nimbusagent.memory.base import AgentMemory
+import json
+from types import SimpleNamespace
+
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.memory.base import AgentMemory, message_to_dict
+from nimbusagent.testing.fake_openai import (
+    FakeResponse,
+    FakeToolCall,
+    ScriptedResponder,
+)
 import pytest
 
 
@@ -81,7 +90,8 @@ class TestAgentMemory:
         memory.add_entry({"role": "user", "content": "world"})
         memory.resize(max_tokens_resize=8, max_messages_resize=1)
         assert memory.get_chat_length() == 1
-        assert memory.get_total_tokens() == 0
+        assert memory.get_total_tokens() == 1
+        assert list(memory.token_counts) == [1]
 
     def test_initialization_with_initial_history(self):
         initial_history = [
@@ -134,3 +144,137 @@ class TestAgentMemory:
         self.memory.add_entry({"role": "user", "content": "hello"})
         text_history = self.memory.get_chat_history_as_text()
         assert text_history == "user: hello"
+
+    def test_state_round_trip(self, fake_encoding):
+        memory = AgentMemory(
+            max_tokens=10, max_messages=5, token_encoding="cl100k_base"
+        )
+        memory.add_entry({"role": "user", "content": "hello there"})
+        memory.add_entry({"role": "assistant", "content": "hi"})
+        restored = AgentMemory(
+            max_tokens=10, max_messages=1, token_encoding="cl100k_base"
+        )
+        restored.load_state(memory.get_state())
+        assert restored.get_chat_history() == [{"role": "assistant", "content": "hi"}]
+        assert restored.get_total_tokens() == 1
+
+    def test_compact_entries(self):
+        memory = AgentMemory(
+            max_tokens=100, max_messages=10, token_encoding="cl100k_base"
+        )
+        state = {
+            "chat_history": [
+                {"role": "user", "content": "hello there"},
+                {"role": "assistant", "content": "hi"},
+                {"role": "user", "content": "how are you"},
+            ],
+            "token_counts": [2, 1, 3],
+        }
+        memory.load_state(json.loads(json.dumps(state)))
+        assert memory.token_counts.typecode == "I"
+        assert memory.entries[0].role is memory.entries[2].role
+        assert memory.get_total_tokens() == 6
+        assert memory.get_state() == state
+
+        history = memory.get_chat_history()
+        history.append({"role": "assistant", "content": "fine"})
+        assert memory.get_chat_length() == 3
+        assert memory.get_chat_history() == state["chat_history"]
+
+    def test_chat_history_is_cached_until_it_changes(self, fake_encoding):
+        memory = AgentMemory(
+            max_tokens=100, max_messages=2, token_encoding="cl100k_base"
+        )
+        memory.add_entry({"role": "user", "content": "hello there"})
+        history = memory.get_chat_history()
+        assert memory.get_chat_history()[0] is history[0]
+
+        memory.add_entry({"role": "assistant", "content": "hi"})
+        memory.add_entry({"role": "user", "content": "how are you"})
+        assert memory.get_chat_history() == [
+            {"role": "assistant", "content": "hi"},
+            {"role": "user", "content": "how are you"},
+        ]
+        memory.pop_entry()
+        assert memory.get_chat_history() == [{"role": "assistant", "content": "hi"}]
+        memory.load_state({"chat_history": [], "token_counts": []})
+        assert memory.get_chat_history() == []
+
+    def test_copy(self, fake_encoding):
+        memory = AgentMemory(
+            max_tokens=100, max_messages=10, token_encoding="cl100k_base"
+        )
+        memory.add_entry({"role": "user", "content": "hello there"})
+        copied = memory.copy()
+        copied.add_entry({"role": "assistant", "content": "hi"})
+        assert copied.entries[0] is memory.entries[0]
+        assert memory.get_chat_length() == 1
+        assert (copied.get_chat_length(), copied.get_total_tokens()) == (2, 3)
+        assert list(memory.token_counts) == [2]
+
+    def test_chat_history_property(self, fake_encoding):
+        memory = AgentMemory(
+            max_tokens=100, max_messages=10, token_encoding="cl100k_base"
+        )
+        memory.chat_history = [{"role": "user", "content": "hello there"}]
+        assert memory.get_total_tokens() == 2
+        assert memory.chat_history == [{"role": "user", "content": "hello there"}]
+
+    def test_load_state_with_invalid_token_counts(self, fake_encoding):
+        memory = AgentMemory(
+            max_tokens=100, max_messages=10, token_encoding="cl100k_base"
+        )
+        memory.load_state(
+            {
+                "chat_history": [{"role": "user", "content": "hello there"}],
+                "token_counts": [-1],
+            }
+        )
+        assert memory.get_total_tokens() == 2
+
+
+class TestMessageToDict:
+    def test_tool_calls(self):
+        tool_call = SimpleNamespace(
+            id="call_1",
+            type="function",
+            function=SimpleNamespace(name="get_weather", arguments='{"city": "X"}'),
+        )
+        message = SimpleNamespace(
+            role="assistant", content=None, tool_calls=[tool_call], function_call=None
+        )
+        assert message_to_dict(message) == {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": "call_1",
+                    "type": "function",
+                    "function": {"name": "get_weather", "arguments": '{"city": "X"}'},
+                }
+            ],
+        }
+
+    def test_plain_message(self):
+        message = SimpleNamespace(role="assistant", content="Hello!", tool_calls=None)
+        assert message_to_dict(message) == {"role": "assistant", "content": "Hello!"}
+
+    def test_agent_keeps_thoughts_as_dicts(self, fake_openai, make_agent, get_weather):
+        responder = ScriptedResponder(
+            [
+                FakeResponse(
+                    tool_calls=[FakeToolCall("get_weather", {"location": "Paris"})]
+                ),
+                "Sunny.",
+            ]
+        )
+        agent = make_agent(
+            CompletionAgent, fake_openai(responder), functions=[get_weather]
+        )
+        assert agent.ask("Weather in Paris?") == "Sunny."
+
+        assert [type(thought) for thought in agent.internal_thoughts] == [dict, dict]
+        assert agent.internal_thoughts[0]["tool_calls"][0]["function"]["name"] == (
+            "get_weather"
+        )
+        assert agent.get_last_response() == "Sunny."
@@ -0,0 +1,155 @@
+import json
+import socket
+import time
+
+import httpx
+import pytest
+
+from nimbusagent.serve import AgentServer
+from nimbusagent.testing.fake_openai import ScriptedResponder
+from nimbusagent.utils.metrics import HTTP_CLIENT_DISCONNECTS_TOTAL
+
+
+def parse_sse(text):
+    events = []
+    for message in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in message.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestAgentServer:
+    @pytest.fixture(autouse=True)
+    def servers(self, fake_openai, agent_options):
+        self.upstream = fake_openai(ScriptedResponder(["It is sunny today, enjoy it."]))
+        options = agent_options(self.upstream)
+        with AgentServer(
+            agents={"weather": options}, port=0, max_in_flight=4
+        ) as server:
+            self.server = server
+            self.client = httpx.Client(base_url=server.base_url, timeout=10)
+            yield
+            self.client.close()
+
+    def test_health(self):
+        res = self.client.get("/health")
+        assert res.status_code == 200
+        assert res.json()["agents"] == ["weather"]
+        assert res.json()["in_flight"] == 0
+
+    def test_ask(self):
+        res = self.client.post(
+            "/v1/agents/weather/ask",
+            json={"query": "Hi", "history": [{"role": "user", "content": "Hello"}]},
+        )
+        assert res.status_code == 200
+        assert res.json()["response"] == "It is sunny today, enjoy it."
+        assert res.json()["stats"]["loop_count"] == 1
+
+        metrics = self.client.get("/metrics").text
+        assert 'nimbusagent_http_requests_total{route="ask",status="200"} 1' in metrics
+        assert "nimbusagent_ask_seconds_count 1" in metrics
+
+    def test_stream(self):
+        res = self.client.post("/v1/stream", json={"query": "Hi"})
+        assert res.status_code == 200
+        assert res.headers["content-type"] == "text/event-stream"
+
+        events = parse_sse(res.text)
+        assert events[-1][0] == "done"
+        assert events[-1][1]["stats"]["loop_count"] == 1
+        content = "".join(data["content"] for event, data in events[:-1])
+        assert content == "It is sunny today, enjoy it."
+
+    def test_errors(self):
+        assert (
+            self.client.post("/v1/agents/other/ask", json={"query": "Hi"}).status_code
+            == 404
+        )
+        assert self.client.post("/v1/ask", json={}).status_code == 400
+        assert self.client.post("/v1/ask", content=b"not json").status_code == 400
+        assert self.client.get("/v1/ask").status_code == 405
+
+    def test_invalid_content_length(self):
+        for length in (b"abc", b"-1"):
+            with socket.create_connection(("127.0.0.1", self.server.port)) as sock:
+                sock.sendall(
+                    b"POST /v1/ask HTTP/1.1\r\nHost: test\r\nContent-Length: "
+                    + length
+                    + b"\r\n\r\n"
+                )
+                assert sock.recv(4096).startswith(b"HTTP/1.1 400 ")
+
+    def test_in_flight_cap(self):
+        self.server.in_flight = self.server.max_in_flight
+        try:
+            res = self.client.post("/v1/ask", json={"query": "Hi"})
+        finally:
+            self.server.in_flight = 0
+        assert res.status_code == 503
+        assert res.headers["retry-after"] == "1"
+
+    def test_client_disconnect_cancels_stream(self):
+        self.upstream.tokens_per_second = 5
+        body = json.dumps({"query": "Hi"}).encode()
+        with socket.create_connection(("127.0.0.1", self.server.port)) as sock:
+            sock.sendall(
+                b"POST /v1/stream HTTP/1.1\r\nHost: test\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            assert b"event: content" in sock.recv(4096) + sock.recv(4096)
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if (
+                self.server.metrics.get_counter(HTTP_CLIENT_DISCONNECTS_TOTAL)
+                and self.client.get("/health").json()["in_flight"] == 0
+            ):
+                break
+            time.sleep(0.05)
+        assert self.server.metrics.get_counter(HTTP_CLIENT_DISCONNECTS_TOTAL) == 1
+        assert self.client.get("/health").json()["in_flight"] == 0
+
+    def test_failed_head_cancels_stream(self):
+        self.upstream.tokens_per_second = 5
+        send_head = self.server._send_head
+
+        async def fail_stream_head(writer, status, content_type, *args, **kwargs):
+            if content_type == "text/event-stream":
+                raise ConnectionResetError("The client disconnected")
+            await send_head(writer, status, content_type, *args, **kwargs)
+
+        self.server._send_head = fail_stream_head
+        with pytest.raises(httpx.HTTPError):
+            self.client.post("/v1/stream", json={"query": "Hi"})
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if self.client.get("/health").json()["in_flight"] == 0:
+                break
+            time.sleep(0.05)
+        assert self.server.metrics.get_counter(HTTP_CLIENT_DISCONNECTS_TOTAL) == 1
+        assert self.client.get("/health").json()["in_flight"] == 0
+
+    def test_warmup_on_start(self):
+        with AgentServer(
+            agents={"weather": self.server.agents["weather"]},
+            port=0,
+            warmup_on_start=True,
+            warmup_keep_alive=True,
+        ) as server:
+            client = httpx.Client(base_url=server.base_url, timeout=10)
+            deadline = time.monotonic() + 5
+            while client.get("/ready").status_code != 200:
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+            assert client.get("/health").json()["ready"]
+            assert len(server._blueprints) == 2
+            # one keep-alive request per client; these options give each blueprint its own
+            clients = {
+                id(blueprint.client) for blueprint in server._blueprints.values()
+            }
+            assert self.upstream.request_counts["/models/gpt-4-turbo"] == len(clients)
+            client.close()
+        assert self.client.get("/ready").json() == {"status": "ready"}
@@ -0,0 +1,102 @@
+import time
+
+import httpx
+import pytest
+
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.testing.cassette import (
+    RecordingTransport,
+    ReplayTransport,
+    cassette_client,
+    cassette_queries,
+    load_cassette,
+)
+from nimbusagent.testing.fake_openai import ScriptedResponder
+
+pytestmark = pytest.mark.usefixtures("fake_encoding")
+
+
+class TestCassette:
+    @pytest.fixture(autouse=True)
+    def server(self, tmp_path, fake_openai):
+        self.server = fake_openai(
+            ScriptedResponder(["Hello there, friend. How are you?"])
+        )
+        self.path = str(tmp_path / "cassette.jsonl")
+
+    def record(self, agent_class, query="Hi"):
+        client = cassette_client(
+            self.path, "record", api_key="fake", base_url=self.server.base_url
+        )
+        agent = agent_class(client=client)
+        response = agent.ask(query)
+        if agent_class is StreamingAgent:
+            response = "".join(response)
+        client.close()
+        return response
+
+    def test_record_streaming(self):
+        response = self.record(StreamingAgent)
+        assert response == "Hello there, friend. How are you?"
+
+        interactions = load_cassette(self.path)
+        paths = [interaction["path"] for interaction in interactions]
+        assert paths == ["/v1/moderations", "/v1/chat/completions"]
+        chat = interactions[1]
+        assert chat["status"] == 200
+        assert chat["request"]["stream"] is True
+        assert len(chat["chunks"]) > 1
+        assert all(offset >= 0 for offset, _ in chat["chunks"])
+        assert cassette_queries(self.path) == ["Hi"]
+
+    def test_replay_matches_recording(self):
+        recorded = self.record(StreamingAgent)
+        self.server.stop()
+
+        client = cassette_client(self.path, "replay")
+        agent = StreamingAgent(client=client)
+        assert "".join(agent.ask("Hi")) == recorded
+        assert agent.get_last_stats().completion_tokens > 0
+
+    def test_replay_completion(self):
+        recorded = self.record(CompletionAgent)
+        self.server.stop()
+
+        agent = CompletionAgent(client=cassette_client(self.path, "replay"))
+        assert agent.ask("Hi") == recorded
+
+    def test_replay_exhausted(self):
+        self.record(CompletionAgent)
+        client = httpx.Client(transport=ReplayTransport(self.path))
+        url = f"{self.server.base_url}/chat/completions"
+        client.post(url, json={}).read()
+        with pytest.raises(RuntimeError):
+            client.post(url, json={})
+
+    def test_replay_cycle(self):
+        self.record(CompletionAgent)
+        client = httpx.Client(transport=ReplayTransport(self.path, cycle=True))
+        url = f"{self.server.base_url}/chat/completions"
+        for _ in range(3):
+            assert client.post(url, json={}).status_code == 200
+
+    def test_replay_preserves_timing(self):
+        transport = RecordingTransport(self.path)
+        self.server.latency = 0.1
+        client = httpx.Client(transport=transport)
+        client.post(f"{self.server.base_url}/moderations", json={"input": "Hi"})
+        client.close()
+
+        url = f"{self.server.base_url}/moderations"
+        collapsed = httpx.Client(transport=ReplayTransport(self.path))
+        start = time.perf_counter()
+        collapsed.post(url, json={})
+        assert time.perf_counter() - start < 0.05
+
+        preserved = httpx.Client(
+            transport=ReplayTransport(self.path, timing="preserve")
+        )
+        start = time.perf_counter()
+        preserved.post(url, json={})
+        assert time.perf_counter() - start >= 0.1
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+from openai import OpenAI
+
+from nimbusagent.testing.fake_openai import (
+    FakeOpenAIServer,
+    FakeResponse,
+    FakeToolCall,
+    ScriptedResponder,
+    fake_embedding,
+)
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_weather",
+            "parameters": {
+                "type": "object",
+                "properties": {"location": {"type": "string"}},
+                "required": ["location"],
+            },
+        },
+    }
+]
+
+
+class TestFakeOpenAIServer:
+    @pytest.fixture(autouse=True)
+    def server(self):
+        with FakeOpenAIServer(flag_words=["forbidden"]) as server:
+            self.server = server
+            self.client = OpenAI(api_key="fake", base_url=server.base_url)
+            yield
+            self.client.close()
+
+    def test_completion(self):
+        res = self.client.chat.completions.create(
+            model="gpt-4", messages=[{"role": "user", "content": "Hi"}]
+        )
+        assert res.choices[0].finish_reason == "stop"
+        assert res.choices[0].message.content
+        assert res.usage.completion_tokens > 0
+
+    def test_completion_with_tool_calls(self):
+        res = self.client.chat.completions.create(
+            model="gpt-4",
+            messages=[{"role": "user", "content": "What's the weather?"}],
+            tools=TOOLS,
+        )
+        assert res.choices[0].finish_reason == "tool_calls"
+        tool_call = res.choices[0].message.tool_calls[0]
+        assert tool_call.function.name == "get_weather"
+        assert "location" in json.loads(tool_call.function.arguments)
+
+    def test_streaming(self):
+        self.server.responder = ScriptedResponder(["Hello there, friend."])
+        stream = self.client.chat.completions.create(
+            model="gpt-4",
+            messages=[{"role": "user", "content": "Hi"}],
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        chunks = list(stream)
+        content = "".join(
+            chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices
+        )
+        assert content == "Hello there, friend."
+        assert chunks[-1].usage.completion_tokens > 0
+
+    def test_streaming_tool_calls(self):
+        self.server.responder = ScriptedResponder(
+            [FakeResponse(tool_calls=[FakeToolCall("get_weather", {"location": "X"})])]
+        )
+        stream = self.client.chat.completions.create(
+            model="gpt-4",
+            messages=[{"role": "user", "content": "Hi"}],
+            tools=TOOLS,
+            stream=True,
+        )
+        arguments = ""
+        finish_reason = None
+        for chunk in stream:
+            choice = chunk.choices[0]
+            if choice.delta.tool_calls:
+                arguments += choice.delta.tool_calls[0].function.arguments or ""
+            finish_reason = choice.finish_reason or finish_reason
+        assert json.loads(arguments) == {"location": "X"}
+        assert finish_reason == "tool_calls"
+
+    def test_moderation(self):
+        assert not self.client.moderations.create(input="Hi").results[0].flagged
+        assert self.client.moderations.create(input="forbidden").results[0].flagged
+
+    def test_embeddings(self):
+        res = self.client.embeddings.create(input="Hi", model="text-embedding-3-small")
+        assert res.data[0].embedding == pytest.approx(fake_embedding("Hi"))
+        assert self.server.request_counts["/embeddings"] == 1
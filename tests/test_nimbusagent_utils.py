@@ -2,6 +2,7 @@ import os
 from unittest.mock import patch
 
 import openai.types
+import pytest
 import requests
 from nimbusagent.utils import helper
 
@@ -60,6 +61,26 @@ class TestHelperFunctions:
 
         assert result[0]["name"] == "func1"
 
+    def test_embedding_index_matches_find_similar_embedding_list(self):
+        function_embeddings = [
+            {"name": "func1", "embedding": [0.2, 0.1]},
+            {"name": "func2", "embedding": [0.1, 0.3]},
+            {"name": "func3", "embedding": [-1.0, 0.0]},
+        ]
+        expected = helper.find_similar_embedding_list(
+            "some query",
+            function_embeddings,
+            k_nearest_neighbors=3,
+            query_embedding=[0.3, 0.2],
+        )
+        result = helper.EmbeddingIndex(function_embeddings).search(
+            [0.3, 0.2], k_nearest_neighbors=3
+        )
+        assert [d["name"] for d in result] == ["func1", "func2"]
+        for found, similar in zip(result, expected):
+            assert found["similarity"] == pytest.approx(similar["similarity"])
+        assert helper.EmbeddingIndex([]).search([0.3, 0.2]) is None
+
     def test_combine_lists_unique(self):
         assert helper.combine_lists_unique([1, 2], [2, 3]) == [1, 2, 3]
         assert helper.combine_lists_unique([1, 2], [2, 3, 4]) == [1, 2, 3, 4]
@@ -104,3 +125,26 @@ class TestHelperFunctions:
         function_embeddings = [{"name": "func1", "embedding": [0.2, 0.1]}]
         result = helper.find_similar_embedding_list("some query", function_embeddings)
         assert result is None
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        cache = helper.LRUCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1  # "b" is now the least recently used
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert len(cache) == 2
+
+    def test_find_similar_embedding_list_with_query_embedding(self):
+        function_embeddings = [
+            {"name": "func1", "embedding": [0.2, 0.1]},
+            {"name": "func2", "embedding": [0.1, 0.3]},
+        ]
+        with patch("nimbusagent.utils.helper.get_embedding") as mock_get_embedding:
+            result = helper.find_similar_embedding_list(
+                "some query", function_embeddings, query_embedding=[0.1, 0.3]
+            )
+            mock_get_embedding.assert_not_called()
+        assert result[0]["name"] == "func2"
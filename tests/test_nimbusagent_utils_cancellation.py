@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.testing.fake_openai import (
+    FakeResponse,
+    FakeToolCall,
+    ScriptedResponder,
+)
+from nimbusagent.utils.cancellation import (
+    AskCancelled,
+    CancellationToken,
+    current_cancellation_token,
+)
+
+
+class TestCancellationToken:
+    def test_cancel(self):
+        token = CancellationToken()
+        calls = []
+        token.add_callback(lambda: calls.append(1))
+        assert not token.cancelled
+        assert not token.wait(0.01)
+        token.raise_if_cancelled()
+
+        token.cancel()
+        token.cancel()
+        assert token.cancelled and token.wait(0)
+        assert calls == [1]
+        token.add_callback(lambda: calls.append(2))
+        assert calls == [1, 2]
+        with pytest.raises(AskCancelled):
+            token.raise_if_cancelled()
+
+
+class TestAgentCancellation:
+    @pytest.fixture(autouse=True)
+    def setup(self, fake_openai, make_agent):
+        self.fake_openai = fake_openai
+        self.make_agent = make_agent
+
+    def test_cancel_from_tool(self):
+        history = [
+            {"role": "user", "content": "Hi"},
+            {"role": "assistant", "content": "Hello!"},
+        ]
+        tokens = []
+
+        def get_weather(location: str) -> dict:
+            """
+            Get the current weather
+            :param location: The city
+            """
+            tokens.append(current_cancellation_token())
+            agent.cancel()
+            return {"content": "Sunny"}
+
+        responder = ScriptedResponder(
+            [
+                FakeResponse(
+                    tool_calls=[FakeToolCall("get_weather", {"location": "Paris"})]
+                ),
+                "Sunny.",
+            ]
+        )
+        agent = self.make_agent(
+            CompletionAgent,
+            self.fake_openai(responder),
+            functions=[get_weather],
+            message_history=history,
+        )
+        assert agent.ask("Weather in Paris?") is None
+
+        assert tokens[0] is not None and tokens[0].cancelled
+        assert agent.get_chat_history() == history
+        stats = agent.get_last_stats()
+        assert stats.cancelled and stats.loop_count == 1
+        assert agent.get_stats().cancelled == 1
+
+    def test_cancel_stream_from_another_thread(self):
+        content = " ".join(f"word{i}" for i in range(100))
+        server = self.fake_openai(ScriptedResponder([content]), tokens_per_second=20)
+        agent = self.make_agent(StreamingAgent, server)
+        start = time.perf_counter()
+        chunks = []
+        for chunk in agent.ask("Tell me a story"):
+            chunks.append(chunk)
+            if len(chunks) == 1:
+                threading.Timer(0.1, agent.cancel).start()
+
+        assert time.perf_counter() - start < 2
+        assert 0 < len(chunks) < 20
+        assert agent.get_chat_history() == []
+        assert agent.get_last_stats().cancelled
+        assert agent._active_stream is None
+
+    def test_cancel_before_the_stream_starts(self):
+        server = self.fake_openai(ScriptedResponder(["One two three."]))
+        agent = self.make_agent(StreamingAgent, server)
+        token = CancellationToken()
+        events = agent.ask("Count", cancellation=token)
+        agent.cancel()
+
+        assert list(events) == []
+        assert token.cancelled and token._callbacks == []
+        assert agent.get_last_stats().cancelled
+        assert "/chat/completions" not in server.request_counts
+
+    def test_closing_the_stream_cancels(self):
+        server = self.fake_openai(ScriptedResponder(["One two three."]))
+        agent = self.make_agent(StreamingAgent, server)
+        events = agent.ask("Count")
+        next(events)
+        events.close()
+
+        assert agent.get_chat_history() == []
+        assert agent.get_last_stats().cancelled
@@ -0,0 +1,140 @@
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.testing.fake_openai import (
+    ScriptedResponder,
+    fake_embedding,
+)
+from nimbusagent.utils.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitBreakers,
+    CircuitOpenError,
+)
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+
+
+def unavailable():
+    raise openai.APIConnectionError(request=REQUEST)
+
+
+def bad_request():
+    raise openai.BadRequestError(
+        "Bad request", response=httpx.Response(400, request=REQUEST), body=None
+    )
+
+
+def get_tides(location: str) -> dict:
+    """
+    Get the tides
+    :param location: The city
+    """
+    return {"content": "Low tide at noon"}
+
+
+def trip(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+class TestCircuitBreaker:
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("embeddings", failure_threshold=2)
+        for _ in range(3):
+            with pytest.raises(openai.BadRequestError):
+                breaker.call(bad_request)
+        with pytest.raises(openai.APIConnectionError):
+            breaker.call(unavailable)
+        assert breaker.state == CLOSED
+        with pytest.raises(openai.APIConnectionError):
+            breaker.call(unavailable)
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.call(lambda: "ok")
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker("chat", failure_threshold=1, recovery_time=0.05)
+        trip(breaker)
+        time.sleep(0.06)
+        assert breaker.state == HALF_OPEN
+        with pytest.raises(openai.APIConnectionError):
+            breaker.call(unavailable)
+        assert breaker.state == OPEN
+
+        time.sleep(0.06)
+        assert breaker.allow()
+        assert not breaker.allow()  # a single probe at a time
+        breaker.record_success()
+        assert breaker.state == CLOSED
+        assert breaker.call(lambda: "ok") == "ok"
+
+    def test_call_admitted_before_opening_is_not_a_probe(self):
+        breaker = CircuitBreaker("chat", failure_threshold=1, recovery_time=0)
+        assert breaker.allow()
+        probes = []
+        probing = threading.Thread(
+            target=lambda: (trip(breaker), probes.append(breaker.allow()))
+        )
+        probing.start()
+        probing.join()
+        assert probes == [True]
+
+        breaker.record_success()
+        assert breaker.state == HALF_OPEN and breaker._probes == 1
+        assert not breaker.allow()  # the probe is still in flight
+
+
+class TestAgentDegradedModes:
+    @pytest.fixture(autouse=True)
+    def server(self, fake_openai, make_agent):
+        self.server = fake_openai(ScriptedResponder(["Hello!"]))
+        self.new_agent = make_agent
+
+    def make_agent(self, breakers, **kwargs):
+        return self.new_agent(
+            CompletionAgent, self.server, circuit_breakers=breakers, **kwargs
+        )
+
+    def test_embeddings_down_uses_pattern_groups(self, get_weather):
+        breakers = CircuitBreakers()
+        trip(breakers.embeddings)
+        agent = self.make_agent(
+            breakers,
+            functions=[get_weather, get_tides],
+            functions_embeddings=[
+                {"name": "get_weather", "embedding": fake_embedding("weather")},
+                {"name": "get_tides", "embedding": fake_embedding("tides")},
+            ],
+            functions_pattern_groups=[
+                {"pattern": r"(?i)weather", "functions": ["get_weather"]}
+            ],
+        )
+        assert agent.ask("What's the weather in Paris?") == "Hello!"
+        assert [func["name"] for func in agent.get_functions()] == ["get_weather"]
+        assert "/embeddings" not in self.server.request_counts
+
+    @pytest.mark.parametrize("fail_open", [True, False])
+    def test_moderation_down(self, fail_open):
+        breakers = CircuitBreakers(moderation_fail_open=fail_open)
+        trip(breakers.moderation)
+        agent = self.make_agent(breakers, perform_moderation=True)
+        response = agent.ask("Hi")
+        assert (response == "Hello!") is fail_open
+        assert agent.get_last_stats().moderation_skipped
+        assert "/moderations" not in self.server.request_counts
+
+    def test_chat_down_fails_fast(self):
+        breakers = CircuitBreakers()
+        trip(breakers.chat)
+        agent = self.make_agent(breakers)
+        with pytest.raises(CircuitOpenError):
+            agent.ask("Hi")
+        assert "/chat/completions" not in self.server.request_counts
@@ -0,0 +1,158 @@
+import contextvars
+import time
+
+import pytest
+
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.testing.fake_openai import (
+    FakeResponse,
+    ScriptedResponder,
+)
+from nimbusagent.utils.hedging import HedgePolicy, PrefetchedStream
+from nimbusagent.utils.rate_limit import RateLimiter
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        self.closed = True
+
+
+class TestHedgePolicy:
+    def test_delay_follows_percentile(self):
+        policy = HedgePolicy(percentile=90, initial_delay=1.0, min_samples=10)
+        assert policy.get_delay() == 1.0
+        for i in range(1, 11):
+            policy._record(i / 10, False, False)
+        assert policy.get_delay() == pytest.approx(0.9)
+
+    def test_hedge_wins_and_loser_is_discarded(self):
+        policy = HedgePolicy(initial_delay=0.01)
+        discarded = []
+
+        def slow(token):
+            time.sleep(0.2)
+            return "slow"
+
+        outcome = policy.call(slow, lambda token: "fast", discard=discarded.append)
+        assert (outcome.result, outcome.hedged, outcome.hedge_won) == (
+            "fast",
+            True,
+            True,
+        )
+        time.sleep(0.3)
+        assert discarded == ["slow"]
+        assert policy.get_stats()["hedges_won"] == 1
+
+    def test_hedge_rate_is_capped(self):
+        policy = HedgePolicy(initial_delay=0.01, min_delay=0, max_hedge_rate=0.5)
+
+        def slow(token):
+            time.sleep(0.1)
+            return "slow"
+
+        outcomes = [policy.call(slow, lambda token: "fast").hedged for _ in range(4)]
+        assert outcomes == [True, False, False, True]
+        assert not HedgePolicy(max_hedge_rate=0)._can_hedge()
+
+    def test_loser_is_cancelled(self):
+        policy = HedgePolicy(initial_delay=0.01)
+        tokens = []
+
+        def slow(token):
+            tokens.append(token)
+            time.sleep(0.1)
+            return "slow"
+
+        assert policy.call(slow, lambda token: "fast").hedge_won
+        assert tokens[0].cancelled
+
+    def test_delay_starts_when_the_attempt_runs(self):
+        policy = HedgePolicy(initial_delay=0.2, max_workers=1)
+        policy._executor.submit(time.sleep, 0.3)
+
+        def attempt(token):
+            time.sleep(0.05)
+            return "first"
+
+        outcome = policy.call(attempt, lambda token: "hedge")
+        assert (outcome.result, outcome.hedged) == ("first", False)
+        policy.shutdown()
+
+    def test_attempts_run_in_the_callers_context(self):
+        policy = HedgePolicy(initial_delay=0.01)
+        request_id = contextvars.ContextVar("request_id", default=None)
+        seen = []
+
+        def slow(token):
+            seen.append(request_id.get())
+            time.sleep(0.1)
+            return "slow"
+
+        def fast(token):
+            seen.append(request_id.get())
+            return "fast"
+
+        request_id.set("abc")
+        assert policy.call(slow, fast).hedge_won
+        assert seen == ["abc", "abc"]
+
+    def test_prefetched_stream(self):
+        stream = FakeStream([1, 2, 3])
+        prefetched = PrefetchedStream(stream)
+        assert next(prefetched) == 1
+        assert list(prefetched) == [2, 3]
+        prefetched.close()
+        assert stream.closed
+
+
+class TestAgentHedging:
+    @pytest.mark.parametrize("agent_class", [CompletionAgent, StreamingAgent])
+    def test_slow_call_is_hedged(self, agent_class, fake_openai, make_agent):
+        responder = ScriptedResponder(
+            [FakeResponse("Slow answer.", delay=0.5), "Fast answer."]
+        )
+        agent = make_agent(
+            agent_class,
+            fake_openai(responder),
+            hedge_policy=HedgePolicy(initial_delay=0.05, use_secondary_model=True),
+        )
+        response = agent.ask("Hi")
+        if agent_class is StreamingAgent:
+            response = "".join(response)
+
+        assert response == "Fast answer."
+        loop = agent.get_last_stats().loops[0]
+        assert loop.hedged and loop.hedge_won
+        assert loop.model == agent.secondary_model_name
+        assert agent.get_stats().hedges_won == 1
+
+    @pytest.mark.parametrize("agent_class", [CompletionAgent, StreamingAgent])
+    def test_loser_is_not_charged_the_winners_usage(
+        self, agent_class, fake_openai, make_agent
+    ):
+        limiter = RateLimiter(tokens_per_minute=60000)
+        responder = ScriptedResponder(
+            [FakeResponse("Slow answer.", delay=0.3), "Fast answer."]
+        )
+        agent = make_agent(
+            agent_class,
+            fake_openai(responder),
+            hedge_policy=HedgePolicy(initial_delay=0.05),
+            rate_limiter=limiter,
+        )
+        response = agent.ask("Hi")
+        if agent_class is StreamingAgent:
+            response = "".join(response)
+        assert response == "Fast answer."
+        time.sleep(0.5)
+
+        # both calls were pre-charged max_tokens on top of their prompt, and settled once they were done
+        assert limiter._levels["tokens"] > 60000 - 200
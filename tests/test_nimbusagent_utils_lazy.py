@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+from nimbusagent.memory.base import AgentMemory
+from nimbusagent.utils.lazy import LAZY_MODULES, warmup
+
+
+class TestLazyImports:
+    def test_agents_do_not_load_lazy_modules(self):
+        code = """
+import sys
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.streaming import StreamingAgent
+import nimbusagent.serve
+
+def get_weather(location: str) -> dict:
+    '''
+    Get the current weather
+    :param location: The city
+    '''
+
+CompletionAgent(openai_api_key="fake", functions=[get_weather])
+StreamingAgent(openai_api_key="fake", perform_moderation=False)
+print(",".join(module for module in %r if module in sys.modules))
+""" % list(LAZY_MODULES)
+        process = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        assert process.stdout.strip() == ""
+
+    def test_encoding_loaded_on_first_count(self, fake_encoding):
+        memory = AgentMemory(100, 10, "cl100k_base")
+        fake_encoding.assert_not_called()
+        memory.add_entry({"role": "user", "content": "Hello there"})
+        memory.add_entry({"role": "assistant", "content": "Hi"})
+        fake_encoding.assert_called_once_with("cl100k_base")
+        assert memory.get_total_tokens() == 3
+
+    def test_warmup(self, fake_encoding):
+        timings = warmup(["cl100k_base", "o200k_base"])
+        assert set(timings) == {*LAZY_MODULES, "cl100k_base", "o200k_base"}
+        assert fake_encoding.call_count == 2
+        assert all(module in sys.modules for module in LAZY_MODULES)
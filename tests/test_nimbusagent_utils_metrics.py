@@ -0,0 +1,58 @@
+from nimbusagent.utils.metrics import (
+    MetricsRegistry,
+    NOOP_METRICS,
+    ASK_LOOPS,
+    MODEL_CALL_SECONDS,
+    TOOL_CALL_ERRORS_TOTAL,
+)
+
+
+class TestMetricsRegistry:
+    def test_noop_metrics(self):
+        NOOP_METRICS.inc("anything")
+        NOOP_METRICS.observe("anything", 1.0)
+
+    def test_counter(self):
+        registry = MetricsRegistry()
+        registry.inc(TOOL_CALL_ERRORS_TOTAL, labels={"function": "get_weather"})
+        registry.inc(TOOL_CALL_ERRORS_TOTAL, labels={"function": "get_weather"})
+        assert (
+            registry.get_counter(
+                TOOL_CALL_ERRORS_TOTAL, labels={"function": "get_weather"}
+            )
+            == 2
+        )
+        assert registry.get_counter(TOOL_CALL_ERRORS_TOTAL) == 0
+
+    def test_render_counter(self):
+        registry = MetricsRegistry()
+        registry.inc(TOOL_CALL_ERRORS_TOTAL, labels={"function": 'say "hi"'})
+        text = registry.render_prometheus()
+        assert f"# TYPE {TOOL_CALL_ERRORS_TOTAL} counter" in text
+        assert f'{TOOL_CALL_ERRORS_TOTAL}{{function="say \\"hi\\""}} 1' in text
+
+    def test_render_histogram(self):
+        registry = MetricsRegistry(buckets={MODEL_CALL_SECONDS: (0.1, 1.0)})
+        registry.observe(MODEL_CALL_SECONDS, 0.05, labels={"model": "gpt-4"})
+        registry.observe(MODEL_CALL_SECONDS, 0.5, labels={"model": "gpt-4"})
+        registry.observe(MODEL_CALL_SECONDS, 5.0, labels={"model": "gpt-4"})
+        lines = registry.render_prometheus().splitlines()
+
+        assert f"# TYPE {MODEL_CALL_SECONDS} histogram" in lines
+        assert f'{MODEL_CALL_SECONDS}_bucket{{model="gpt-4",le="0.1"}} 1' in lines
+        assert f'{MODEL_CALL_SECONDS}_bucket{{model="gpt-4",le="1"}} 2' in lines
+        assert f'{MODEL_CALL_SECONDS}_bucket{{model="gpt-4",le="+Inf"}} 3' in lines
+        assert f'{MODEL_CALL_SECONDS}_sum{{model="gpt-4"}} 5.55' in lines
+        assert f'{MODEL_CALL_SECONDS}_count{{model="gpt-4"}} 3' in lines
+
+    def test_default_loop_buckets(self):
+        registry = MetricsRegistry()
+        registry.observe(ASK_LOOPS, 2)
+        assert registry.get_histogram_count(ASK_LOOPS) == 1
+        assert f'{ASK_LOOPS}_bucket{{le="2"}} 1' in registry.render_prometheus()
+
+    def test_reset(self):
+        registry = MetricsRegistry()
+        registry.inc(TOOL_CALL_ERRORS_TOTAL)
+        registry.reset()
+        assert registry.render_prometheus() == ""
@@ -0,0 +1,69 @@
+import os
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from nimbusagent.utils.profiling import AskProfiler
+
+os.environ["OPENAI_API_KEY"] = "some key"
+
+
+def busy_function():
+    return [str(i) for i in range(1000)]
+
+
+class TestAskProfiler:
+    def test_writes_reports(self, tmp_path):
+        profiler = AskProfiler(output_dir=str(tmp_path))
+        for _ in range(2):
+            session = profiler.start_ask()
+            busy_function()
+            session.stop()
+
+        assert profiler.last_report == str(tmp_path / "ask-2")
+        assert "busy_function" in (tmp_path / "ask-1.cpu.txt").read_text()
+        assert (tmp_path / "ask-1.prof").exists()
+        assert (
+            "Difference from the previous profiled ask"
+            not in (tmp_path / "ask-1.mem.txt").read_text()
+        )
+        assert (
+            "Difference from the previous profiled ask"
+            in (tmp_path / "ask-2.mem.txt").read_text()
+        )
+
+    def test_every_n(self, tmp_path):
+        profiler = AskProfiler(output_dir=str(tmp_path), every_n=2, trace_memory=False)
+        sessions = [profiler.start_ask() for _ in range(4)]
+        assert [session is not None for session in sessions] == [
+            True,
+            False,
+            True,
+            False,
+        ]
+        sessions[0].stop()
+        sessions[2].stop()
+        assert sorted(os.listdir(tmp_path)) == [
+            "ask-1.cpu.txt",
+            "ask-1.prof",
+            "ask-3.cpu.txt",
+            "ask-3.prof",
+        ]
+
+    def test_agent_ask_is_profiled(self, tmp_path, fake_encoding):
+        from nimbusagent.agent.completion import CompletionAgent
+
+        agent = CompletionAgent(
+            perform_moderation=False,
+            profiler=AskProfiler(output_dir=str(tmp_path), trace_memory=False),
+        )
+        message = SimpleNamespace(role="assistant", content="Hello!", tool_calls=None)
+        agent.client.chat.completions.create = MagicMock(
+            return_value=SimpleNamespace(
+                choices=[SimpleNamespace(finish_reason="stop", message=message)],
+                usage=None,
+            )
+        )
+
+        agent.ask("Hi")
+
+        assert "_generate_response" in (tmp_path / "ask-1.cpu.txt").read_text()
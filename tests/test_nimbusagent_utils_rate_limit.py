@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.testing.fake_openai import ScriptedResponder
+from nimbusagent.utils.rate_limit import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    RateLimiter,
+)
+
+
+def timed_acquire(limiter, tokens, priority=PRIORITY_INTERACTIVE):
+    start = time.perf_counter()
+    reservation = limiter.acquire(tokens, priority)
+    return reservation, time.perf_counter() - start
+
+
+class TestRateLimiter:
+    def test_tokens_per_minute(self):
+        limiter = RateLimiter(tokens_per_minute=60000)
+        _, waited = timed_acquire(limiter, 60000)
+        assert waited < 0.05
+        _, waited = timed_acquire(limiter, 100)
+        assert 0.05 < waited < 0.5
+        assert limiter.get_stats()["waits"] == 1
+
+    def test_requests_per_minute(self):
+        limiter = RateLimiter(requests_per_minute=600)
+        limiter._levels["requests"] = 0
+        _, waited = timed_acquire(limiter, 0)
+        assert 0.05 < waited < 0.5
+
+    def test_settle_gives_back_unused_tokens(self):
+        limiter = RateLimiter(tokens_per_minute=60000)
+        reservation = limiter.acquire(60000)
+        reservation.settle(0)
+        _, waited = timed_acquire(limiter, 1000)
+        assert waited < 0.05
+
+    def test_interactive_goes_before_batch(self):
+        limiter = RateLimiter(tokens_per_minute=60000)
+        limiter.acquire(60000)
+        served = []
+
+        def ask(priority):
+            limiter.acquire(200, priority)
+            served.append(priority)
+
+        batch = threading.Thread(target=ask, args=(PRIORITY_BATCH,))
+        batch.start()
+        time.sleep(0.05)
+        interactive = threading.Thread(target=ask, args=(PRIORITY_INTERACTIVE,))
+        interactive.start()
+        batch.join()
+        interactive.join()
+        assert served == [PRIORITY_INTERACTIVE, PRIORITY_BATCH]
+
+    def test_shared_state_file(self, tmp_path):
+        state_file = tmp_path / "limits.json"
+        first = RateLimiter(tokens_per_minute=60000, state_file=state_file)
+        second = RateLimiter(tokens_per_minute=60000, state_file=state_file)
+        first.acquire(60000)
+        _, waited = timed_acquire(second, 100)
+        assert 0.05 < waited < 0.5
+
+
+class TestAgentRateLimit:
+    def test_usage_corrects_the_estimate(self, fake_openai, make_agent):
+        limiter = RateLimiter(tokens_per_minute=60)
+        server = fake_openai(ScriptedResponder(["Hello there!"]))
+        agent = make_agent(CompletionAgent, server, rate_limiter=limiter)
+        agent.ask("Hi")
+
+        stats = agent.get_last_stats()
+        used = stats.prompt_tokens + stats.completion_tokens
+        assert 0 < used < 60
+        # the ask was pre-charged max_tokens on top of its prompt, and settled with its usage
+        assert limiter._levels["tokens"] == pytest.approx(60 - used, abs=1)
@@ -0,0 +1,141 @@
+import time
+
+import pytest
+
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.routing import ModelRouter, SECONDARY
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.testing.fake_openai import (
+    FakeResponse,
+    FakeToolCall,
+    ScriptedResponder,
+)
+from nimbusagent.utils.response_cache import ResponseCache
+
+HISTORY = [
+    {"role": "user", "content": "Hello"},
+    {"role": "assistant", "content": "Hi! How can I help?"},
+]
+
+
+class TestResponseCache:
+    def test_exact_hit(self):
+        cache = ResponseCache()
+        scope = cache.make_scope("You are helpful.", "gpt-4", None)
+        key = cache.make_key(scope, HISTORY, "What's the weather today?")
+        assert cache.get(key) == (None, None)
+
+        cache.set(key, "Sunny.", chunks=["Sun", "ny."])
+        entry, result = cache.get(key)
+        assert result == "exact"
+        assert entry.content == "Sunny."
+        assert entry.get_chunks() == ["Sun", "ny."]
+
+    def test_key_depends_on_history_tail_and_tools(self):
+        cache = ResponseCache(history_tail=1)
+        scope = cache.make_scope("You are helpful.", "gpt-4", None)
+        key = cache.make_key(scope, HISTORY, "What's the weather today?")
+        assert key == cache.make_key(scope, HISTORY[1:], "What's the weather today?")
+        assert key != cache.make_key(scope, HISTORY[:1], "What's the weather today?")
+
+        tool_scope = cache.make_scope("You are helpful.", "gpt-4", [{"name": "f"}])
+        assert key != cache.make_key(tool_scope, HISTORY, "What's the weather today?")
+
+    def test_ttl_per_entry(self):
+        cache = ResponseCache(ttl=60)
+        cache.set("short", "a", ttl=0.01)
+        cache.set("long", "b")
+        cache.set("never", "c", ttl=0)
+        time.sleep(0.02)
+        assert cache.get("short") == (None, None)
+        assert cache.get("long")[1] == "exact"
+        assert cache.get("never") == (None, None)
+
+    def test_semantic_hit(self):
+        cache = ResponseCache(semantic_threshold=0.95)
+        cache.set("a", "Sunny.", scope="s", embedding=[1.0, 0.0, 0.1])
+
+        entry, result = cache.get("b", scope="s", embedding=[1.0, 0.0, 0.12])
+        assert result == "semantic"
+        assert entry.content == "Sunny."
+        assert cache.get("b", scope="other", embedding=[1.0, 0.0, 0.1]) == (None, None)
+        assert cache.get("b", scope="s", embedding=[0.0, 1.0, 0.0]) == (None, None)
+
+    def test_eviction(self):
+        cache = ResponseCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        assert len(cache) == 2
+        assert cache.get("b") == (None, None)
+
+
+def get_weather(location: str) -> dict:
+    """
+    Get the current weather
+    :param location: The city
+    """
+    return {"content": "Sunny, 21C", "cacheable": False}
+
+
+class TestAgentResponseCache:
+    @pytest.fixture(autouse=True)
+    def server(self, fake_openai, make_agent):
+        self.server = fake_openai(ScriptedResponder(["It is sunny today."]))
+        self.new_agent = make_agent
+
+    def make_agent(self, agent_class, cache, **kwargs):
+        return self.new_agent(agent_class, self.server, response_cache=cache, **kwargs)
+
+    def test_completion_cache_hit(self):
+        cache = ResponseCache()
+        assert self.make_agent(CompletionAgent, cache).ask("Hi") == "It is sunny today."
+        assert self.server.request_counts["/chat/completions"] == 1
+
+        agent = self.make_agent(CompletionAgent, cache)
+        assert agent.ask("Hi") == "It is sunny today."
+        assert self.server.request_counts["/chat/completions"] == 1
+        assert agent.get_last_stats().response_cache == "exact"
+        assert agent.get_last_stats().loop_count == 0
+        assert agent.get_chat_history()[-1]["content"] == "It is sunny today."
+
+    def test_streaming_cache_replays_chunks(self):
+        cache = ResponseCache()
+        first = list(self.make_agent(StreamingAgent, cache).ask("Hi"))
+
+        agent = self.make_agent(StreamingAgent, cache)
+        assert list(agent.ask("Hi")) == first
+        assert self.server.request_counts["/chat/completions"] == 1
+        assert agent.get_last_stats().time_to_first_token is not None
+
+    def test_cache_is_scoped_to_the_routed_model(self):
+        cache = ResponseCache()
+        routed = self.make_agent(CompletionAgent, cache, model_router=ModelRouter())
+        routed.ask("Hi")
+        assert routed.get_last_stats().model_route == SECONDARY
+
+        agent = self.make_agent(CompletionAgent, cache)
+        agent.ask("Hi")
+        assert agent.get_last_stats().response_cache is None
+        assert self.server.request_counts["/chat/completions"] == 2
+
+        routed = self.make_agent(CompletionAgent, cache, model_router=ModelRouter())
+        routed.ask("Hi")
+        assert routed.get_last_stats().response_cache == "exact"
+        assert self.server.request_counts["/chat/completions"] == 2
+
+    def test_uncacheable_tool_response(self):
+        self.server.responder = ScriptedResponder(
+            [
+                FakeResponse(
+                    tool_calls=[FakeToolCall("get_weather", {"location": "Paris"})]
+                ),
+                "It is sunny in Paris.",
+            ]
+        )
+        cache = ResponseCache()
+        agent = self.make_agent(CompletionAgent, cache, functions=[get_weather])
+        agent.ask("What's the weather in Paris?")
+        assert len(agent.get_last_stats().tool_calls) == 1
+        assert len(cache) == 0
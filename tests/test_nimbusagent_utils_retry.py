@@ -0,0 +1,114 @@
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from nimbusagent.agent.completion import CompletionAgent
+from nimbusagent.agent.streaming import StreamingAgent
+from nimbusagent.testing.fake_openai import (
+    FakeResponse,
+    ScriptedResponder,
+)
+from nimbusagent.utils.cancellation import AskCancelled, CancellationToken
+from nimbusagent.utils.retry import RetryPolicy, classify_error, get_retry_after
+
+
+def status_error(status, headers=None, code=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    error_class = {
+        400: openai.BadRequestError,
+        429: openai.RateLimitError,
+        503: openai.InternalServerError,
+    }[status]
+    return error_class("error", response=response, body={"code": code})
+
+
+class TestRetry:
+    def test_classify_error(self):
+        assert classify_error(status_error(429)) == "rate_limit"
+        assert classify_error(status_error(429, code="insufficient_quota")) is None
+        assert classify_error(status_error(503)) == "server_error"
+        assert classify_error(status_error(400)) is None
+        assert classify_error(httpx.ReadError("reset")) == "connection"
+        assert classify_error(ValueError("bug")) is None
+
+    def test_get_retry_after(self):
+        assert get_retry_after(status_error(429, {"retry-after": "2"})) == 2.0
+        assert get_retry_after(status_error(429, {"retry-after-ms": "250"})) == 0.25
+        assert get_retry_after(status_error(429)) is None
+
+    def test_call_retries_transient_errors_within_budget(self):
+        sleeps = []
+        policy = RetryPolicy(max_retries=3, budget=5, sleep=sleeps.append)
+        retries = []
+        budget = policy.new_budget(lambda *args: retries.append(args))
+        errors = [status_error(429, {"retry-after": "1"}), status_error(503)]
+
+        def call():
+            if errors:
+                raise errors.pop(0)
+            return "ok"
+
+        assert budget.call("chat", call) == "ok"
+        assert sleeps[0] == 1.0 and 0 <= sleeps[1] <= 1.0
+        assert [args[:2] for args in retries] == [
+            ("chat", "rate_limit"),
+            ("chat", "server_error"),
+        ]
+
+        with pytest.raises(openai.BadRequestError):
+            budget.call("chat", lambda: (_ for _ in ()).throw(status_error(400)))
+
+        budget.remaining = 0.5
+        with pytest.raises(openai.RateLimitError):
+            budget.call(
+                "chat",
+                lambda: (_ for _ in ()).throw(status_error(429, {"retry-after": "1"})),
+            )
+        assert budget.retries == 2
+
+    def test_cancel_interrupts_the_wait(self):
+        policy = RetryPolicy(max_retries=1, budget=60)
+        cancellation = CancellationToken()
+        budget = policy.new_budget(cancellation=cancellation)
+        threading.Timer(0.05, cancellation.cancel).start()
+
+        start = time.monotonic()
+        with pytest.raises(AskCancelled):
+            budget.should_retry(
+                "chat", 0, status_error(429, {"retry-after": "30"}), max_retries=1
+            )
+        assert time.monotonic() - start < 5
+
+
+class TestAgentRetries:
+    @pytest.mark.parametrize("agent_class", [CompletionAgent, StreamingAgent])
+    def test_agents_retry_rate_limits(self, agent_class, fake_openai, make_agent):
+        responder = ScriptedResponder(
+            [FakeResponse(status=429, retry_after=0.01), "It is sunny today."]
+        )
+        server = fake_openai(responder)
+        agent = make_agent(agent_class, server, retry_policy=RetryPolicy(max_retries=1))
+        response = agent.ask("Hi")
+        if agent_class is StreamingAgent:
+            response = "".join(response)
+
+        assert response == "It is sunny today."
+        assert server.request_counts["/chat/completions"] == 2
+        assert agent.get_last_stats().retries == 1
+        assert agent.get_last_stats().retry_time == pytest.approx(0.01)
+
+    def test_cancel_while_waiting_to_retry_a_stream(self, fake_openai, make_agent):
+        responder = ScriptedResponder([FakeResponse(disconnect=True), "Too late."])
+        agents = []
+        policy = RetryPolicy(max_retries=1, sleep=lambda delay: agents[0].cancel())
+        agents.append(
+            make_agent(StreamingAgent, fake_openai(responder), retry_policy=policy)
+        )
+
+        assert "".join(agents[0].ask("Hi")) == ""
+        assert agents[0].get_last_stats().cancelled
+        assert agents[0].get_chat_history() == []
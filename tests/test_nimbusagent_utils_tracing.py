@@ -0,0 +1,80 @@
+import json
+import os
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from nimbusagent.utils.tracing import TraceCollector, NOOP_TRACE, NOOP_TRACER
+
+os.environ["OPENAI_API_KEY"] = "some key"
+
+
+class TestTracing:
+    def test_noop_tracer(self):
+        trace = NOOP_TRACER.start_trace("ask")
+        assert trace is NOOP_TRACE
+        with trace.span("moderation") as span:
+            span.set_attribute("key", "value")
+        NOOP_TRACER.finish_trace(trace)
+
+    def test_collector_records_spans(self):
+        collector = TraceCollector()
+        trace = collector.start_trace("ask", {"model": "gpt-4"})
+        with trace.span("moderation"):
+            pass
+        span = trace.span("tool", {"function": "get_weather"})
+        span.end()
+        collector.finish_trace(trace)
+
+        events = collector.get_traces()[0].to_chrome_trace()["traceEvents"]
+        assert [event["name"] for event in events] == ["moderation", "tool", "ask"]
+        assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+        assert events[1]["args"] == {"function": "get_weather"}
+        assert events[2]["args"] == {"model": "gpt-4"}
+
+    def test_span_records_errors(self):
+        collector = TraceCollector()
+        trace = collector.start_trace("ask")
+        try:
+            with trace.span("tool"):
+                raise RuntimeError("failed")
+        except RuntimeError:
+            pass
+        assert trace.events[0]["args"] == {"error": "RuntimeError"}
+
+    def test_sampling(self):
+        collector = TraceCollector(sample_rate=0.0)
+        assert collector.start_trace("ask") is NOOP_TRACE
+
+    def test_writes_trace_files(self, tmp_path):
+        collector = TraceCollector(output_dir=str(tmp_path))
+        collector.finish_trace(collector.start_trace("ask"))
+        files = list(tmp_path.iterdir())
+        assert len(files) == 1
+        assert json.loads(files[0].read_text())["traceEvents"][0]["name"] == "ask"
+
+        dump_path = tmp_path / "all.json"
+        collector.dump(str(dump_path))
+        assert len(json.loads(dump_path.read_text())["traceEvents"]) == 1
+
+    def test_agent_ask_is_traced(self, fake_encoding):
+        from nimbusagent.agent.completion import CompletionAgent
+
+        collector = TraceCollector()
+        agent = CompletionAgent(perform_moderation=False, tracer=collector)
+        message = SimpleNamespace(role="assistant", content="Hello!", tool_calls=None)
+        agent.client.chat.completions.create = MagicMock(
+            return_value=SimpleNamespace(
+                choices=[SimpleNamespace(finish_reason="stop", message=message)],
+                usage=None,
+            )
+        )
+
+        agent.ask("Hi")
+
+        names = [event["name"] for event in collector.get_traces()[0].events]
+        assert names == [
+            "get_functions_from_query_and_history",
+            "chat.completions.create",
+            "model_loop",
+            "ask",
+        ]